@@ -1,36 +1,50 @@
 # backend/app.py - FastAPI endpoints
+import asyncio
+import os
 from pathlib import Path
-from typing import Optional, List
-from collections import defaultdict, deque
+from typing import Optional, List, Dict
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, Response
 from pydantic import BaseModel, Field
-import httpx
 from contextlib import asynccontextmanager
 
-from utils import query_sparql, parse_point_wkt, parse_multilinestring_wkt, SPARQL_ENDPOINT
+from utils import parse_point_wkt, parse_multilinestring_wkt, close_client, SPARQL_ENDPOINT
+from sparql_stream import open_sparql_stream
+from queries import registry
+from health import health_monitor
+from metrics import MetricsMiddleware, metrics
+from network import ROUTE_MODES, network_store
+from responses import FastJSONResponse, PrecompressedStaticFiles, dumps, response_cache
 
 # Obtener la ruta absoluta del directorio frontend
 BASE_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_DIR = BASE_DIR / "frontend"
 RESOURCES_DIR = BASE_DIR / "resources"
+# Snapshots estáticos generados con `python snapshot.py`
+SNAPSHOT_DIR = FRONTEND_DIR / "snapshot"
+SNAPSHOT_MODE = os.environ.get("METRO_SNAPSHOT_MODE", "0") == "1"
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Código al iniciar
+    health_monitor.start()
+    await network_store.preload()
     yield
     # Código al cerrar (limpieza)
-    pass
+    await health_monitor.stop()
+    await close_client()
 
 
 app = FastAPI(
     title="Metro Barcelona API",
     description="API REST para consultar datos del metro de Barcelona mediante SPARQL",
     version="2.0.0",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -43,18 +57,45 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compresión del resto de respuestas (las cacheadas ya van precomprimidas)
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
+# Una recarga del dataset (en este worker o en otro) invalida las respuestas cacheadas
+network_store.on_change.append(response_cache.clear)
+
+# Métricas por ruta (el más externo: mide también la compresión y el tamaño final)
+app.add_middleware(MetricsMiddleware)
+
 # Modelos Pydantic
 class SparqlQueryRequest(BaseModel):
     query: str = Field(..., min_length=1, description="Consulta SPARQL")
     format: str = Field(
         default="application/sparql-results+json",
-        description="Formato de respuesta"
+        description="Formato de respuesta (JSON, text/csv, text/tab-separated-values o application/x-ndjson)"
+    )
+    max_rows: Optional[int] = Field(
+        default=None, gt=0,
+        description="Máximo de filas a devolver (CSV/TSV/NDJSON), limitado por la configuración del servidor"
+    )
+    max_bytes: Optional[int] = Field(
+        default=None, gt=0,
+        description="Máximo de bytes a devolver (CSV/TSV/NDJSON), limitado por la configuración del servidor"
     )
 
 class HealthResponse(BaseModel):
     backend: str
     sparql_endpoint: str
     sparql_status: str
+    last_check: Optional[str] = None
+    status_since: Optional[str] = None
+    consecutive_failures: int = 0
+    ping_ms: Optional[float] = None
+    ping_p50_ms: Optional[float] = None
+    query_count: int = 0
+    query_error_rate: Optional[float] = None
+    query_p50_ms: Optional[float] = None
+    query_p95_ms: Optional[float] = None
+    query_histogram: Dict[str, int] = {}
 
 class StationResponse(BaseModel):
     id: str
@@ -93,56 +134,31 @@ async def index():
 @app.post("/api/query")
 async def proxy_sparql(body: SparqlQueryRequest):
     """
-    Ejecuta una consulta SPARQL y devuelve los resultados
+    Ejecuta una consulta SPARQL y devuelve los resultados en streaming,
+    sin cargar la respuesta completa de Fuseki en memoria
     """
-    result = await query_sparql(body.query, body.format)
-    return result
+    stream = await open_sparql_stream(body.query, body.format, body.max_rows, body.max_bytes)
+    return StreamingResponse(
+        stream.body(),
+        media_type=stream.media_type,
+        headers=stream.headers
+    )
 
 
 @app.get("/api/health", response_model=HealthResponse)
 async def health_check():
-    """Verifica el estado del backend y del endpoint SPARQL"""
-    status = {
-        "backend": "ok",
-        "sparql_endpoint": SPARQL_ENDPOINT,
-        "sparql_status": "unknown"
-    }
-    
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.get(SPARQL_ENDPOINT.replace("/sparql", "/$/ping"))
-            status["sparql_status"] = "connected" if resp.status_code == 200 else "unreachable"
-    except:
-        status["sparql_status"] = "unreachable"
-    
-    return status
+    """
+    Estado del backend y del endpoint SPARQL según el último chequeo del
+    monitor en segundo plano, con las latencias de las consultas reales
+    """
+    return health_monitor.snapshot()
 
 
-@app.get("/api/stations", response_model=List[StationResponse])
-async def get_stations():
-    """Obtiene todas las estaciones con sus coordenadas y líneas"""
-    query = """
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    PREFIX geo: <http://www.opengis.net/ont/geosparql#>
-    
-    SELECT ?station ?name ?geometry
-           (GROUP_CONCAT(DISTINCT ?lineCode; separator=",") AS ?lines)
-    WHERE {
-      ?station rdf:type metro:Station .
-      ?station rdfs:label ?name .
-      OPTIONAL { ?station metro:hasGeometry ?geometry }
-      OPTIONAL { 
-        ?stationLine metro:relatesTo ?station .
-        ?stationLine metro:onLine ?line .
-        ?line metro:lineCode ?lineCode
-      }
-    }
-    GROUP BY ?station ?name ?geometry
-    """
-    
-    data = await query_sparql(query)
+# Construcción de las respuestas de solo lectura. Devuelven dicts/listas ya listos
+# para serializar: los datos vienen de nuestras propias consultas, así que no se
+# vuelven a validar con Pydantic elemento a elemento.
+async def build_stations() -> List[dict]:
+    data = await registry.execute("stations")
     
     stations = []
     for binding in data.get("results", {}).get("bindings", []):
@@ -150,90 +166,38 @@ async def get_stations():
         coords = parse_point_wkt(geometry_wkt)
         
         if coords:
-            station = StationResponse(
-                id=binding.get("station", {}).get("value", ""),
-                name=binding.get("name", {}).get("value", ""),
-                latitude=coords["lat"],
-                longitude=coords["lng"],
-                lines=binding.get("lines", {}).get("value", "").split(",") if binding.get("lines") else []
-            )
-            stations.append(station)
+            stations.append({
+                "id": binding.get("station", {}).get("value", ""),
+                "name": binding.get("name", {}).get("value", ""),
+                "latitude": coords["lat"],
+                "longitude": coords["lng"],
+                "lines": binding.get("lines", {}).get("value", "").split(",") if binding.get("lines") else []
+            })
     
     return stations
 
 
-@app.get("/api/lines", response_model=List[LineResponse])
-async def get_lines():
-    """Obtiene todas las líneas con información"""
-    query = """
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    
-    SELECT ?line ?lineCode ?lineName ?lineColor ?auxColor ?origin ?destination
-           (COUNT(DISTINCT ?station) AS ?numStations)
-    WHERE {
-      ?line rdf:type metro:MetroLine .
-      ?line metro:lineCode ?lineCode .
-      OPTIONAL { ?line metro:lineName ?lineName }
-      OPTIONAL { ?line metro:lineColor ?lineColor }
-      OPTIONAL { ?line metro:auxiliaryColor ?auxColor }
-      OPTIONAL { ?line metro:originStation ?origin }
-      OPTIONAL { ?line metro:destinationStation ?destination }
-      OPTIONAL {
-        ?stationLine metro:onLine ?line .
-        ?stationLine metro:relatesTo ?station
-      }
-    }
-    GROUP BY ?line ?lineCode ?lineName ?lineColor ?auxColor ?origin ?destination
-    ORDER BY ?lineCode
-    """
-    
-    data = await query_sparql(query)
+async def build_lines() -> List[dict]:
+    data = await registry.execute("lines")
     
     lines = []
     for binding in data.get("results", {}).get("bindings", []):
-        line = LineResponse(
-            id=binding.get("line", {}).get("value", ""),
-            code=str(binding.get("lineCode", {}).get("value", "")),
-            name=binding.get("lineName", {}).get("value", ""),
-            color="#" + binding.get("lineColor", {}).get("value", "999"),
-            auxColor=binding.get("auxColor", {}).get("value"),
-            origin=binding.get("origin", {}).get("value"),
-            destination=binding.get("destination", {}).get("value"),
-            numStations=int(binding.get("numStations", {}).get("value", 0))
-        )
-        lines.append(line)
+        lines.append({
+            "id": binding.get("line", {}).get("value", ""),
+            "code": str(binding.get("lineCode", {}).get("value", "")),
+            "name": binding.get("lineName", {}).get("value", ""),
+            "color": "#" + binding.get("lineColor", {}).get("value", "999"),
+            "auxColor": binding.get("auxColor", {}).get("value"),
+            "origin": binding.get("origin", {}).get("value"),
+            "destination": binding.get("destination", {}).get("value"),
+            "numStations": int(binding.get("numStations", {}).get("value", 0))
+        })
     
     return lines
 
 
-@app.get("/api/station/{station_id:path}")
-async def get_station_details(station_id: str):
-    """Obtiene detalles de una estación específica"""
-    from urllib.parse import unquote
-    station_uri = unquote(station_id)
-    
-    query = f"""
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    
-    SELECT ?name ?geometry ?inaugurated
-           (GROUP_CONCAT(DISTINCT ?lineCode; separator=",") AS ?lines)
-    WHERE {{
-      <{station_uri}> rdfs:label ?name .
-      OPTIONAL {{ <{station_uri}> metro:hasGeometry ?geometry }}
-      OPTIONAL {{ <{station_uri}> metro:inauguratedDate ?inaugurated }}
-      OPTIONAL {{ 
-        ?stationLine metro:relatesTo <{station_uri}> .
-        ?stationLine metro:onLine ?line .
-        ?line metro:lineCode ?lineCode
-      }}
-    }}
-    GROUP BY ?name ?geometry ?inaugurated
-    """
-    
-    data = await query_sparql(query)
+async def build_station_details(station_uri: str) -> dict:
+    data = await registry.execute("station_details", station=station_uri)
     
     bindings = data.get("results", {}).get("bindings", [])
     if not bindings:
@@ -243,7 +207,7 @@ async def get_station_details(station_id: str):
     geometry_wkt = binding.get("geometry", {}).get("value", "")
     coords = parse_point_wkt(geometry_wkt)
     
-    station = {
+    return {
         "id": station_uri,
         "name": binding.get("name", {}).get("value", ""),
         "latitude": coords["lat"] if coords else None,
@@ -251,29 +215,10 @@ async def get_station_details(station_id: str):
         "inaugurated": binding.get("inaugurated", {}).get("value", ""),
         "lines": binding.get("lines", {}).get("value", "").split(",") if binding.get("lines") else []
     }
-    
-    return station
 
 
-@app.get("/api/line-geometries")
-async def get_line_geometries():
-    """Obtiene las geometrías de todas las líneas desde MULTILINESTRING WKT"""
-    query = """
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    PREFIX geo: <http://www.opengis.net/ont/geosparql#>
-    
-    SELECT ?lineCode ?lineColor ?geometry
-    WHERE {
-      ?line rdf:type metro:MetroLine .
-      ?line metro:lineCode ?lineCode .
-      OPTIONAL { ?line metro:lineColor ?lineColor }
-      OPTIONAL { ?line metro:hasGeometry ?geometry }
-    }
-    ORDER BY ?lineCode
-    """
-    
-    data = await query_sparql(query)
+async def build_line_geometries() -> List[dict]:
+    data = await registry.execute("line_geometries")
     
     result = []
     for binding in data.get("results", {}).get("bindings", []):
@@ -295,33 +240,8 @@ async def get_line_geometries():
     return result
 
 
-@app.get("/api/line/{line_code}")
-async def get_line_details(line_code: str):
-    """Obtiene detalles de una línea específica incluyendo sus estaciones"""
-    query = f"""
-    PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    
-    SELECT ?line ?lineColor ?auxColor ?origin ?destination ?stationName ?order
-    WHERE {{
-      ?line rdf:type metro:MetroLine .
-      ?line metro:lineCode {line_code} .
-      OPTIONAL {{ ?line metro:lineColor ?lineColor }}
-      OPTIONAL {{ ?line metro:auxiliaryColor ?auxColor }}
-      OPTIONAL {{ ?line metro:originStation ?origin }}
-      OPTIONAL {{ ?line metro:destinationStation ?destination }}
-      OPTIONAL {{
-        ?stationLine metro:onLine ?line .
-        ?stationLine metro:relatesTo ?station .
-        ?stationLine metro:stationOrder ?order .
-        ?station rdfs:label ?stationName
-      }}
-    }}
-    ORDER BY ?order
-    """
-    
-    data = await query_sparql(query)
+async def build_line_details(line_code: str) -> dict:
+    data = await registry.execute("line_details", line_code=line_code)
     
     bindings = data.get("results", {}).get("bindings", [])
     if not bindings:
@@ -349,6 +269,108 @@ async def get_line_details(line_code: str):
     return line_info
 
 
+def normalize_network(stations: List[dict], lines: List[dict], geometries: List[dict]) -> dict:
+    """
+    Une estaciones, líneas y geometrías en un único payload normalizado: cada línea
+    aparece una vez (con su trazado como pares [lat, lng]) y las estaciones la
+    referencian por su posición en `lines` en lugar de repetir los códigos.
+    """
+    coordinates = {
+        g["code"]: [[c["lat"], c["lng"]] for c in g["coordinates"]] for g in geometries
+    }
+    line_index = {}
+    network_lines = []
+    for line in lines:
+        line_index[line["code"]] = len(network_lines)
+        network_lines.append({**line, "coordinates": coordinates.get(line["code"], [])})
+
+    network_stations = [
+        {
+            "id": station["id"],
+            "name": station["name"],
+            "latitude": station["latitude"],
+            "longitude": station["longitude"],
+            "lines": [line_index[code] for code in station["lines"] if code in line_index]
+        }
+        for station in stations
+    ]
+    return {"lines": network_lines, "stations": network_stations}
+
+
+async def build_network() -> dict:
+    # Las tres consultas se lanzan a la vez: el tiempo total es el de la más lenta
+    stations, lines, geometries = await asyncio.gather(
+        build_stations(), build_lines(), build_line_geometries()
+    )
+    return normalize_network(stations, lines, geometries)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Métricas en formato de texto de Prometheus"""
+    return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/stations", responses={200: {"model": List[StationResponse]}})
+async def get_stations(request: Request):
+    """Obtiene todas las estaciones con sus coordenadas y líneas"""
+    return await response_cache.respond(request, "stations", build_stations, List[StationResponse])
+
+
+@app.get("/api/lines", responses={200: {"model": List[LineResponse]}})
+async def get_lines(request: Request):
+    """Obtiene todas las líneas con información"""
+    return await response_cache.respond(request, "lines", build_lines, List[LineResponse])
+
+
+@app.get("/api/network")
+async def get_network(request: Request):
+    """
+    Estaciones, líneas y geometrías en una sola respuesta para arrancar el mapa
+    en un único viaje de ida y vuelta
+    """
+    return await response_cache.respond(request, "network", build_network)
+
+
+@app.get("/api/station/{station_id:path}")
+async def get_station_details(station_id: str, request: Request):
+    """Obtiene detalles de una estación específica"""
+    from urllib.parse import unquote
+    station_uri = unquote(station_id)
+    
+    return await response_cache.respond(
+        request, f"station/{station_uri}", lambda: build_station_details(station_uri)
+    )
+
+
+@app.get("/api/line-geometries")
+async def get_line_geometries(request: Request):
+    """Obtiene las geometrías de todas las líneas desde MULTILINESTRING WKT"""
+    return await response_cache.respond(request, "line-geometries", build_line_geometries)
+
+
+@app.get("/api/line/{line_code}")
+async def get_line_details(line_code: str, request: Request):
+    """Obtiene detalles de una línea específica incluyendo sus estaciones"""
+    return await response_cache.respond(
+        request, f"line/{line_code}", lambda: build_line_details(line_code)
+    )
+
+
+@app.get("/api/query-templates")
+async def get_query_templates():
+    """Plantillas SPARQL registradas con su texto canónico y estadísticas de latencia"""
+    return {
+        name: {
+            "params": template.params,
+            "cacheable": template.cacheable,
+            "query": template.text,
+            "stats": template.stats.summary()
+        }
+        for name, template in registry.templates.items()
+    }
+
+
 @app.get("/api/examples", response_model=List[ExampleQuery])
 async def get_examples():
     """Devuelve consultas SPARQL de ejemplo para el dominio de metro"""
@@ -464,160 +486,94 @@ async def get_examples():
     return examples
 
 
-@app.get("/api/route")
-async def find_route(origin: str = Query(...), destination: str = Query(...)):
+@app.get("/api/stations/search")
+async def search_stations(
+    q: str = Query(..., min_length=1, description="Nombre (o parte) de la estación"),
+    limit: int = Query(10, ge=1, le=50)
+):
     """
-    Encuentra la ruta más corta entre dos estaciones
+    Autocompletado de estaciones: por prefijo, sin distinguir acentos ni
+    mayúsculas y tolerando erratas. Devuelve el id a usar en /api/route.
     """
-    query = """
-    PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
-    PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
-    PREFIX geo: <http://www.opengis.net/ont/geosparql#>
-    
-    SELECT ?station ?stationName ?lineCode ?order ?lineGeometry ?stationGeometry
-    WHERE {
-      ?station a metro:Station ;
-               rdfs:label ?stationName .
-      ?accessPoint metro:relatesTo ?station ;
-                   metro:onLine ?line ;
-                   metro:stationOrder ?order .
-      ?line metro:lineCode ?lineCode .
-      OPTIONAL { ?line metro:hasGeometry ?lineGeometry }
-      OPTIONAL { ?station metro:hasGeometry ?stationGeometry }
-    }
-    ORDER BY ?lineCode ?order
+    network = await network_store.get()
+    return network.index.search(q, limit)
+
+
+@app.get("/api/route")
+async def find_route(
+    origin_id: Optional[str] = Query(None, description="URI de la estación origen"),
+    destination_id: Optional[str] = Query(None, description="URI de la estación destino"),
+    origin: Optional[str] = Query(None, description="Nombre de la estación origen"),
+    destination: Optional[str] = Query(None, description="Nombre de la estación destino"),
+    mode: str = Query("stations", description="Criterio: menos estaciones (stations) o menos transbordos (transfers)")
+):
     """
-    
-    data = await query_sparql(query)
-    
-    # Construir grafo y estructuras de datos
-    stations_by_name = defaultdict(list)
-    station_names = {}
-    station_coords = {}
-    station_lines = defaultdict(set)
-    line_stations = defaultdict(list)
-    line_geometries = {}
-    
-    for binding in data.get("results", {}).get("bindings", []):
-        station_uri = binding.get("station", {}).get("value", "")
-        station_name = binding.get("stationName", {}).get("value", "")
-        line_code = str(binding.get("lineCode", {}).get("value", ""))
-        order = int(binding.get("order", {}).get("value", 0))
-        line_geom = binding.get("lineGeometry", {}).get("value", "")
-        station_geom = binding.get("stationGeometry", {}).get("value", "")
-        
-        stations_by_name[station_name].append(station_uri)
-        station_names[station_uri] = station_name
-        station_lines[station_name].add(line_code)
-        line_stations[line_code].append((station_name, order, station_uri))
-        
-        if station_geom and station_uri not in station_coords:
-            coords = parse_point_wkt(station_geom)
-            if coords:
-                station_coords[station_uri] = (coords['lat'], coords['lng'])
-        
-        if line_geom and line_code not in line_geometries:
-            line_geometries[line_code] = line_geom
-    
+    Encuentra la ruta más corta entre dos estaciones, identificadas por su id
+    (ver /api/stations/search) o por su nombre
+    """
+    if not (origin_id or origin) or not (destination_id or destination):
+        raise HTTPException(status_code=400, detail="Indica origen y destino")
+    if mode not in ROUTE_MODES:
+        raise HTTPException(status_code=400, detail=f"Modo no válido, usa uno de {list(ROUTE_MODES)}")
+
+    network = await network_store.get()
+
     # Verificar que origen y destino existen
-    if origin not in stations_by_name:
-        return {"found": False, "error": f"Estación origen '{origin}' no encontrada"}
-    if destination not in stations_by_name:
-        return {"found": False, "error": f"Estación destino '{destination}' no encontrada"}
-    
-    # Construir grafo
-    graph = defaultdict(list)
-    
-    for line_code, stations in line_stations.items():
-        unique_stations = {}
-        for name, order, uri in stations:
-            if name not in unique_stations or order < unique_stations[name][0]:
-                unique_stations[name] = (order, uri)
-        
-        sorted_stations = sorted(unique_stations.items(), key=lambda x: x[1][0])
-        
-        for i in range(len(sorted_stations) - 1):
-            name1, _ = sorted_stations[i]
-            name2, _ = sorted_stations[i + 1]
-            graph[name1].append((name2, line_code))
-            graph[name2].append((name1, line_code))
-    
-    # BFS para encontrar ruta más corta
-    queue = deque([(origin, [origin], [])])
-    visited = {origin}
-    
-    while queue:
-        current, path, lines = queue.popleft()
-        
-        if current == destination:
-            # Construir respuesta
-            route_stations = []
-            route_segments = []
-            
-            for i, station_name in enumerate(path):
-                station_uri = stations_by_name[station_name][0]
-                route_stations.append({
-                    "name": station_name,
-                    "uri": station_uri
-                })
-                
-                if i < len(path) - 1:
-                    line_code = lines[i]
-                    next_station_name = path[i + 1]
-                    
-                    current_uri = station_uri
-                    next_uri = stations_by_name[next_station_name][0]
-                    
-                    current_coords = station_coords.get(current_uri)
-                    next_coords = station_coords.get(next_uri)
-                    
-                    segment_info = {
-                        "line_code": line_code,
-                        "from_station": station_name,
-                        "to_station": next_station_name
-                    }
-                    
-                    if line_code in line_geometries and current_coords and next_coords:
-                        segment_info["geometry"] = line_geometries[line_code]
-                        segment_info["from_coords"] = current_coords
-                        segment_info["to_coords"] = next_coords
-                    
-                    route_segments.append(segment_info)
-            
-            # Calcular transbordos
-            transfers = []
-            current_line = None
-            for i, line_code in enumerate(lines):
-                if current_line and current_line != line_code:
-                    transfers.append({
-                        "station": path[i],
-                        "from_line": current_line,
-                        "to_line": line_code
-                    })
-                current_line = line_code
-            
-            return {
-                "found": True,
-                "stations": route_stations,
-                "lines": lines,
-                "segments": route_segments,
-                "transfers": transfers,
-                "num_stations": len(route_stations),
-                "num_transfers": len(transfers)
-            }
-        
-        # Explorar vecinos
-        for neighbor, line_code in graph.get(current, []):
-            if neighbor not in visited:
-                visited.add(neighbor)
-                queue.append((neighbor, path + [neighbor], lines + [line_code]))
-    
+    origin_name = network.resolve(origin_id, origin)
+    if origin_name is None:
+        return {"found": False, "error": f"Estación origen '{origin_id or origin}' no encontrada",
+                "suggestions": network.index.search(origin, 5) if origin else []}
+    destination_name = network.resolve(destination_id, destination)
+    if destination_name is None:
+        return {"found": False,
+                "error": f"Estación destino '{destination_id or destination}' no encontrada",
+                "suggestions": network.index.search(destination, 5) if destination else []}
+
+    # Las rutas ya calculadas se sirven tal cual; la versión del dataset en la
+    # clave evita servir rutas de una red que ya se ha recargado
+    key = (origin_name, destination_name, mode, network.version)
+    body = network_store.routes.get(key)
+    if body is None:
+        body = dumps(network.shortest_route(origin_name, destination_name, mode))
+        network_store.routes.put(key, body)
+    return Response(body, media_type="application/json")
+
+
+@app.get("/api/route/cache")
+async def get_route_cache():
+    """Estado de la caché de rutas: tamaño, aciertos, fallos y versión del dataset"""
+    stats = network_store.routes.stats()
+    stats["dataset_version"] = network_store.network.version if network_store.network else None
+    return stats
+
+
+@app.post("/api/reload")
+async def reload_dataset():
+    """
+    Vuelve a leer la red desde Fuseki tras recargar el RDF. Si el dataset ha
+    cambiado se invalidan las rutas y las respuestas cacheadas. Con varios
+    workers el resto adopta la nueva imagen compartida en el siguiente acceso.
+    """
+    previous = network_store.network.version if network_store.network else None
+    network = await network_store.reload()
+    response_cache.clear()
     return {
-        "found": False,
-        "error": "No se encontró ruta entre las estaciones"
+        "previous_version": previous,
+        "dataset_version": network.version,
+        "changed": previous != network.version,
+        "stations": len(network.index),
     }
 
 
+# Snapshots del mapa: solo se publican en modo snapshot (si no, el mapa usa la API)
+if SNAPSHOT_MODE:
+    SNAPSHOT_DIR.mkdir(exist_ok=True)
+    app.mount("/snapshot", PrecompressedStaticFiles(directory=str(SNAPSHOT_DIR)), name="snapshot")
+else:
+    @app.get("/snapshot/{path:path}", include_in_schema=False)
+    async def snapshot_disabled(path: str):
+        raise HTTPException(status_code=404, detail="Modo snapshot desactivado")
+
 # Servir archivos de recursos (documentación)
 app.mount("/resources", StaticFiles(directory=str(RESOURCES_DIR), html=True), name="resources")
 
@@ -631,4 +587,14 @@ if __name__ == "__main__":
     print(f"📍 Backend: http://localhost:8000")
     print(f"📚 API Docs: http://localhost:8000/docs")
     print(f"🔗 SPARQL Endpoint: {SPARQL_ENDPOINT}")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if SNAPSHOT_MODE:
+        print(f"📸 Modo snapshot: {SNAPSHOT_DIR}")
+    workers = int(os.environ.get("METRO_WORKERS", "1"))
+    if workers > 1:
+        # Los workers comparten la red mapeando el mismo fichero (ver network_image.py)
+        import tempfile
+        os.environ.setdefault("METRO_SHARED_DIR", str(Path(tempfile.gettempdir()) / "metro-network"))
+        print(f"👥 {workers} workers, red compartida en {os.environ['METRO_SHARED_DIR']}")
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
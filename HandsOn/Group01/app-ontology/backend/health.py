@@ -0,0 +1,145 @@
+# backend/health.py - Monitor en segundo plano del estado del endpoint SPARQL
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+import httpx
+
+from utils import SPARQL_ENDPOINT, get_client, query_listeners
+
+HEALTH_INTERVAL = float(os.environ.get("SPARQL_HEALTH_INTERVAL", "10"))
+HEALTH_TIMEOUT = 5.0
+# Límites superiores (ms) de las cubetas del histograma de latencias
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _percentile(samples, p: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 2)
+
+
+def _histogram(samples) -> Dict[str, int]:
+    counts = {f"le_{bucket}ms": 0 for bucket in LATENCY_BUCKETS_MS}
+    counts["inf"] = 0
+    for seconds in samples:
+        ms = seconds * 1000
+        for bucket in LATENCY_BUCKETS_MS:
+            if ms <= bucket:
+                counts[f"le_{bucket}ms"] += 1
+                break
+        else:
+            counts["inf"] += 1
+    return counts
+
+
+class HealthMonitor:
+    """
+    Comprueba Fuseki cada `interval` segundos y guarda el último estado, junto
+    con las latencias recientes del ping y de las consultas reales de la API.
+    /api/health solo lee este estado, sin hacer ninguna petición.
+    """
+
+    def __init__(self, interval: float = HEALTH_INTERVAL, window: int = 1000):
+        self.interval = interval
+        self.status = "unknown"
+        self.last_check: Optional[float] = None
+        self.last_change: Optional[float] = None
+        self.consecutive_failures = 0
+        self.ping_latencies = deque(maxlen=120)
+        self.query_latencies = deque(maxlen=window)
+        self.query_errors = deque(maxlen=window)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ping_url(self) -> str:
+        return SPARQL_ENDPOINT.replace("/sparql", "/$/ping")
+
+    def record_query(self, seconds: float, ok: bool, shared: bool = False):
+        """Listener de utils.query_sparql: latencia de cada consulta real"""
+        self.query_latencies.append(seconds)
+        self.query_errors.append(not ok)
+
+    def _set_status(self, status: str):
+        if status != self.status:
+            self.status = status
+            self.last_change = time.time()
+
+    async def probe(self):
+        start = time.perf_counter()
+        try:
+            resp = await get_client().get(self.ping_url, timeout=HEALTH_TIMEOUT)
+            up = resp.status_code == 200
+        except httpx.HTTPError:
+            up = False
+        self.last_check = time.time()
+
+        if up:
+            self.ping_latencies.append(time.perf_counter() - start)
+            self.consecutive_failures = 0
+            self._set_status("connected")
+        else:
+            self._mark_unreachable()
+
+    def _mark_unreachable(self):
+        self.last_check = time.time()
+        self.consecutive_failures += 1
+        self._set_status("unreachable")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.probe()
+            except Exception as e:
+                # Un fallo inesperado no puede parar el monitor y dejar el último estado fijo
+                print(f"⚠️  Comprobación de Fuseki fallida: {e!r}")
+                self._mark_unreachable()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.record_query not in query_listeners:
+            query_listeners.append(self.record_query)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.record_query in query_listeners:
+            query_listeners.remove(self.record_query)
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        def iso(timestamp):
+            if timestamp is None:
+                return None
+            return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="seconds")
+
+        queries = list(self.query_latencies)
+        errors = sum(self.query_errors)
+        return {
+            "backend": "ok",
+            "sparql_endpoint": SPARQL_ENDPOINT,
+            "sparql_status": self.status,
+            "last_check": iso(self.last_check),
+            "status_since": iso(self.last_change),
+            "consecutive_failures": self.consecutive_failures,
+            "ping_ms": round(self.ping_latencies[-1] * 1000, 2) if self.ping_latencies else None,
+            "ping_p50_ms": _percentile(self.ping_latencies, 0.50),
+            "query_count": len(queries),
+            "query_error_rate": round(errors / len(self.query_errors), 4) if self.query_errors else None,
+            "query_p50_ms": _percentile(queries, 0.50),
+            "query_p95_ms": _percentile(queries, 0.95),
+            "query_histogram": _histogram(queries),
+        }
+
+
+health_monitor = HealthMonitor()
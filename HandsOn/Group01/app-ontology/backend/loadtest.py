@@ -0,0 +1,449 @@
+# backend/loadtest.py - Banco de pruebas de carga con un Fuseki simulado
+#
+# Uso:
+#   python loadtest.py record                  # graba respuestas desde ../../rdf/metro-with-links.ttl (rdflib)
+#   python loadtest.py record --source http://localhost:3030/dataset/sparql
+#   python loadtest.py run --sessions 200 --concurrency 20 --latency-ms 30
+#   python loadtest.py stub --port 3131        # solo el Fuseki simulado
+#
+# `run` arranca el Fuseki simulado y el backend (uvicorn) en subprocesos, simula
+# sesiones de map.js (carga de la red con /api/network, clics en estaciones y
+# líneas, rutas aleatorias) y muestra throughput, latencias y memoria por endpoint.
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, quote
+
+import httpx
+
+from queries import canonicalize, registry
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DEFAULT_RECORDINGS = BACKEND_DIR / "loadtest-recordings.json"
+DEFAULT_SOURCE = BACKEND_DIR.parent.parent / "rdf" / "metro-with-links.ttl"
+EMPTY_RESULT = b'{"head":{"vars":[]},"results":{"bindings":[]}}'
+
+
+# --- Grabación de respuestas -------------------------------------------------
+
+def _runner(source: str):
+    """Devuelve una función query -> resultado JSON, contra un endpoint o un fichero RDF"""
+    if source.startswith("http://") or source.startswith("https://"):
+        client = httpx.Client(timeout=60.0)
+
+        def run(query: str) -> Dict[str, Any]:
+            resp = client.get(source, params={"query": query},
+                              headers={"Accept": "application/sparql-results+json"})
+            resp.raise_for_status()
+            return resp.json()
+        return run
+
+    from rdflib import Graph  # solo hace falta para grabar desde un fichero
+
+    graph = Graph()
+    graph.parse(source)
+
+    def run(query: str) -> Dict[str, Any]:
+        return json.loads(graph.query(query).serialize(format="json"))
+    return run
+
+
+def record(source: str, output: Path):
+    """Ejecuta todas las plantillas de queries.py y guarda sus respuestas por texto de consulta"""
+    run = _runner(source)
+    recordings = {}
+
+    def save(name: str, **params) -> Dict[str, Any]:
+        query = registry.get(name).bind(**params)
+        recordings[query] = run(query)
+        return recordings[query]
+
+    for name, template in registry.templates.items():
+        if not template.params:
+            save(name)
+
+    stations = recordings[registry.get("stations").bind()]["results"]["bindings"]
+    for binding in stations:
+        save("station_details", station=binding["station"]["value"])
+
+    lines = recordings[registry.get("lines").bind()]["results"]["bindings"]
+    for binding in lines:
+        save("line_details", line_code=binding["lineCode"]["value"])
+
+    output.write_text(json.dumps(recordings, ensure_ascii=False), encoding="utf-8")
+    print(f"💾 {len(recordings)} respuestas grabadas en {output}")
+
+
+# --- Fuseki simulado ---------------------------------------------------------
+
+class StubSparqlApp:
+    """
+    Aplicación ASGI que imita a Fuseki: responde a /$/ping y a /<dataset>/sparql
+    con la respuesta grabada para esa consulta, tras una latencia configurable.
+    """
+
+    def __init__(self, recordings: Dict[str, Any], latency: float, jitter: float):
+        self.responses = {
+            canonicalize(query): json.dumps(result).encode("utf-8")
+            for query, result in recordings.items()
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.misses = 0
+
+    async def _send(self, send, status: int, body: bytes, content_type: str):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()),
+                        (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        if path.endswith("/$/ping"):
+            await self._send(send, 200, b"ok", "text/plain")
+            return
+        if not path.endswith("/sparql"):
+            await self._send(send, 404, b"not found", "text/plain")
+            return
+
+        params = parse_qs(scope.get("query_string", b"").decode("utf-8"))
+        query = canonicalize(params.get("query", [""])[0])
+        body = self.responses.get(query)
+        if body is None:
+            self.misses += 1
+            body = EMPTY_RESULT
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._send(send, 200, body, "application/sparql-results+json")
+
+
+def serve_stub(recordings_path: Path, port: int, latency_ms: float, jitter_ms: float):
+    import uvicorn
+
+    recordings = json.loads(recordings_path.read_text(encoding="utf-8"))
+    app = StubSparqlApp(recordings, latency_ms / 1000, jitter_ms / 1000)
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+
+
+# --- Generador de carga ------------------------------------------------------
+
+def read_rss(pid: int) -> Optional[int]:
+    """Memoria residente (bytes) de un proceso; solo en Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class LoadResults:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.bytes: Dict[str, int] = defaultdict(int)
+        self.memory: Dict[str, Dict[str, int]] = {}
+        # Duración propia de cada endpoint cuando se carga por separado (isolate)
+        self.walls: Dict[str, float] = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool, size: int):
+        self.latencies[endpoint].append(seconds)
+        self.bytes[endpoint] += size
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def report(self, wall_seconds: Optional[float] = None) -> Dict[str, Any]:
+        report = {}
+        # Un endpoint puede tener solo medidas de memoria
+        for endpoint in sorted(set(self.latencies) | set(self.memory)):
+            row: Dict[str, Any] = {}
+            values = self.latencies.get(endpoint)
+            if values:
+                wall = self.walls.get(endpoint, wall_seconds)
+                row.update({
+                    "requests": len(values),
+                    "errors": self.errors[endpoint],
+                    "rps": round(len(values) / wall, 1) if wall else None,
+                    "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                    "max_ms": round(max(values) * 1000, 2),
+                    "avg_kb": round(self.bytes[endpoint] / len(values) / 1024, 1),
+                })
+            row.update(self.memory.get(endpoint, {}))
+            report[endpoint] = row
+        return report
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, results: LoadResults, clicks: int, routes: int):
+        self.base_url = base_url
+        self.results = results
+        self.clicks = clicks
+        self.routes = routes
+        self.stations: List[Dict[str, Any]] = []
+        self.line_codes: List[str] = []
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, url: str):
+        start = time.perf_counter()
+        ok = False
+        size = 0
+        try:
+            resp = await client.get(url)
+            size = len(resp.content)
+            ok = resp.status_code < 400
+        except httpx.HTTPError:
+            pass
+        self.results.add(endpoint, time.perf_counter() - start, ok, size)
+
+    async def prepare(self, client: httpx.AsyncClient):
+        self.stations = (await client.get("/api/stations")).json()
+        self.line_codes = [line["code"] for line in (await client.get("/api/lines")).json()]
+        if not self.stations:
+            raise RuntimeError("El backend no devolvió estaciones: ¿faltan grabaciones?")
+
+    def station_click(self):
+        station = random.choice(self.stations)
+        return "/api/station/{id}", f"/api/station/{quote(station['id'], safe='')}"
+
+    def line_click(self):
+        return "/api/line/{code}", f"/api/line/{random.choice(self.line_codes)}"
+
+    def route(self):
+        origin, destination = random.sample(self.stations, 2)
+        return "/api/route", (f"/api/route?origin={quote(origin['name'])}"
+                              f"&destination={quote(destination['name'])}")
+
+    async def session(self, client: httpx.AsyncClient):
+        """Una visita a map.html: carga inicial y algunas interacciones"""
+        await self.request(client, "/api/network", "/api/network")
+        actions = ([self.station_click] * self.clicks + [self.line_click]
+                   + [self.route] * self.routes)
+        random.shuffle(actions)
+        for action in actions:
+            await self.request(client, *action())
+
+    async def run_sessions(self, sessions: int, concurrency: int):
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency * 2)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60.0, limits=limits) as client:
+            async def bounded():
+                async with semaphore:
+                    await self.session(client)
+            await asyncio.gather(*(bounded() for _ in range(sessions)))
+
+    async def isolate(self, pid: int, requests: int, concurrency: int) -> LoadResults:
+        """
+        Carga cada endpoint por separado para atribuirle el crecimiento de memoria;
+        devuelve sus latencias y memoria, aparte de las de las sesiones
+        """
+        builders = {
+            "/api/network": lambda: ("/api/network", "/api/network"),
+            "/api/stations": lambda: ("/api/stations", "/api/stations"),
+            "/api/lines": lambda: ("/api/lines", "/api/lines"),
+            "/api/line-geometries": lambda: ("/api/line-geometries", "/api/line-geometries"),
+            "/api/station/{id}": self.station_click,
+            "/api/line/{code}": self.line_click,
+            "/api/route": self.route,
+        }
+        isolated = LoadResults()
+        generator = LoadGenerator(self.base_url, isolated, 0, 0)
+        semaphore = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=60.0) as client:
+            for endpoint, build in builders.items():
+                before = read_rss(pid)
+                sampler = RssSampler(pid)
+                sampler.start()
+                start = time.perf_counter()
+
+                async def one():
+                    async with semaphore:
+                        await generator.request(client, *build())
+                await asyncio.gather(*(one() for _ in range(requests)))
+                isolated.walls[endpoint] = time.perf_counter() - start
+                peak = await sampler.stop()
+                after = read_rss(pid)
+                if before is not None:
+                    isolated.memory[endpoint] = {
+                        "rss_delta_kb": (after - before) // 1024,
+                        "rss_peak_delta_kb": (peak - before) // 1024,
+                    }
+        return isolated
+
+
+class RssSampler:
+    """Muestrea la memoria del backend mientras dura la carga"""
+
+    def __init__(self, pid: int, interval: float = 0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = read_rss(pid) or 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, read_rss(self.pid) or 0)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> int:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return self.peak
+
+
+async def wait_ready(url: str, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} no respondió en {timeout:.0f}s")
+
+
+def print_table(report: Dict[str, Any]):
+    columns = ["requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "max_ms", "avg_kb",
+               "rss_delta_kb", "rss_peak_delta_kb"]
+    columns = [c for c in columns if any(c in row for row in report.values())]
+    print(f"\n{'endpoint':<24}" + "".join(f"{c:>18}" for c in columns))
+    for endpoint, row in report.items():
+        print(f"{endpoint:<24}" + "".join(f"{str(row.get(c, '')):>18}" for c in columns))
+
+
+def print_report(report: Dict[str, Any], wall: float, sessions: int, peak_rss: Optional[int],
+                 isolated: Optional[Dict[str, Any]] = None, isolated_requests: int = 0):
+    print(f"\n🚇 {sessions} sesiones en {wall:.2f}s ({sessions / wall:.1f} sesiones/s)")
+    if peak_rss:
+        print(f"🧠 Memoria máxima del backend: {peak_rss / 1024 / 1024:.1f} MB")
+    print_table(report)
+    if isolated:
+        print(f"\n🔬 Endpoints aislados ({isolated_requests} peticiones cada uno)")
+        print_table(isolated)
+
+
+async def run_load(args):
+    recordings = Path(args.recordings)
+    if not recordings.exists():
+        record(str(DEFAULT_SOURCE), recordings)
+
+    env = dict(os.environ, SPARQL_ENDPOINT=f"http://127.0.0.1:{args.stub_port}/dataset/sparql")
+    if args.no_cache:
+        env.update(SPARQL_CACHE_TTL="0", RESPONSE_CACHE_TTL="0")
+
+    stub = subprocess.Popen([
+        sys.executable, __file__, "stub", "--port", str(args.stub_port),
+        "--recordings", str(recordings),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+    ], cwd=BACKEND_DIR)
+    backend = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+        "--port", str(args.port), "--log-level", "warning", "--no-access-log",
+    ], cwd=BACKEND_DIR, env=env)
+
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        await wait_ready(f"http://127.0.0.1:{args.stub_port}/dataset/$/ping")
+        await wait_ready(f"{base_url}/api/health")
+
+        results = LoadResults()
+        generator = LoadGenerator(base_url, results, args.clicks, args.routes)
+        async with httpx.AsyncClient(base_url=base_url, timeout=60.0) as client:
+            await generator.prepare(client)
+
+        sampler = RssSampler(backend.pid)
+        sampler.start()
+        start = time.perf_counter()
+        await generator.run_sessions(args.sessions, args.concurrency)
+        wall = time.perf_counter() - start
+        peak_rss = await sampler.stop()
+
+        isolated = None
+        if args.isolate:
+            isolated = (await generator.isolate(backend.pid, args.isolate, args.concurrency)).report()
+
+        report = results.report(wall)
+        print_report(report, wall, args.sessions, peak_rss, isolated, args.isolate)
+        if args.json:
+            Path(args.json).write_text(json.dumps({
+                "sessions": args.sessions, "concurrency": args.concurrency,
+                "latency_ms": args.latency_ms, "wall_seconds": round(wall, 3),
+                "peak_rss_bytes": peak_rss, "endpoints": report, "isolated": isolated,
+            }, indent=2), encoding="utf-8")
+    finally:
+        for process in (backend, stub):
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pruebas de carga del backend del metro")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="Graba las respuestas de cada consulta de queries.py")
+    rec.add_argument("--source", default=str(DEFAULT_SOURCE),
+                     help="Endpoint SPARQL o fichero RDF (por defecto el TTL del grupo)")
+    rec.add_argument("--out", default=str(DEFAULT_RECORDINGS))
+
+    stub = sub.add_parser("stub", help="Arranca solo el Fuseki simulado")
+    stub.add_argument("--port", type=int, default=3131)
+    stub.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    stub.add_argument("--latency-ms", type=float, default=20.0)
+    stub.add_argument("--jitter-ms", type=float, default=10.0)
+
+    run = sub.add_parser("run", help="Lanza la prueba de carga completa")
+    run.add_argument("--sessions", type=int, default=100)
+    run.add_argument("--concurrency", type=int, default=10)
+    run.add_argument("--clicks", type=int, default=3, help="Clics en estaciones por sesión")
+    run.add_argument("--routes", type=int, default=1, help="Rutas calculadas por sesión")
+    run.add_argument("--latency-ms", type=float, default=20.0, help="Latencia inyectada en Fuseki")
+    run.add_argument("--jitter-ms", type=float, default=10.0)
+    run.add_argument("--port", type=int, default=8100)
+    run.add_argument("--stub-port", type=int, default=3131)
+    run.add_argument("--recordings", default=str(DEFAULT_RECORDINGS))
+    run.add_argument("--no-cache", action="store_true", help="Desactiva las cachés del backend")
+    run.add_argument("--isolate", type=int, default=0, metavar="N",
+                     help="Después, N peticiones por endpoint aislado para medir memoria")
+    run.add_argument("--json", help="Guarda el informe en este fichero")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args.source, Path(args.out))
+    elif args.command == "stub":
+        serve_stub(Path(args.recordings), args.port, args.latency_ms, args.jitter_ms)
+    else:
+        asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
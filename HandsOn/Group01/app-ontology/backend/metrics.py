@@ -0,0 +1,212 @@
+# backend/metrics.py - Métricas por ruta en formato de texto de Prometheus
+import time
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from fastapi.staticfiles import StaticFiles
+
+from utils import query_listeners
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class RequestTiming:
+    """Tiempos acumulados durante una petición, rellenados por los hooks de instrumentación"""
+    __slots__ = ("sparql_seconds", "sparql_queries", "serialize_seconds", "cache")
+
+    def __init__(self):
+        self.sparql_seconds = 0.0
+        self.sparql_queries = 0
+        self.serialize_seconds = 0.0
+        # (caché, acierto) -> número de accesos
+        self.cache: Dict[Tuple[str, bool], int] = {}
+
+
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("metro_request_timing", default=None)
+
+
+def record_sparql(seconds: float, ok: bool, shared: bool = False):
+    """Listener de utils.query_sparql: suma el tiempo de espera a Fuseki a la petición actual"""
+    timing = _current.get()
+    if timing is not None:
+        timing.sparql_seconds += seconds
+        if not shared:
+            timing.sparql_queries += 1
+        # Consultas resueltas uniéndose a otra idéntica en curso
+        record_cache("coalesce", shared)
+
+
+def record_serialize(seconds: float):
+    timing = _current.get()
+    if timing is not None:
+        timing.serialize_seconds += seconds
+
+
+def record_cache(cache: str, hit: bool):
+    timing = _current.get()
+    if timing is not None:
+        timing.cache[(cache, hit)] = timing.cache.get((cache, hit), 0) + 1
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for name, value in labels:
+        value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [contadores por cubeta, suma, total]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+                break
+        entry[1] += value
+        entry[2] += 1
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                yield f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(labels)} {count}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.requests = Counter(
+            "metro_http_requests_total", "Peticiones HTTP por ruta, método y código")
+        self.duration = Histogram(
+            "metro_http_request_duration_seconds", "Duración total de la petición", DURATION_BUCKETS)
+        self.sparql = Histogram(
+            "metro_http_sparql_wait_seconds", "Tiempo esperando a Fuseki dentro de la petición",
+            DURATION_BUCKETS)
+        self.serialize = Histogram(
+            "metro_http_serialize_seconds", "Tiempo serializando el cuerpo JSON", DURATION_BUCKETS)
+        self.processing = Histogram(
+            "metro_http_processing_seconds",
+            "Tiempo de Python fuera de SPARQL y serialización (post-procesado de bindings)",
+            DURATION_BUCKETS)
+        self.response_size = Histogram(
+            "metro_http_response_size_bytes", "Tamaño del cuerpo enviado", SIZE_BUCKETS)
+        self.sparql_queries = Counter(
+            "metro_sparql_queries_total", "Consultas SPARQL lanzadas por ruta")
+        self.cache = Counter(
+            "metro_cache_requests_total", "Accesos a caché por ruta, caché y resultado")
+
+    def observe_request(self, route: str, method: str, status: int, seconds: float,
+                        size: int, timing: RequestTiming):
+        labels = (("route", route), ("method", method))
+        self.requests.inc(labels + (("status", str(status)),))
+        self.duration.observe(labels, seconds)
+        self.sparql.observe(labels, timing.sparql_seconds)
+        self.serialize.observe(labels, timing.serialize_seconds)
+        self.processing.observe(
+            labels, max(0.0, seconds - timing.sparql_seconds - timing.serialize_seconds))
+        self.response_size.observe(labels, size)
+        if timing.sparql_queries:
+            self.sparql_queries.inc((("route", route),), timing.sparql_queries)
+        for (cache, hit), count in timing.cache.items():
+            self.cache.inc((("route", route), ("cache", cache),
+                            ("result", "hit" if hit else "miss")), count)
+
+    def expose(self) -> str:
+        lines = []
+        for metric in (self.requests, self.duration, self.sparql, self.serialize,
+                       self.processing, self.response_size, self.sparql_queries, self.cache):
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+query_listeners.append(record_sparql)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    # Ficheros estáticos y rutas no encontradas: se agrupan para no disparar la cardinalidad
+    return "static" if isinstance(scope.get("endpoint"), StaticFiles) else "other"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide cada petición: duración total, tiempo en SPARQL,
+    serialización, tamaño de la respuesta y aciertos de caché por ruta.
+    Se mide hasta el último trozo del cuerpo, así que cubre también el streaming.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = _current.set(timing)
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            metrics.observe_request(
+                _route_label(scope), scope["method"], status,
+                time.perf_counter() - start, size, timing
+            )
@@ -0,0 +1,341 @@
+# backend/network.py - Red de metro precalculada para el buscador de rutas
+import asyncio
+import heapq
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from metrics import record_cache
+from network_image import (NetworkImage, build_image, build_lock, current_image_path, map_image,
+                           publish_image)
+from queries import registry
+from search import StationSearchIndex
+
+ROUTE_CACHE_SIZE = int(os.environ.get("METRO_ROUTE_CACHE_SIZE", "1024"))
+# Directorio de la imagen compartida entre workers (vacío: cada proceso la tiene en memoria)
+SHARED_DIR = os.environ.get("METRO_SHARED_DIR", "")
+# Cada cuánto comprueba un worker si otro ha publicado una imagen nueva
+SHARED_CHECK_INTERVAL = 1.0
+# Lecturas del puntero `current` si su imagen desaparece antes de mapearla
+MAP_ATTEMPTS = 3
+# Modos de cálculo: menos estaciones o menos transbordos
+ROUTE_MODES = ("stations", "transfers")
+
+
+class RouteNetwork:
+    """
+    Buscador de rutas sobre una imagen de la red (ver network_image): las
+    estaciones son índices enteros y los vecinos se leen de los arrays de la
+    imagen, sin copiarlos. Los nodos son nombres de estación (una misma
+    estación tiene una URI por cada línea).
+    """
+
+    def __init__(self, image: NetworkImage):
+        self.image = image
+        self.version = image.version
+
+    @classmethod
+    def from_bindings(cls, bindings: List[Dict[str, Any]]) -> "RouteNetwork":
+        return cls(NetworkImage(build_image(bindings)))
+
+    @cached_property
+    def index(self) -> StationSearchIndex:
+        # Se construye en cada proceso: son unos pocos KB frente a la imagen compartida
+        img = self.image
+        return StationSearchIndex(
+            {"name": img.names[node], "ids": self._uris(node), "lines": self._lines(node)}
+            for node in range(len(img))
+        )
+
+    def _uris(self, node: int) -> List[str]:
+        img = self.image
+        start, end = img.node_uri_offsets[node], img.node_uri_offsets[node + 1]
+        return [img.uris[i] for i in img.node_uris[start:end]]
+
+    def _lines(self, node: int) -> List[str]:
+        img = self.image
+        start, end = img.node_line_offsets[node], img.node_line_offsets[node + 1]
+        return [img.line_codes[i] for i in img.node_lines[start:end]]
+
+    def _neighbors(self, node: int):
+        img = self.image
+        start, end = img.adj_offsets[node], img.adj_offsets[node + 1]
+        return zip(img.adj_targets[start:end], img.adj_lines[start:end])
+
+    def _coords(self, node: int) -> Optional[Tuple[float, float]]:
+        lat, lng = self.image.coords[2 * node], self.image.coords[2 * node + 1]
+        return None if math.isnan(lat) else (lat, lng)
+
+    def resolve(self, station_id: Optional[str], name: Optional[str]) -> Optional[int]:
+        """Estación (nodo del grafo) a partir de su URI o de su nombre"""
+        img = self.image
+        if station_id:
+            uri = img.uris.find(station_id)
+            return img.uri_nodes[uri] if uri is not None else None
+        if name:
+            node = img.names.find(name)
+            if node is not None:
+                return node
+            entry = self.index.by_name(name)
+            if entry is not None:
+                return self.resolve(entry["id"], None)
+        return None
+
+    def shortest_route(self, origin: int, destination: int, mode: str = "stations") -> Dict[str, Any]:
+        """Ruta entre dos nodos ya resueltos según el modo (ver ROUTE_MODES)"""
+        if mode == "transfers":
+            found = self._fewest_transfers(origin, destination)
+        else:
+            found = self._fewest_stations(origin, destination)
+        if found is None:
+            return {
+                "found": False,
+                "error": "No se encontró ruta entre las estaciones"
+            }
+        return self._describe(*found)
+
+    def _fewest_stations(self, origin: int, destination: int):
+        """BFS por número de estaciones"""
+        queue = deque([(origin, [origin], [])])
+        visited = {origin}
+
+        while queue:
+            current, path, lines = queue.popleft()
+
+            if current == destination:
+                return path, lines
+
+            # Explorar vecinos
+            for neighbor, line in self._neighbors(current):
+                if neighbor not in visited:
+                    visited.add(neighbor)
+                    queue.append((neighbor, path + [neighbor], lines + [line]))
+        return None
+
+    def _fewest_transfers(self, origin: int, destination: int):
+        """Dijkstra sobre (estación, línea) con coste (transbordos, estaciones)"""
+        if origin == destination:
+            return [origin], []
+        heap = [(0, 0, origin, -1, (origin,), ())]
+        best: Dict[Tuple[int, int], Tuple[int, int]] = {}
+
+        while heap:
+            transfers, hops, current, line, path, lines = heapq.heappop(heap)
+            if current == destination:
+                return list(path), list(lines)
+            if best.get((current, line), (transfers + 1, 0)) <= (transfers, hops):
+                continue
+            best[(current, line)] = (transfers, hops)
+
+            for neighbor, next_line in self._neighbors(current):
+                if neighbor in path:
+                    continue
+                cost = transfers + (1 if line >= 0 and next_line != line else 0)
+                heapq.heappush(heap, (cost, hops + 1, neighbor, next_line,
+                                      path + (neighbor,), lines + (next_line,)))
+        return None
+
+    def _describe(self, path: List[int], lines: List[int]) -> Dict[str, Any]:
+        img = self.image
+        names = [img.names[node] for node in path]
+        line_codes = [img.line_codes[line] for line in lines]
+        route_stations = []
+        route_segments = []
+
+        for i, station_name in enumerate(names):
+            station_uri = img.uris[img.node_uris[img.node_uri_offsets[path[i]]]]
+            route_stations.append({
+                "name": station_name,
+                "uri": station_uri
+            })
+
+            if i < len(path) - 1:
+                line_code = line_codes[i]
+                current_coords = self._coords(path[i])
+                next_coords = self._coords(path[i + 1])
+
+                segment_info = {
+                    "line_code": line_code,
+                    "from_station": station_name,
+                    "to_station": names[i + 1]
+                }
+
+                geometry = img.line_geometries[lines[i]]
+                if geometry and current_coords and next_coords:
+                    segment_info["geometry"] = geometry
+                    segment_info["from_coords"] = current_coords
+                    segment_info["to_coords"] = next_coords
+
+                route_segments.append(segment_info)
+
+        # Calcular transbordos
+        transfers = []
+        current_line = None
+        for i, line_code in enumerate(line_codes):
+            if current_line and current_line != line_code:
+                transfers.append({
+                    "station": names[i],
+                    "from_line": current_line,
+                    "to_line": line_code
+                })
+            current_line = line_code
+
+        return {
+            "found": True,
+            "stations": route_stations,
+            "lines": line_codes,
+            "segments": route_segments,
+            "transfers": transfers,
+            "num_stations": len(route_stations),
+            "num_transfers": len(transfers)
+        }
+
+
+class RouteCache:
+    """
+    Caché LRU de rutas ya calculadas por (origen, destino, modo, versión del
+    dataset). Guarda el cuerpo JSON ya serializado: repetir una ruta cuesta
+    una búsqueda en el diccionario.
+    """
+
+    def __init__(self, size: int = ROUTE_CACHE_SIZE):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        body = self._entries.get(key)
+        record_cache("route", body is not None)
+        if body is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: tuple, body: bytes):
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
+
+
+class NetworkStore:
+    """
+    Mantiene la red construida; se carga al arrancar o, si Fuseki no estaba, en
+    el primer uso. Con METRO_SHARED_DIR la imagen se publica en un fichero que
+    todos los workers mapean en solo lectura. Un fichero de bloqueo hace que
+    solo uno consulte Fuseki: los que arrancan a la vez esperan y mapean su
+    imagen (en Windows, sin fcntl, cada worker en frío la construye). Una
+    recarga es un cambio atómico del puntero `current`.
+    """
+
+    def __init__(self, shared_dir: str = SHARED_DIR):
+        self.network: Optional[RouteNetwork] = None
+        self.routes = RouteCache()
+        # Funciones a las que se avisa cuando cambia la versión del dataset
+        self.on_change: List[Callable[[], None]] = []
+        self.shared_dir = Path(shared_dir) if shared_dir else None
+        self._shared_path: Optional[Path] = None
+        self._last_check = 0.0
+        self._lock = asyncio.Lock()
+
+    def _set(self, network: RouteNetwork):
+        if self.network is not None and self.network.version != network.version:
+            # Las claves llevan la versión, así que las rutas antiguas ya no se
+            # volverían a usar: se liberan directamente
+            self.routes.clear()
+            for callback in self.on_change:
+                callback()
+        self.network = network
+
+    def _map_current(self) -> bool:
+        """
+        Mapea la imagen publicada si es distinta de la actual. False si no hay
+        ninguna que mapear: entonces load() la construye.
+        """
+        self._last_check = time.monotonic()
+        for _ in range(MAP_ATTEMPTS):
+            path = current_image_path(self.shared_dir)
+            if path is None or path == self._shared_path:
+                return path is not None
+            try:
+                image = map_image(path)
+            except FileNotFoundError:
+                # Otro worker la ha borrado al publicar una más nueva: se vuelve a leer el puntero
+                continue
+            self._set(RouteNetwork(image))
+            self._shared_path = path
+            return True
+        return False
+
+    async def load(self, refresh: bool = False) -> RouteNetwork:
+        if self.shared_dir is not None and not refresh and self._map_current():
+            return self.network
+
+        if self.shared_dir is None:
+            self._set(RouteNetwork(NetworkImage(await self._build())))
+            return self.network
+
+        async with build_lock(self.shared_dir):
+            # Mientras se esperaba, otro worker puede haberla publicado
+            if not refresh and self._map_current():
+                return self.network
+            publish_image(await self._build(), self.shared_dir)
+            self._map_current()
+        return self.network
+
+    async def _build(self) -> bytes:
+        data = await registry.execute("route_network")
+        return build_image(data.get("results", {}).get("bindings", []))
+
+    async def reload(self) -> RouteNetwork:
+        """Vuelve a consultar Fuseki tras recargar el RDF (sin pasar por la caché SPARQL)"""
+        async with self._lock:
+            registry.clear_cache()
+            return await self.load(refresh=True)
+
+    async def get(self) -> RouteNetwork:
+        if self.network is not None:
+            if (self.shared_dir is not None
+                    and time.monotonic() - self._last_check > SHARED_CHECK_INTERVAL):
+                # Otro worker puede haber publicado una recarga
+                self._map_current()
+            return self.network
+        async with self._lock:
+            if self.network is None:
+                await self.load()
+            return self.network
+
+    async def preload(self):
+        """Carga inicial desde el lifespan: si Fuseki no responde se reintentará en el primer uso"""
+        try:
+            await self.get()
+        except HTTPException as e:
+            print(f"⚠️  Red de metro no cargada al arrancar: {e.detail}")
+
+
+network_store = NetworkStore()
@@ -0,0 +1,268 @@
+# backend/network_image.py - Imagen binaria de la red para compartirla entre procesos
+#
+# La red de rutas se guarda en un único bloque de bytes con arrays planos
+# (coordenadas, adyacencia en formato CSR, índices) y tablas de cadenas. El
+# buscador de rutas trabaja directamente sobre ese bloque, así que puede venir
+# de memoria o de un fichero mapeado con mmap: con varios workers de uvicorn
+# todos mapean el mismo fichero y el sistema operativo comparte sus páginas.
+import asyncio
+import hashlib
+import json
+import math
+import mmap
+import os
+import struct
+from array import array
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from utils import parse_point_wkt
+
+MAGIC = b"METRONET"
+FORMAT_VERSION = 1
+# Imágenes antiguas que se conservan para los workers que aún las tengan mapeadas
+KEEP_IMAGES = 2
+POINTER_NAME = "current"
+LOCK_NAME = "build.lock"
+LOCK_POLL_INTERVAL = 0.1
+
+# Secciones en el orden en que se escriben: (nombre, tipo de array o "str")
+SECTIONS = (
+    ("coords", "d"),             # lat, lng por estación (NaN si no hay geometría)
+    ("adj_offsets", "I"),        # inicio de los vecinos de cada estación
+    ("adj_targets", "I"),        # estación vecina
+    ("adj_lines", "I"),          # línea del tramo
+    ("node_uri_offsets", "I"),   # URIs de cada estación, en orden de aparición
+    ("node_uris", "I"),
+    ("node_line_offsets", "I"),  # líneas que pasan por cada estación
+    ("node_lines", "I"),
+    ("uri_nodes", "I"),          # estación de cada URI (URIs ordenadas)
+    ("names", "str"),            # nombres de estación, ordenados
+    ("uris", "str"),             # URIs ordenadas
+    ("line_codes", "str"),
+    ("line_geometries", "str"),
+)
+_HEADER = struct.Struct(f"<8sI16s{len(SECTIONS) * 2}Q")
+_ALIGN = 8
+
+Buffer = Union[bytes, mmap.mmap]
+
+assert array("I").itemsize == 4 and array("d").itemsize == 8
+
+
+def _string_table(values: List[str]) -> bytes:
+    encoded = [v.encode("utf-8") for v in values]
+    offsets = array("I", [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+    return struct.pack("<I", len(encoded)) + offsets.tobytes() + b"".join(encoded)
+
+
+class StringTable:
+    """Vista de solo lectura sobre una tabla de cadenas: se decodifican al acceder"""
+
+    def __init__(self, view: memoryview):
+        self.count = struct.unpack_from("<I", view)[0]
+        self.offsets = view[4:4 + 4 * (self.count + 1)].cast("I")
+        self.blob = view[4 + 4 * (self.count + 1):]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def find(self, value: str) -> Optional[int]:
+        """Búsqueda binaria (la tabla debe estar ordenada)"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self[lo] == value else None
+
+
+def build_image(bindings: List[Dict[str, Any]]) -> bytes:
+    """Construye la imagen a partir de los bindings de la consulta `route_network`"""
+    # Versión del dataset: cambia solo si cambia el resultado de la consulta
+    version = hashlib.blake2b(
+        json.dumps(bindings, sort_keys=True).encode("utf-8"), digest_size=8
+    ).hexdigest()
+
+    uris_by_name: Dict[str, List[str]] = defaultdict(list)
+    station_coords: Dict[str, Tuple[float, float]] = {}
+    station_lines: Dict[str, set] = defaultdict(set)
+    line_stations = defaultdict(list)
+    line_geometries: Dict[str, str] = {}
+
+    for binding in bindings:
+        station_uri = binding.get("station", {}).get("value", "")
+        station_name = binding.get("stationName", {}).get("value", "")
+        line_code = str(binding.get("lineCode", {}).get("value", ""))
+        order = int(binding.get("order", {}).get("value", 0))
+        line_geom = binding.get("lineGeometry", {}).get("value", "")
+        station_geom = binding.get("stationGeometry", {}).get("value", "")
+
+        if station_uri not in uris_by_name[station_name]:
+            uris_by_name[station_name].append(station_uri)
+        station_lines[station_name].add(line_code)
+        line_stations[line_code].append((station_name, order, station_uri))
+
+        if station_geom and station_uri not in station_coords:
+            coords = parse_point_wkt(station_geom)
+            if coords:
+                station_coords[station_uri] = (coords['lat'], coords['lng'])
+
+        if line_geom and line_code not in line_geometries:
+            line_geometries[line_code] = line_geom
+
+    # Grafo por nombre de estación, conservando el orden de inserción de los
+    # vecinos (determina qué ruta gana entre las de igual longitud)
+    graph: Dict[str, List[Tuple[str, str]]] = defaultdict(list)
+    for line_code, stations in line_stations.items():
+        unique_stations = {}
+        for name, order, uri in stations:
+            if name not in unique_stations or order < unique_stations[name][0]:
+                unique_stations[name] = (order, uri)
+
+        sorted_stations = sorted(unique_stations.items(), key=lambda x: x[1][0])
+
+        for i in range(len(sorted_stations) - 1):
+            name1, _ = sorted_stations[i]
+            name2, _ = sorted_stations[i + 1]
+            graph[name1].append((name2, line_code))
+            graph[name2].append((name1, line_code))
+
+    names = sorted(uris_by_name)
+    node_of = {name: i for i, name in enumerate(names)}
+    line_codes = sorted(line_stations)
+    line_of = {code: i for i, code in enumerate(line_codes)}
+    uris = sorted({uri for name in names for uri in uris_by_name[name]})
+    uri_of = {uri: i for i, uri in enumerate(uris)}
+
+    sections: Dict[str, Any] = {name: array(kind) for name, kind in SECTIONS if kind != "str"}
+    sections["uri_nodes"] = array("I", [0] * len(uris))
+    for offsets in ("adj_offsets", "node_uri_offsets", "node_line_offsets"):
+        sections[offsets].append(0)
+
+    for node, name in enumerate(names):
+        first_uri = uris_by_name[name][0]
+        sections["coords"].extend(station_coords.get(first_uri, (math.nan, math.nan)))
+        for neighbor, line_code in graph.get(name, []):
+            sections["adj_targets"].append(node_of[neighbor])
+            sections["adj_lines"].append(line_of[line_code])
+        sections["adj_offsets"].append(len(sections["adj_targets"]))
+        for uri in uris_by_name[name]:
+            sections["node_uris"].append(uri_of[uri])
+            sections["uri_nodes"][uri_of[uri]] = node
+        sections["node_uri_offsets"].append(len(sections["node_uris"]))
+        sections["node_lines"].extend(sorted(line_of[code] for code in station_lines[name]))
+        sections["node_line_offsets"].append(len(sections["node_lines"]))
+
+    sections["names"] = names
+    sections["uris"] = uris
+    sections["line_codes"] = line_codes
+    sections["line_geometries"] = [line_geometries.get(code, "") for code in line_codes]
+
+    body = bytearray()
+    toc = []
+    for name, kind in SECTIONS:
+        data = _string_table(sections[name]) if kind == "str" else sections[name].tobytes()
+        body.extend(b"\0" * (-(_HEADER.size + len(body)) % _ALIGN))
+        toc.extend((_HEADER.size + len(body), len(data)))
+        body.extend(data)
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, version.encode("ascii"), *toc) + bytes(body)
+
+
+class NetworkImage:
+    """Lectura de una imagen (bytes en memoria o fichero mapeado) sin copiarla"""
+
+    def __init__(self, buffer: Buffer):
+        self.buffer = buffer
+        magic, fmt, version, *toc = _HEADER.unpack_from(buffer)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError("Imagen de red no válida o de otra versión del formato")
+        self.version = version.decode("ascii")
+
+        view = memoryview(buffer)
+        for i, (name, kind) in enumerate(SECTIONS):
+            offset, length = toc[2 * i], toc[2 * i + 1]
+            section = view[offset:offset + length]
+            setattr(self, name, StringTable(section) if kind == "str" else section.cast(kind))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+def publish_image(image: bytes, directory: Path) -> Path:
+    """
+    Escribe la imagen como network-<versión>.bin y apunta `current` a ella.
+    Ambos pasos son renombrados atómicos: un worker ve la imagen anterior o la
+    nueva completa, nunca una a medias.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    version = NetworkImage(image).version
+    path = directory / f"network-{version}.bin"
+    if not path.exists():
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(image)
+        tmp.replace(path)
+
+    pointer_tmp = directory / f"{POINTER_NAME}.{os.getpid()}.tmp"
+    pointer_tmp.write_text(path.name)
+    pointer_tmp.replace(directory / POINTER_NAME)
+
+    # En Linux un fichero borrado sigue disponible para quien ya lo tenga mapeado
+    old_images = sorted(
+        (p for p in directory.glob("network-*.bin") if p != path),
+        key=lambda p: p.stat().st_mtime,
+        reverse=True,
+    )
+    for old in old_images[KEEP_IMAGES - 1:]:
+        old.unlink(missing_ok=True)
+    return path
+
+
+@asynccontextmanager
+async def build_lock(directory: Path) -> AsyncIterator[None]:
+    """
+    Bloqueo exclusivo entre workers para consultar Fuseki y publicar la imagen.
+    Se espera sin bloquear el bucle de eventos; sin fcntl (Windows) no bloquea.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_NAME, "a") as lock_file:
+        while fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+        # Cerrar el fichero libera el bloqueo
+        yield
+
+
+def current_image_path(directory: Path) -> Optional[Path]:
+    """
+    Imagen a la que apunta `current`. Puede haberse borrado ya: quien la
+    mapea trata el FileNotFoundError en lugar de comprobarlo antes
+    """
+    try:
+        name = (directory / POINTER_NAME).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return directory / name
+
+
+def map_image(path: Path) -> NetworkImage:
+    """Mapea el fichero en solo lectura: sus páginas se comparten entre procesos"""
+    with open(path, "rb") as f:
+        return NetworkImage(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
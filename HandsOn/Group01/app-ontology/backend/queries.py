@@ -0,0 +1,293 @@
+# backend/queries.py - Registro de plantillas SPARQL con parámetros tipados
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from string import Template
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlencode
+
+from fastapi import HTTPException
+
+from metrics import record_cache
+from utils import canonicalize, query_sparql
+
+CACHE_SIZE = int(os.environ.get("SPARQL_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.environ.get("SPARQL_CACHE_TTL", "300"))
+
+PREFIXES = """
+PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+PREFIX rdfs: <http://www.w3.org/2000/01/rdf-schema#>
+PREFIX metro: <https://data.example.org/transport/bcn/metro/ontology#>
+PREFIX geo: <http://www.opengis.net/ont/geosparql#>
+"""
+
+# Caracteres no permitidos dentro de un IRIREF de SPARQL
+_INVALID_IRI = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+
+
+def bind_iri(value: Any) -> str:
+    value = str(value)
+    if not value or _INVALID_IRI.search(value):
+        raise ValueError(f"IRI no válido: {value!r}")
+    return f"<{value}>"
+
+
+def bind_int(value: Any) -> str:
+    try:
+        return str(int(str(value).strip()))
+    except ValueError:
+        raise ValueError(f"Se esperaba un entero: {value!r}")
+
+
+def bind_string(value: Any) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"')
+               .replace("\n", "\\n").replace("\r", "\\r"))
+    return f'"{escaped}"'
+
+
+PARAM_TYPES: Dict[str, Callable[[Any], str]] = {
+    "iri": bind_iri,
+    "int": bind_int,
+    "string": bind_string,
+}
+
+
+class TemplateStats:
+    """Latencias de las ejecuciones de una plantilla (ventana de las últimas muestras)"""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def summary(self) -> Dict[str, Any]:
+        def ms(value):
+            return round(value * 1000, 2) if value is not None else None
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "avg_ms": ms(self.total_seconds / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.50)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "max_ms": ms(self.max_seconds) if self.count else None,
+        }
+
+
+class QueryTemplate:
+    """
+    Consulta SPARQL definida una sola vez con parámetros $nombre tipados.
+    Los valores se validan y escapan al enlazarlos, nunca se interpolan tal cual.
+    """
+
+    def __init__(self, name: str, text: str, params: Optional[Dict[str, str]] = None,
+                 cacheable: bool = True):
+        self.name = name
+        self.params = params or {}
+        self.cacheable = cacheable
+        self.text = canonicalize(PREFIXES + text)
+        self._template = Template(self.text)
+        self.stats = TemplateStats()
+
+        for param_type in self.params.values():
+            if param_type not in PARAM_TYPES:
+                raise ValueError(f"Tipo de parámetro desconocido: {param_type}")
+
+    def _bound(self, values: Dict[str, Any]) -> Dict[str, str]:
+        """Valores validados y convertidos por su tipo, tal como van en la consulta"""
+        missing = set(self.params) - set(values)
+        unknown = set(values) - set(self.params)
+        if missing or unknown:
+            raise ValueError(f"Parámetros incorrectos para '{self.name}': "
+                             f"faltan {sorted(missing)}, sobran {sorted(unknown)}")
+        return {name: PARAM_TYPES[self.params[name]](value) for name, value in values.items()}
+
+    def bind(self, **values: Any) -> str:
+        """Devuelve el texto canónico de la consulta con los parámetros enlazados"""
+        return self._template.substitute(self._bound(values))
+
+    def cache_key(self, **values: Any) -> str:
+        """
+        Clave estable de la ejecución: nombre de la plantilla + parámetros ya
+        convertidos y ordenados, así "04" y "4" comparten entrada
+        """
+        if not values:
+            return self.name
+        return f"{self.name}?{urlencode(sorted(self._bound(values).items()))}"
+
+
+class QueryRegistry:
+    """Plantillas registradas, caché de resultados y estadísticas por plantilla"""
+
+    def __init__(self, cache_size: int = CACHE_SIZE, cache_ttl: float = CACHE_TTL):
+        self.templates: Dict[str, QueryTemplate] = {}
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def register(self, name: str, text: str, params: Optional[Dict[str, str]] = None,
+                 cacheable: bool = True) -> QueryTemplate:
+        if name in self.templates:
+            raise ValueError(f"Plantilla duplicada: {name}")
+        template = QueryTemplate(name, text, params, cacheable)
+        self.templates[name] = template
+        return template
+
+    def get(self, name: str) -> QueryTemplate:
+        return self.templates[name]
+
+    async def execute(self, name: str, **values: Any) -> Any:
+        """Ejecuta la plantilla, sirviendo desde caché si ya se ejecutó con esos parámetros"""
+        template = self.get(name)
+        try:
+            query = template.bind(**values)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        key = template.cache_key(**values)
+        if template.cacheable:
+            cached = self._cache.get(key)
+            if cached and time.monotonic() - cached[0] < self.cache_ttl:
+                self._cache.move_to_end(key)
+                template.stats.cache_hits += 1
+                record_cache("sparql", True)
+                return cached[1]
+            record_cache("sparql", False)
+
+        start = time.perf_counter()
+        try:
+            data = await query_sparql(query)
+        except HTTPException:
+            template.stats.errors += 1
+            raise
+        template.stats.record(time.perf_counter() - start)
+
+        if template.cacheable:
+            self._cache[key] = (time.monotonic(), data)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return data
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: t.stats.summary() for name, t in self.templates.items()}
+
+
+registry = QueryRegistry()
+
+registry.register("stations", """
+    SELECT ?station ?name ?geometry
+           (GROUP_CONCAT(DISTINCT ?lineCode; separator=",") AS ?lines)
+    WHERE {
+      ?station rdf:type metro:Station .
+      ?station rdfs:label ?name .
+      OPTIONAL { ?station metro:hasGeometry ?geometry }
+      OPTIONAL {
+        ?stationLine metro:relatesTo ?station .
+        ?stationLine metro:onLine ?line .
+        ?line metro:lineCode ?lineCode
+      }
+    }
+    GROUP BY ?station ?name ?geometry
+""")
+
+registry.register("lines", """
+    SELECT ?line ?lineCode ?lineName ?lineColor ?auxColor ?origin ?destination
+           (COUNT(DISTINCT ?station) AS ?numStations)
+    WHERE {
+      ?line rdf:type metro:MetroLine .
+      ?line metro:lineCode ?lineCode .
+      OPTIONAL { ?line metro:lineName ?lineName }
+      OPTIONAL { ?line metro:lineColor ?lineColor }
+      OPTIONAL { ?line metro:auxiliaryColor ?auxColor }
+      OPTIONAL { ?line metro:originStation ?origin }
+      OPTIONAL { ?line metro:destinationStation ?destination }
+      OPTIONAL {
+        ?stationLine metro:onLine ?line .
+        ?stationLine metro:relatesTo ?station
+      }
+    }
+    GROUP BY ?line ?lineCode ?lineName ?lineColor ?auxColor ?origin ?destination
+    ORDER BY ?lineCode
+""")
+
+registry.register("station_details", """
+    SELECT ?name ?geometry ?inaugurated
+           (GROUP_CONCAT(DISTINCT ?lineCode; separator=",") AS ?lines)
+    WHERE {
+      $station rdfs:label ?name .
+      OPTIONAL { $station metro:hasGeometry ?geometry }
+      OPTIONAL { $station metro:inauguratedDate ?inaugurated }
+      OPTIONAL {
+        ?stationLine metro:relatesTo $station .
+        ?stationLine metro:onLine ?line .
+        ?line metro:lineCode ?lineCode
+      }
+    }
+    GROUP BY ?name ?geometry ?inaugurated
+""", params={"station": "iri"})
+
+registry.register("line_geometries", """
+    SELECT ?lineCode ?lineColor ?geometry
+    WHERE {
+      ?line rdf:type metro:MetroLine .
+      ?line metro:lineCode ?lineCode .
+      OPTIONAL { ?line metro:lineColor ?lineColor }
+      OPTIONAL { ?line metro:hasGeometry ?geometry }
+    }
+    ORDER BY ?lineCode
+""")
+
+registry.register("line_details", """
+    SELECT ?line ?lineColor ?auxColor ?origin ?destination ?stationName ?order
+    WHERE {
+      ?line rdf:type metro:MetroLine .
+      ?line metro:lineCode $line_code .
+      OPTIONAL { ?line metro:lineColor ?lineColor }
+      OPTIONAL { ?line metro:auxiliaryColor ?auxColor }
+      OPTIONAL { ?line metro:originStation ?origin }
+      OPTIONAL { ?line metro:destinationStation ?destination }
+      OPTIONAL {
+        ?stationLine metro:onLine ?line .
+        ?stationLine metro:relatesTo ?station .
+        ?stationLine metro:stationOrder ?order .
+        ?station rdfs:label ?stationName
+      }
+    }
+    ORDER BY ?order
+""", params={"line_code": "int"})
+
+registry.register("route_network", """
+    SELECT ?station ?stationName ?lineCode ?order ?lineGeometry ?stationGeometry
+    WHERE {
+      ?station a metro:Station ;
+               rdfs:label ?stationName .
+      ?accessPoint metro:relatesTo ?station ;
+                   metro:onLine ?line ;
+                   metro:stationOrder ?order .
+      ?line metro:lineCode ?lineCode .
+      OPTIONAL { ?line metro:hasGeometry ?lineGeometry }
+      OPTIONAL { ?station metro:hasGeometry ?stationGeometry }
+    }
+    ORDER BY ?lineCode ?order
+""")
@@ -0,0 +1,179 @@
+# backend/responses.py - Serialización JSON rápida y cuerpos precomprimidos
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import stat
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import anyio
+from fastapi import Request
+from fastapi.responses import Response
+from fastapi.staticfiles import StaticFiles
+from pydantic import TypeAdapter
+from starlette.datastructures import Headers
+
+from metrics import record_cache, record_serialize
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: se usa json de la librería estándar
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # sin brotli solo se negocia gzip
+    brotli = None
+
+BODY_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "128"))
+BODY_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", os.environ.get("SPARQL_CACHE_TTL", "300")))
+# Por debajo de este tamaño comprimir no compensa
+MIN_COMPRESS_SIZE = 1024
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa a JSON (UTF-8, sin espacios) con orjson si está disponible"""
+    start = time.perf_counter()
+    if orjson is not None:
+        body = orjson.dumps(content)
+    else:
+        body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    record_serialize(time.perf_counter() - start)
+    return body
+
+
+class FastJSONResponse(Response):
+    """JSONResponse que serializa con orjson sin pasar por jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class EncodedBody:
+    """Cuerpo JSON serializado una vez, con sus variantes comprimidas calculadas bajo demanda"""
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.etag = 'W/"' + hashlib.blake2b(raw, digest_size=16).hexdigest() + '"'
+        self._encoded: Dict[str, bytes] = {"identity": raw}
+
+    def encode(self, encoding: str) -> bytes:
+        if encoding not in self._encoded:
+            if encoding == "br":
+                self._encoded[encoding] = brotli.compress(self.raw, quality=9)
+            elif encoding == "gzip":
+                self._encoded[encoding] = gzip.compress(self.raw, compresslevel=9)
+        return self._encoded[encoding]
+
+
+def negotiate_encoding(accept_encoding: str, size: Optional[int] = None) -> str:
+    """Elige br o gzip según Accept-Encoding (ignorando las codificaciones con q=0)"""
+    if size is not None and size < MIN_COMPRESS_SIZE:
+        return "identity"
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+
+class ResponseCache:
+    """Caché LRU de cuerpos ya serializados y comprimidos para los endpoints de solo lectura"""
+
+    def __init__(self, size: int = BODY_CACHE_SIZE, ttl: float = BODY_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[EncodedBody]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, content: Any) -> EncodedBody:
+        body = EncodedBody(dumps(content))
+        self._entries[key] = (time.monotonic(), body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return body
+
+    def clear(self):
+        self._entries.clear()
+
+    async def respond(self, request: Request, key: str,
+                      build: Callable[[], Awaitable[Any]], model: Any = None) -> Response:
+        """
+        Devuelve el cuerpo cacheado para `key` (construyéndolo con `build` si no existe)
+        en la codificación que acepte el cliente, o 304 si ya tiene esa versión.
+        Con `model` el contenido se valida y filtra una sola vez, al construirlo,
+        como haría `response_model` (que FastAPI no aplica a un Response).
+        """
+        body = self.get(key)
+        record_cache("response", body is not None)
+        if body is None:
+            content = await build()
+            if model is not None:
+                adapter = TypeAdapter(model)
+                content = adapter.dump_python(adapter.validate_python(content), mode="json")
+            body = self.put(key, content)
+
+        headers = {
+            "ETag": body.etag,
+            "Vary": "Accept-Encoding",
+            "Cache-Control": "no-cache",
+        }
+        if body.etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""), len(body.raw))
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(content=body.encode(encoding), media_type="application/json", headers=headers)
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    StaticFiles que sirve la variante .br o .gz generada de antemano junto a cada
+    fichero cuando el cliente la acepta. Los ficheros bajo un directorio versionado
+    se marcan como inmutables; el resto (p. ej. el manifiesto) se revalida siempre.
+    """
+    SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+    async def get_response(self, path: str, scope) -> Response:
+        response = None
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding != "identity" and scope["method"] in ("GET", "HEAD"):
+            full_path, stat_result = await anyio.to_thread.run_sync(
+                self.lookup_path, path + self.SUFFIXES[encoding]
+            )
+            if stat_result and stat.S_ISREG(stat_result.st_mode):
+                response = self.file_response(full_path, stat_result, scope)
+                response.headers["Content-Encoding"] = encoding
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                response.headers["Content-Type"] = media_type
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        response.headers["Vary"] = "Accept-Encoding"
+        if "/" in path.strip("/"):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+response_cache = ResponseCache()
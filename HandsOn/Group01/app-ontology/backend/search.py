@@ -0,0 +1,156 @@
+# backend/search.py - Índice en memoria para buscar estaciones por nombre
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+NGRAM_SIZE = 3
+# Similitud mínima (coeficiente de Dice sobre trigramas) para las coincidencias aproximadas
+MIN_SIMILARITY = 0.35
+# Sufijos que aparecen en algunas etiquetas del dataset ("Plaça de Catalunya station")
+_NOISE_WORDS = {"station", "estacio", "estacion"}
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def fold(text: str) -> str:
+    """Normaliza un nombre para comparar: sin acentos, en minúsculas y sin puntuación"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    words = [w for w in _NON_ALNUM.split(stripped) if w and w not in _NOISE_WORDS]
+    return " ".join(words)
+
+
+def ngrams(folded: str, n: int = NGRAM_SIZE) -> Set[str]:
+    padded = f" {folded} "
+    if len(padded) < n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # Entradas cuyo nombre (o alguna de sus palabras) empieza por este prefijo
+        self.entries: Set[int] = set()
+
+
+class StationSearchIndex:
+    """
+    Índice de nombres de estación: un trie para las búsquedas por prefijo (del
+    nombre completo o de cualquiera de sus palabras) y un índice invertido de
+    trigramas para tolerar erratas. Todo se compara sobre el texto plegado, así
+    que "placa catalunya" encuentra "Plaça de Catalunya".
+    """
+
+    def __init__(self, stations: Iterable[Dict[str, Any]]):
+        """`stations`: dicts con name, ids (URIs de la estación) y lines"""
+        self.entries: List[Dict[str, Any]] = []
+        self._folded: List[str] = []
+        self._grams: List[Set[str]] = []
+        self._by_folded: Dict[str, int] = {}
+        self._by_id: Dict[str, int] = {}
+        self._trie = _TrieNode()
+        self._gram_index: Dict[str, List[int]] = defaultdict(list)
+
+        for station in stations:
+            folded = fold(station["name"])
+            if not folded or folded in self._by_folded:
+                continue
+            entry_id = len(self.entries)
+            self.entries.append({
+                "id": station["ids"][0],
+                "ids": list(station["ids"]),
+                "name": station["name"],
+                "lines": sorted(station.get("lines", [])),
+            })
+            self._folded.append(folded)
+            self._by_folded[folded] = entry_id
+            for uri in station["ids"]:
+                self._by_id[uri] = entry_id
+
+            words = folded.split()
+            for start in range(len(words)):
+                self._insert(" ".join(words[start:]), entry_id)
+
+            grams = ngrams(folded)
+            self._grams.append(grams)
+            for gram in grams:
+                self._gram_index[gram].append(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _insert(self, key: str, entry_id: int):
+        node = self._trie
+        node.entries.add(entry_id)
+        for char in key:
+            node = node.children.setdefault(char, _TrieNode())
+            node.entries.add(entry_id)
+
+    def _prefix(self, folded: str) -> Set[int]:
+        node = self._trie
+        for char in folded:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.entries
+
+    def _similar(self, folded: str) -> Dict[int, float]:
+        grams = ngrams(folded)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for entry_id in self._gram_index.get(gram, ()):
+                shared[entry_id] += 1
+        scores = {}
+        for entry_id, count in shared.items():
+            dice = 2 * count / (len(grams) + len(self._grams[entry_id]))
+            if dice >= MIN_SIMILARITY:
+                scores[entry_id] = dice
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Estaciones ordenadas por relevancia: coincidencia exacta, prefijo del
+        nombre, prefijo de una palabra y, por último, similitud de trigramas
+        """
+        folded = fold(query)
+        if not folded:
+            return []
+
+        scored: Dict[int, float] = {}
+        for entry_id in self._prefix(folded):
+            name = self._folded[entry_id]
+            if name == folded:
+                scored[entry_id] = 3.0
+            elif name.startswith(folded):
+                scored[entry_id] = 2.0
+            else:
+                scored[entry_id] = 1.5
+        # Varias palabras: cada una debe ser prefijo de alguna palabra del nombre
+        words = folded.split()
+        if len(words) > 1:
+            for entry_id in set.intersection(*(self._prefix(w) for w in words)):
+                scored.setdefault(entry_id, 1.2)
+        # Las búsquedas muy cortas solo se resuelven por prefijo
+        if len(folded) >= NGRAM_SIZE - 1:
+            for entry_id, similarity in self._similar(folded).items():
+                scored[entry_id] = max(scored.get(entry_id, 0.0), similarity)
+
+        ranked: List[Tuple[float, str, int]] = sorted(
+            (-score, self._folded[entry_id], entry_id) for entry_id, score in scored.items()
+        )
+        return [
+            dict(self.entries[entry_id], score=round(-score, 3))
+            for score, _, entry_id in ranked[:limit]
+        ]
+
+    def by_id(self, station_id: str) -> Optional[Dict[str, Any]]:
+        entry_id = self._by_id.get(station_id)
+        return self.entries[entry_id] if entry_id is not None else None
+
+    def by_name(self, name: str) -> Optional[Dict[str, Any]]:
+        """Coincidencia exacta salvo acentos, mayúsculas y puntuación"""
+        entry_id = self._by_folded.get(fold(name))
+        return self.entries[entry_id] if entry_id is not None else None
@@ -0,0 +1,120 @@
+# backend/snapshot.py - Generación de snapshots estáticos para el mapa
+#
+# Uso (con Fuseki arrancado y el dataset cargado):
+#   python snapshot.py
+#
+# Ejecuta una vez todas las consultas de solo lectura y escribe en
+# frontend/snapshot/<versión>/ los JSON (con sus variantes .gz y .br).
+# Arrancando el backend con METRO_SNAPSHOT_MODE=1 el mapa carga esos ficheros
+# sin lanzar consultas SPARQL.
+import asyncio
+import gzip
+import hashlib
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict
+
+from fastapi import HTTPException
+
+from app import (
+    SNAPSHOT_DIR,
+    build_line_details,
+    build_line_geometries,
+    build_lines,
+    build_station_details,
+    build_stations,
+    normalize_network,
+)
+from responses import brotli, dumps
+from utils import SPARQL_ENDPOINT
+
+MANIFEST_NAME = "manifest.json"
+# Versiones antiguas que se conservan para los clientes que aún las estén usando
+KEEP_VERSIONS = 2
+
+
+async def collect() -> Dict[str, Any]:
+    """Ejecuta las consultas de solo lectura y devuelve el contenido de cada fichero"""
+    stations, lines, geometries = await asyncio.gather(
+        build_stations(), build_lines(), build_line_geometries()
+    )
+
+    station_details = {}
+    for station in stations:
+        try:
+            station_details[station["id"]] = await build_station_details(station["id"])
+        except HTTPException:
+            continue
+
+    line_details = {}
+    for line in lines:
+        try:
+            line_details[line["code"]] = await build_line_details(line["code"])
+        except HTTPException:
+            continue
+
+    return {
+        "stations": stations,
+        "lines": lines,
+        "line-geometries": geometries,
+        "network": normalize_network(stations, lines, geometries),
+        "station-details": station_details,
+        "line-details": line_details,
+    }
+
+
+def write_file(path: Path, body: bytes):
+    path.write_bytes(body)
+    path.with_name(path.name + ".gz").write_bytes(gzip.compress(body, compresslevel=9))
+    if brotli is not None:
+        path.with_name(path.name + ".br").write_bytes(brotli.compress(body, quality=11))
+
+
+def write_snapshot(contents: Dict[str, Any], target: Path = SNAPSHOT_DIR) -> str:
+    """Escribe los ficheros en un directorio versionado por contenido y actualiza el manifiesto"""
+    bodies = {name: dumps(content) for name, content in contents.items()}
+    digest = hashlib.sha256()
+    for name in sorted(bodies):
+        digest.update(name.encode("utf-8"))
+        digest.update(bodies[name])
+    version = digest.hexdigest()[:12]
+
+    version_dir = target / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    for name, body in bodies.items():
+        write_file(version_dir / f"{name}.json", body)
+
+    manifest = {
+        "version": version,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "endpoint": SPARQL_ENDPOINT,
+        "files": {name: f"{version}/{name}.json" for name in bodies},
+    }
+    # Se escribe el manifiesto al final y de forma atómica: hasta ese momento
+    # los clientes siguen usando la versión anterior
+    tmp = target / (MANIFEST_NAME + ".tmp")
+    tmp.write_bytes(dumps(manifest))
+    tmp.replace(target / MANIFEST_NAME)
+
+    old_versions = sorted(
+        (d for d in target.iterdir() if d.is_dir() and d.name != version),
+        key=lambda d: d.stat().st_mtime,
+        reverse=True,
+    )
+    for old in old_versions[KEEP_VERSIONS - 1:]:
+        shutil.rmtree(old)
+
+    return version
+
+
+async def main():
+    print(f"📸 Generando snapshot desde {SPARQL_ENDPOINT}...")
+    contents = await collect()
+    version = write_snapshot(contents)
+    print(f"✅ Snapshot {version}: {len(contents['stations'])} estaciones, "
+          f"{len(contents['lines'])} líneas -> {SNAPSHOT_DIR / version}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
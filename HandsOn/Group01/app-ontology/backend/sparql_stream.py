@@ -0,0 +1,276 @@
+# backend/sparql_stream.py - Streaming de resultados SPARQL hacia el cliente
+import json
+import os
+import re
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+
+from utils import SPARQL_ENDPOINT, query_listeners, sparql_error
+
+# Límites por defecto (se pueden ajustar por variables de entorno)
+STREAM_MAX_ROWS = int(os.environ.get("SPARQL_STREAM_MAX_ROWS", "100000"))
+STREAM_MAX_BYTES = int(os.environ.get("SPARQL_STREAM_MAX_BYTES", str(50 * 1024 * 1024)))
+# Segundos máximos sin recibir datos de Fuseki (entre dos lecturas, no en total)
+STREAM_READ_TIMEOUT = float(os.environ.get("SPARQL_STREAM_READ_TIMEOUT", "60"))
+
+NDJSON_FORMAT = "application/x-ndjson"
+
+# Formato pedido por el cliente -> Accept enviado a Fuseki.
+# NDJSON se genera a partir de TSV, que tiene exactamente una fila por línea.
+UPSTREAM_FORMATS = {
+    "application/sparql-results+json": "application/sparql-results+json",
+    "text/csv": "text/csv",
+    "text/tab-separated-values": "text/tab-separated-values",
+    NDJSON_FORMAT: "text/tab-separated-values",
+}
+
+# Formatos en los que se puede contar filas (y cortar en un límite de fila)
+ROW_FORMATS = ("text/csv", "text/tab-separated-values", NDJSON_FORMAT)
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+_ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+_ESCAPE_RE = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+_LITERAL_RE = re.compile(r'^"(.*)"(?:@([A-Za-z0-9-]+)|\^\^<([^>]*)>)?$', re.S)
+
+
+class StreamAborted(Exception):
+    """
+    El resultado no se puede cortar en un punto válido: se interrumpe la
+    conexión para que el cliente vea una transferencia incompleta en lugar
+    de un documento que parece completo
+    """
+
+
+class SparqlStream:
+    """
+    Respuesta de Fuseki abierta en modo streaming.
+
+    El cuerpo se lee trozo a trozo solo cuando el cliente consume el anterior,
+    así que la memoria del backend no depende del tamaño del resultado.
+
+    Al llegar a un límite:
+      - NDJSON termina con una línea {"truncated": true, "limit": ..., "rows": N}.
+      - CSV/TSV cortados por filas terminan en una fila completa; el cliente
+        lo detecta porque recibe exactamente X-Max-Rows filas.
+      - CSV/TSV cortados por bytes y JSON (que no tiene noción de fila) no se
+        pueden cerrar de forma válida: la conexión se interrumpe.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, response: httpx.Response, result_format: str,
+                 max_rows: int, max_bytes: int):
+        self.client = client
+        self.response = response
+        self.result_format = result_format
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.rows_sent = 0
+        self.bytes_sent = 0
+        self.truncated = False
+        # "max_rows" o "max_bytes"
+        self.truncated_by: Optional[str] = None
+
+    @property
+    def media_type(self) -> str:
+        if self.result_format == NDJSON_FORMAT:
+            return NDJSON_FORMAT
+        # Sin parámetros: StreamingResponse añade el charset a los tipos text/*
+        return self.response.headers.get("content-type", self.result_format).split(";")[0].strip()
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        """Límites aplicados; X-Max-Rows solo si el formato se corta por filas"""
+        headers = {"X-Max-Bytes": str(self.max_bytes)}
+        if self.result_format in ROW_FORMATS:
+            headers["X-Max-Rows"] = str(self.max_rows)
+        return headers
+
+    async def aclose(self):
+        await self.response.aclose()
+        await self.client.aclose()
+
+    async def body(self) -> AsyncIterator[bytes]:
+        """Genera el cuerpo de la respuesta aplicando los límites de filas y bytes"""
+        try:
+            if self.result_format == NDJSON_FORMAT:
+                chunks = self._ndjson_rows()
+            elif self.result_format in ROW_FORMATS:
+                chunks = self._text_rows()
+            else:
+                chunks = self.response.aiter_bytes()
+
+            async for chunk in chunks:
+                if self.bytes_sent + len(chunk) > self.max_bytes:
+                    self._truncate("max_bytes")
+                    if self.result_format == NDJSON_FORMAT:
+                        # Cada trozo de NDJSON es una fila: esta ya no se envía
+                        self.rows_sent -= 1
+                    else:
+                        raise StreamAborted(
+                            f"{self.result_format}: más de {self.max_bytes} bytes, respuesta interrumpida")
+                    break
+                self.bytes_sent += len(chunk)
+                yield chunk
+
+            if self.truncated and self.result_format == NDJSON_FORMAT:
+                yield json.dumps({"truncated": True, "limit": self.truncated_by,
+                                  "rows": self.rows_sent}).encode("utf-8") + b"\n"
+        finally:
+            await self.aclose()
+
+    def _truncate(self, limit: str):
+        self.truncated = True
+        self.truncated_by = limit
+
+    async def _lines(self) -> AsyncIterator[bytes]:
+        """Divide el cuerpo en líneas conservando los saltos de línea originales"""
+        pending = b""
+        async for chunk in self.response.aiter_bytes():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line + b"\n"
+        if pending:
+            yield pending
+
+    async def _text_rows(self) -> AsyncIterator[bytes]:
+        """CSV/TSV: cabecera + una fila por registro (en CSV una fila puede ocupar varias líneas)"""
+        header = True
+        in_quotes = False
+        row = b""
+        async for line in self._lines():
+            row += line
+            if self.result_format == "text/csv":
+                in_quotes ^= line.count(b'"') % 2 == 1
+                if in_quotes:
+                    continue
+            if header:
+                header = False
+            elif self.rows_sent >= self.max_rows:
+                self._truncate("max_rows")
+                break
+            else:
+                self.rows_sent += 1
+            yield row
+            row = b""
+        if row and not self.truncated:
+            yield row
+
+    async def _ndjson_rows(self) -> AsyncIterator[bytes]:
+        """Convierte el TSV de Fuseki en una línea JSON por fila, con el formato de los bindings"""
+        variables = None
+        async for line in self._lines():
+            text = line.decode("utf-8").rstrip("\r\n")
+            if variables is None:
+                variables = [v.lstrip("?$") for v in text.split("\t")]
+                continue
+            if not text and len(variables) > 1:
+                continue
+            if self.rows_sent >= self.max_rows:
+                self._truncate("max_rows")
+                break
+            row = {}
+            for var, term in zip(variables, text.split("\t")):
+                value = parse_tsv_term(term)
+                if value is not None:
+                    row[var] = value
+            self.rows_sent += 1
+            yield json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n"
+
+
+def _unescape(value: str) -> str:
+    def replace(match):
+        code = match.group(1)
+        if code[0] in "uU" and len(code) > 1:
+            return chr(int(code[1:], 16))
+        return _ESCAPES.get(code, code)
+    return _ESCAPE_RE.sub(replace, value)
+
+
+def parse_tsv_term(term: str) -> Optional[Dict[str, str]]:
+    """
+    Convierte un término RDF de un resultado TSV al formato de binding JSON.
+    Ejemplos: <http://ex.org/a>, "Sants"@es, "4"^^<...#integer>, 4, true
+    """
+    if not term:
+        return None
+    if term.startswith("<") and term.endswith(">"):
+        return {"type": "uri", "value": term[1:-1]}
+    if term.startswith("_:"):
+        return {"type": "bnode", "value": term[2:]}
+    match = _LITERAL_RE.match(term)
+    if match:
+        value, lang, datatype = match.groups()
+        literal = {"type": "literal", "value": _unescape(value)}
+        if lang:
+            literal["xml:lang"] = lang
+        elif datatype:
+            literal["datatype"] = datatype
+        return literal
+    # Abreviaturas de Turtle para números y booleanos
+    if term in ("true", "false"):
+        datatype = "boolean"
+    elif re.fullmatch(r"[+-]?\d+", term):
+        datatype = "integer"
+    elif re.fullmatch(r"[+-]?\d*\.\d+", term):
+        datatype = "decimal"
+    else:
+        datatype = "double"
+    return {"type": "literal", "value": term, "datatype": XSD + datatype}
+
+
+async def open_sparql_stream(query: str, result_format: str,
+                             max_rows: Optional[int] = None,
+                             max_bytes: Optional[int] = None) -> SparqlStream:
+    """
+    Lanza la consulta contra Fuseki y devuelve la respuesta sin leer el cuerpo.
+
+    Los errores de conexión o de estado HTTP se detectan aquí, antes de empezar
+    a enviar nada al cliente, para poder responder con el código adecuado.
+    """
+    if max_bytes and result_format not in ROW_FORMATS:
+        # Un JSON cortado por bytes no sería un documento válido
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "max_bytes solo se admite en formatos por filas",
+                "details": f"{result_format} no se puede cortar por bytes sin romper el documento",
+                "solution": "Usa max_rows o uno de estos formatos: " + ", ".join(ROW_FORMATS)
+            }
+        )
+
+    accept = UPSTREAM_FORMATS.get(result_format, result_format)
+    client = httpx.AsyncClient(timeout=httpx.Timeout(20.0, read=STREAM_READ_TIMEOUT))
+    request = client.build_request(
+        "GET", SPARQL_ENDPOINT, params={"query": query}, headers={"Accept": accept}
+    )
+    start = time.perf_counter()
+    ok = False
+    try:
+        response = await client.send(request, stream=True)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            await response.aclose()
+            raise
+        ok = True
+    except httpx.HTTPError as e:
+        raise sparql_error(e)
+    finally:
+        if not ok:
+            # Cualquier fallo (también una cancelación): el cliente no se usará más
+            await client.aclose()
+        # Se mide hasta recibir las cabeceras: el resto depende del ritmo del cliente
+        elapsed = time.perf_counter() - start
+        for listener in query_listeners:
+            listener(elapsed, ok, False)
+
+    return SparqlStream(
+        client,
+        response,
+        result_format,
+        max_rows=min(max_rows or STREAM_MAX_ROWS, STREAM_MAX_ROWS),
+        max_bytes=min(max_bytes or STREAM_MAX_BYTES, STREAM_MAX_BYTES),
+    )
@@ -1,10 +1,41 @@
 # backend/utils.py - Utilidades y funciones auxiliares
+import asyncio
+import os
 import re
-from typing import Optional, List, Dict, Any
+import time
+from typing import Optional, List, Dict, Any, Callable, Tuple
 from fastapi import HTTPException
 import httpx
 
-SPARQL_ENDPOINT = "http://localhost:3030/dataset/sparql"
+SPARQL_ENDPOINT = os.environ.get("SPARQL_ENDPOINT", "http://localhost:3030/dataset/sparql")
+
+# Cliente HTTP compartido por todas las consultas (se cierra en el lifespan de la app)
+_client: Optional[httpx.AsyncClient] = None
+
+# Funciones a las que se notifica cada consulta: (segundos, ok, compartida).
+# `compartida` indica que el llamante reutilizó una consulta idéntica ya en curso.
+query_listeners: List[Callable[[float, bool, bool], None]] = []
+
+# Consultas en curso por (texto canónico, formato), para agrupar las idénticas
+_inflight: Dict[Tuple[str, str], "asyncio.Task"] = {}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Devuelve el cliente compartido, creándolo la primera vez"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=20.0,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
 
 def parse_point_wkt(wkt: str) -> Optional[Dict[str, float]]:
@@ -47,45 +78,91 @@ def parse_multilinestring_wkt(wkt: str) -> List[Dict[str, float]]:
         return []
 
 
-async def query_sparql(query: str, response_format: str = "application/sparql-results+json") -> Any:
-    """Ejecuta una consulta SPARQL de forma asíncrona"""
+def canonicalize(query: str) -> str:
+    """Normaliza los espacios para que la misma consulta tenga siempre el mismo texto"""
+    return re.sub(r"\s+", " ", query).strip()
+
+
+def sparql_error(exc: Exception) -> HTTPException:
+    """Traduce un error de httpx al HTTPException que devuelve la API"""
+    if isinstance(exc, httpx.ConnectError):
+        return HTTPException(
+            status_code=502,
+            detail={
+                "error": "No se puede conectar con Apache Jena Fuseki",
+                "details": f"Fuseki no está corriendo en {SPARQL_ENDPOINT}",
+                "solution": "Inicia Fuseki con: fuseki-server --update --mem /dataset"
+            }
+        )
+    if isinstance(exc, httpx.TimeoutException):
+        return HTTPException(
+            status_code=504,
+            detail={
+                "error": "Timeout al conectar con Fuseki",
+                "details": "La consulta tardó demasiado tiempo",
+                "solution": "Verifica que Fuseki esté funcionando correctamente"
+            }
+        )
+    return HTTPException(
+        status_code=502,
+        detail={
+            "error": "Error al ejecutar la consulta SPARQL",
+            "details": str(exc),
+            "endpoint": SPARQL_ENDPOINT
+        }
+    )
+
+
+async def _fetch_sparql(query: str, response_format: str) -> Any:
     headers = {"Accept": response_format}
     params = {"query": query}
     
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        try:
-            resp = await client.get(SPARQL_ENDPOINT, params=params, headers=headers)
-            resp.raise_for_status()
+    try:
+        resp = await get_client().get(SPARQL_ENDPOINT, params=params, headers=headers)
+        resp.raise_for_status()
+        
+        if "json" in resp.headers.get("content-type", ""):
+            return resp.json()
+        else:
+            return resp.text
             
-            if "json" in resp.headers.get("content-type", ""):
-                return resp.json()
-            else:
-                return resp.text
-                
-        except httpx.ConnectError:
-            raise HTTPException(
-                status_code=502,
-                detail={
-                    "error": "No se puede conectar con Apache Jena Fuseki",
-                    "details": f"Fuseki no está corriendo en {SPARQL_ENDPOINT}",
-                    "solution": "Inicia Fuseki con: fuseki-server --update --mem /dataset"
-                }
-            )
-        except httpx.TimeoutException:
-            raise HTTPException(
-                status_code=504,
-                detail={
-                    "error": "Timeout al conectar con Fuseki",
-                    "details": "La consulta tardó demasiado tiempo",
-                    "solution": "Verifica que Fuseki esté funcionando correctamente"
-                }
-            )
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=502,
-                detail={
-                    "error": "Error al ejecutar la consulta SPARQL",
-                    "details": str(e),
-                    "endpoint": SPARQL_ENDPOINT
-                }
-            )
+    except (httpx.ConnectError, httpx.TimeoutException, httpx.HTTPStatusError) as e:
+        raise sparql_error(e)
+
+
+def _forget_inflight(key: Tuple[str, str], task: "asyncio.Task"):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # Marca la excepción como recuperada aunque ya no quede nadie esperando
+    if not task.cancelled():
+        task.exception()
+
+
+async def query_sparql(query: str, response_format: str = "application/sparql-results+json") -> Any:
+    """
+    Ejecuta una consulta SPARQL de forma asíncrona.
+
+    Las llamadas concurrentes con la misma consulta (tras normalizar espacios) y
+    el mismo formato esperan a una única petición a Fuseki y reciben el mismo
+    resultado ya parseado, que por tanto debe tratarse como de solo lectura.
+    """
+    key = (canonicalize(query), response_format)
+    task = _inflight.get(key)
+    shared = task is not None
+    if task is None:
+        # La petición va en su propia tarea: si el primer llamante se cancela
+        # (p. ej. el cliente cierra la conexión) los demás siguen esperándola
+        task = asyncio.ensure_future(_fetch_sparql(query, response_format))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+
+    start = time.perf_counter()
+    ok = False
+    try:
+        result = await asyncio.shield(task)
+        ok = True
+        return result
+    finally:
+        elapsed = time.perf_counter() - start
+        for listener in query_listeners:
+            listener(elapsed, ok, shared)
@@ -75,7 +75,10 @@ if (healthBtn) {
     try {
       const resp = await fetch('/api/health');
       const data = await resp.json();
-      alert(`Backend: ${data.backend}\nSPARQL: ${data.sparql_status}\nEndpoint: ${data.sparql_endpoint}`);
+      const latency = data.query_p50_ms != null
+        ? `\nLatencia consultas: p50 ${data.query_p50_ms} ms · p95 ${data.query_p95_ms} ms (${data.query_count} consultas)`
+        : '';
+      alert(`Backend: ${data.backend}\nSPARQL: ${data.sparql_status}\nEndpoint: ${data.sparql_endpoint}${latency}`);
     } catch (err) {
       alert('❌ No se pudo conectar con el backend');
     }
@@ -5,6 +5,9 @@ let linesData = [];
 let markers = [];
 let polylines = [];
 let routeLayer = null;
+// Snapshot estático (modo snapshot del backend): manifiesto y detalles ya cargados
+let snapshot = null;
+const snapshotCache = {};
 
 const lineColors = {
   'L1': '#E2001A',
@@ -33,22 +36,54 @@ function initMap() {
   loadMapData();
 }
 
+async function loadSnapshotManifest() {
+  try {
+    const resp = await fetch('/snapshot/manifest.json', { cache: 'no-cache' });
+    if (resp.ok) {
+      snapshot = await resp.json();
+      console.log(`📸 Usando snapshot ${snapshot.version}`);
+    }
+  } catch (error) {
+    snapshot = null;
+  }
+}
+
+// Devuelve la URL del fichero del snapshot si existe, o la del endpoint de la API
+function dataUrl(name, apiPath) {
+  if (snapshot && snapshot.files && snapshot.files[name]) {
+    return `/snapshot/${snapshot.files[name]}`;
+  }
+  return apiPath;
+}
+
+// Detalles de estaciones/líneas: en modo snapshot se descargan una sola vez
+async function loadSnapshotDetails(name) {
+  if (!snapshotCache[name]) {
+    const resp = await fetch(dataUrl(name));
+    snapshotCache[name] = await resp.json();
+  }
+  return snapshotCache[name];
+}
+
 async function loadMapData() {
   try {
-    const [stationsResp, linesResp] = await Promise.all([
-      fetch('/api/stations'),
-      fetch('/api/lines')
-    ]);
+    await loadSnapshotManifest();
 
-    if (!stationsResp.ok || !linesResp.ok) {
+    // Una sola petición: /api/network (o el fichero equivalente del snapshot)
+    const resp = await fetch(dataUrl('network', '/api/network'));
+    if (!resp.ok) {
       throw new Error('Error al cargar datos');
     }
 
-    stationsData = await stationsResp.json();
-    linesData = await linesResp.json();
+    const network = await resp.json();
+    linesData = network.lines.map(({ coordinates, ...line }) => line);
+    stationsData = network.stations.map(station => ({
+      ...station,
+      lines: station.lines.map(index => network.lines[index].code)
+    }));
 
     populateStationSelects();
-    await renderLines();
+    renderLines(network.lines);
     renderStations();
 
     document.getElementById('loading').style.display = 'none';
@@ -104,38 +139,36 @@ function renderStations() {
   });
 }
 
-async function renderLines() {
-  try {
-    const resp = await fetch('/api/line-geometries');
-    const lineGeometries = await resp.json();
-
-    lineGeometries.forEach(lineData => {
-      if (!lineData.coordinates || lineData.coordinates.length < 2) return;
-
-      const coords = lineData.coordinates.map(coord => [coord.lat, coord.lng]);
-
-      const polyline = L.polyline(coords, {
-        color: lineData.color,
-        weight: 4,
-        opacity: 0.7,
-        smoothFactor: 1
-      }).addTo(map);
+function renderLines(lines) {
+  let rendered = 0;
+  lines.forEach(lineData => {
+    if (!lineData.coordinates || lineData.coordinates.length < 2) return;
+
+    const polyline = L.polyline(lineData.coordinates, {
+      color: lineData.color,
+      weight: 4,
+      opacity: 0.7,
+      smoothFactor: 1
+    }).addTo(map);
+
+    polyline.on('click', () => showLineDetails(lineData.code));
+    polylines.push(polyline);
+    rendered++;
+  });
 
-      polyline.on('click', () => showLineDetails(lineData.code));
-      polylines.push(polyline);
-    });
-    
-    console.log(`✅ ${lineGeometries.length} líneas renderizadas`);
-  } catch (error) {
-    console.error('Error renderizando líneas:', error);
-  }
+  console.log(`✅ ${rendered} líneas renderizadas`);
 }
 
 async function showStationDetails(station) {
   try {
-    const stationId = encodeURIComponent(station.id);
-    const resp = await fetch(`/api/station/${stationId}`);
-    const details = await resp.json();
+    let details;
+    if (snapshot) {
+      details = (await loadSnapshotDetails('station-details'))[station.id];
+    } else {
+      const stationId = encodeURIComponent(station.id);
+      const resp = await fetch(`/api/station/${stationId}`);
+      details = await resp.json();
+    }
 
     const linesHTML = details.lines.map(lineCode => {
       const lineInfo = linesData.find(l => l.code === lineCode);
@@ -171,8 +204,13 @@ async function showStationDetails(station) {
 
 async function showLineDetails(lineCode) {
   try {
-    const resp = await fetch(`/api/line/${lineCode}`);
-    const details = await resp.json();
+    let details;
+    if (snapshot) {
+      details = (await loadSnapshotDetails('line-details'))[lineCode];
+    } else {
+      const resp = await fetch(`/api/line/${lineCode}`);
+      details = await resp.json();
+    }
 
     const color = details.color || lineColors[lineCode] || '#999';
 
@@ -308,12 +346,12 @@ function populateStationSelects() {
   
   sortedStations.forEach(station => {
     const option1 = document.createElement('option');
-    option1.value = station.name;
+    option1.value = station.id;
     option1.textContent = station.name;
     originSelect.appendChild(option1);
     
     const option2 = document.createElement('option');
-    option2.value = station.name;
+    option2.value = station.id;
     option2.textContent = station.name;
     destSelect.appendChild(option2);
   });
@@ -328,16 +366,16 @@ function checkRouteInputs() {
 }
 
 async function findRoute() {
-  const originName = document.getElementById('origin-select').value;
-  const destName = document.getElementById('destination-select').value;
+  const originId = document.getElementById('origin-select').value;
+  const destId = document.getElementById('destination-select').value;
   const resultDiv = document.getElementById('route-result');
   
-  if (!originName || !destName) {
+  if (!originId || !destId) {
     resultDiv.innerHTML = '<p style="color: #c62828;">Selecciona origen y destino</p>';
     return;
   }
   
-  if (originName === destName) {
+  if (originId === destId) {
     resultDiv.innerHTML = '<p style="color: #c62828;">El origen y destino son la misma estación</p>';
     return;
   }
@@ -345,7 +383,7 @@ async function findRoute() {
   resultDiv.innerHTML = '<p>🔍 Buscando ruta...</p>';
   
   try {
-    const resp = await fetch(`/api/route?origin=${encodeURIComponent(originName)}&destination=${encodeURIComponent(destName)}`);
+    const resp = await fetch(`/api/route?origin_id=${encodeURIComponent(originId)}&destination_id=${encodeURIComponent(destId)}`);
     const data = await resp.json();
     
     if (!data.found) {
@@ -1,11 +1,23 @@
 import streamlit as st
+import rdflib
 from rdflib import Graph
 from rdflib.plugins.sparql import prepareQuery
 import pandas as pd
 from urllib.parse import unquote
-import re
+import asyncio
+import hashlib
+import os
+import pickle
+import threading
 import time
-from SPARQLWrapper import SPARQLWrapper, JSON
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from enrichment import StreamingJoin
+from federation import ServiceFederation, uses_service
+from result_cache import QueryResultCache
+from results_view import render_results
+from wikidata import WikidataBatchExecutor
+from wikidata_cache import WikidataCache
 
 
 
@@ -143,121 +155,258 @@ st.markdown("""
 #Si s parece una URI, devolver la parte local (después de / o #)
 def _shorten_uri(s):
     if s.startswith('http://') or s.startswith('https://'):
-        parts = re.split(r'[#/]', s)
-        if parts:
-            return parts[-1]
+        return s[max(s.rfind('/'), s.rfind('#')) + 1:]
     return s
 
 
+def _term_to_text(term):
+    """Texto que se muestra para un término RDF: decodificado y con las URIs acortadas"""
+    s = str(term)
+    try:
+        s = unquote(s)
+    except:
+        pass
+    return _shorten_uri(s)
+
+
+def _result_to_dataframe(res):
+    """
+    Construye el DataFrame por columnas leyendo directamente los bindings del
+    resultado. Cada término distinto se convierte una sola vez (tabla memo) y
+    todas sus apariciones comparten la misma cadena.
+    """
+    variables = list(getattr(res, 'vars', None) or [])
+    headers = [str(v) for v in variables]
+    columns = [[] for _ in variables]
+    memo = {None: ""}
+
+    appenders = list(zip(variables, [column.append for column in columns]))
+    for binding in res.bindings:
+        for var, append in appenders:
+            term = binding.get(var)
+            text = memo.get(term)
+            if text is None:
+                text = memo[term] = _term_to_text(term)
+            append(text)
+
+    if not columns or not columns[0]:
+        return pd.DataFrame()
+    return pd.DataFrame(dict(zip(headers, columns)), columns=headers)
+
+
+# Grafo local (el mismo que se publica en GitHub) y caché compilada del grafo ya parseado
+RDF_DIR = Path(__file__).resolve().parent.parent / "rdf"
+GRAPH_FILE = "knowledge-graph-with-links.ttl"
+GRAPH_REMOTE_URL = "https://raw.githubusercontent.com/Istrar/Curso2025-2026/refs/heads/master/HandsOn/Group02/rdf"
+CACHE_DIR = Path(os.environ.get("GROUP02_CACHE_DIR", Path(__file__).resolve().parent / ".cache"))
+# Si el fichero local no está solo se descarga de GitHub cuando se pide expresamente
+ALLOW_REMOTE_GRAPH = os.environ.get("GROUP02_ALLOW_REMOTE", "0") == "1"
+GRAPH_CACHE_FORMAT = 1
+# Filas de la vista previa mientras llegan los batches de Wikidata
+PREVIEW_ROWS = 20
+# Hilos que precalculan las queries del menú al arrancar
+WARMUP_WORKERS = int(os.environ.get("GROUP02_WARMUP_WORKERS", "4"))
+# El parser SPARQL de rdflib (pyparsing) no es seguro entre hilos
+_PARSE_LOCK = threading.Lock()
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_compiled_graph(source_hash):
+    """Devuelve el grafo de la caché compilada si corresponde a ese Turtle y a esta versión de rdflib"""
+    cache_file = CACHE_DIR / f"{GRAPH_FILE}.{source_hash[:16]}.pickle"
+    try:
+        with open(cache_file, "rb") as f:
+            header, g = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError):
+        return None
+    if header != (GRAPH_CACHE_FORMAT, source_hash, rdflib.__version__):
+        return None
+    return g
+
+
+def _save_compiled_graph(g, source_hash):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_file = CACHE_DIR / f"{GRAPH_FILE}.{source_hash[:16]}.pickle"
+    tmp = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump(((GRAPH_CACHE_FORMAT, source_hash, rdflib.__version__), g), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(cache_file)
+    # Compilaciones de versiones anteriores del Turtle
+    for old in CACHE_DIR.glob(f"{GRAPH_FILE}.*.pickle"):
+        if old != cache_file:
+            old.unlink(missing_ok=True)
+
+
 @st.cache_resource
 def load_graph():
-    """Carga el grafo RDF (con caché para mejor rendimiento)"""
-    g = Graph()
-    githubStorage = "https://raw.githubusercontent.com/Istrar/Curso2025-2026/refs/heads/master/HandsOn/Group02/rdf"
+    """
+    Carga el grafo RDF (con caché para mejor rendimiento).
+    Usa el Turtle de rdf/ y guarda el grafo ya parseado en .cache/, validado por
+    el hash del fichero: los arranques siguientes no vuelven a parsear Turtle y
+    funcionan sin conexión. GitHub solo se usa si no hay fichero local y se
+    activa GROUP02_ALLOW_REMOTE=1.
+
+    Devuelve (grafo, versión, error). La versión es el hash del Turtle y sirve
+    de clave para la caché de resultados (None si el grafo viene de GitHub).
+    """
+    local_file = RDF_DIR / GRAPH_FILE
     try:
-        g.parse(githubStorage + "/knowledge-graph-with-links.ttl", format="turtle")
-        return g, None
+        if local_file.exists():
+            source_hash = _file_sha256(local_file)
+            g = _load_compiled_graph(source_hash)
+            if g is None:
+                g = Graph()
+                g.parse(local_file, format="turtle")
+                try:
+                    _save_compiled_graph(g, source_hash)
+                except OSError:
+                    # Sin permisos de escritura: se sigue con el grafo en memoria
+                    pass
+            return g, source_hash, None
+
+        if not ALLOW_REMOTE_GRAPH:
+            return None, None, (f"No se encuentra {local_file}. Para descargarlo de GitHub "
+                                f"arranca con GROUP02_ALLOW_REMOTE=1")
+        g = Graph()
+        g.parse(GRAPH_REMOTE_URL + "/" + GRAPH_FILE, format="turtle")
+        return g, None, None
     except Exception as e:
-        return None, str(e)
+        return None, None, str(e)
 
 
 def execute_query(g, query):
     #Ejecuta una query SPARQL y devuelve un DataFrame
     try:
-        res = g.query(prepareQuery(query))
-        rows = list(res)
-        if not rows:
-            return pd.DataFrame(), None
-
-        # Obtener nombres de variables
-        headers = [str(v) for v in getattr(res, 'vars', [])]
-
-        # Procesar resultados
-        data = []
-        for r in rows:
-            row_data = []
-            for x in r:
-                if x is not None:
-                    s = str(x)
-                    try:
-                        s = unquote(s)
-                    except:
-                        pass
-                    s = _shorten_uri(s)
-                    row_data.append(s)
-                else:
-                    row_data.append("")
-            data.append(row_data)
-
-        df = pd.DataFrame(data, columns=headers)
-        return df, None
+        with _PARSE_LOCK:
+            prepared = prepareQuery(query)
+        res = g.query(prepared)
+        return _result_to_dataframe(res), None
     except Exception as e:
         return pd.DataFrame(), str(e)
 
 
+@st.cache_resource
+def get_result_cache():
+    """Caché de resultados del grafo local, compartida por todas las sesiones"""
+    return QueryResultCache(CACHE_DIR / "results")
+
+
+def execute_cached_query(g, graph_version, query, cache=None):
+    """
+    Como execute_query, pero sirviendo el resultado desde la caché si ya se
+    calculó para esta versión del grafo (o lo está calculando el precalentamiento)
+    """
+    cache = cache or get_result_cache()
+    if graph_version is None or uses_service(query):
+        # Con SERVICE el resultado depende también del endpoint remoto (tiene su propia caché)
+        return execute_query(g, query)
+    return cache.get_or_compute(graph_version, query, lambda: execute_query(g, query))
+
+
+def _local_queries():
+    """Texto de la parte local de cada query del menú (la RDF en las combinadas; las federadas no)"""
+    queries = [config.get("query") or config.get("query_rdf") for config in QUERIES.values()]
+    return [query for query in queries if query and not uses_service(query)]
+
+
+@st.cache_resource
+def start_warmup(_g, graph_version):
+    """
+    Lanza en segundo plano las queries del menú para que la primera vez que
+    se pulsa "Ejecutar Query" el resultado ya esté en la caché. Se ejecuta una
+    vez por versión del grafo; la página no espera a que termine.
+    """
+    if graph_version is None:
+        return []
+    # La caché se pasa explícitamente: los hilos no tienen contexto de Streamlit
+    cache = get_result_cache()
+    pool = ThreadPoolExecutor(max_workers=WARMUP_WORKERS, thread_name_prefix="warmup")
+    futures = [pool.submit(execute_cached_query, _g, graph_version, query, cache)
+               for query in _local_queries()]
+    pool.shutdown(wait=False)
+    return futures
+
+
+def _bindings_to_dataframe(bindings):
+    """Convierte los bindings JSON de Wikidata en un DataFrame con las URIs acortadas"""
+    if not bindings:
+        return pd.DataFrame()
+    headers = list(bindings[0].keys())
+
+    data = []
+    for binding in bindings:
+        row = []
+        for header in headers:
+            value = binding.get(header, {}).get("value", "")
+            # Acortar URIs si es necesario
+            value = _shorten_uri(value) if value else ""
+            row.append(value)
+        data.append(row)
+
+    return pd.DataFrame(data, columns=headers)
+
+
+@st.cache_resource
+def get_federation():
+    """Evaluación de SERVICE por bind join (ver federation.py), registrada en rdflib una vez"""
+    federation = ServiceFederation(cache=get_wikidata_executor().cache)
+    federation.register()
+    return federation
+
+
+@st.cache_resource
+def get_wikidata_executor():
+    """Ejecutor compartido por todas las sesiones: conserva el tamaño de batch aprendido y la caché"""
+    try:
+        cache = WikidataCache(CACHE_DIR / "wikidata.sqlite")
+    except Exception:
+        # Sin disco escribible se consulta siempre a Wikidata
+        cache = None
+    return WikidataBatchExecutor(cache=cache)
+
+
 def execute_wikidata_query(sparql_query):
     """Ejecuta una query SPARQL en Wikidata y devuelve un DataFrame"""
-    attempts = 3
-    backoff = 1.0
-    last_err = None
-    for attempt in range(attempts):
-        try:
-            sparql = SPARQLWrapper("https://query.wikidata.org/sparql")
-            sparql.setQuery(sparql_query)
-            sparql.setReturnFormat(JSON)
-            sparql.addCustomHttpHeader(
-                "User-Agent", "BarcelonaActivitiesExplorer/1.0")
-
-            results = sparql.query().convert()
-
-            if not results.get("results", {}).get("bindings"):
-                return pd.DataFrame(), None
-            # si hay resultados
-            bindings = results["results"]["bindings"]
-            headers = list(bindings[0].keys()) if bindings else []
-
-            data = []
-            for binding in bindings:
-                row = []
-                for header in headers:
-                    value = binding.get(header, {}).get("value", "")
-                    # Acortar URIs si es necesario
-                    value = _shorten_uri(value) if value else ""
-                    row.append(value)
-                data.append(row)
-
-            df = pd.DataFrame(data, columns=headers)
-            return df, None
-        except Exception as e:
-            last_err = e
-            # Si no es el último intento, esperar con backoff y reintentar
-            if attempt < attempts - 1:
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            else:
-                return pd.DataFrame(), str(last_err)
+    try:
+        results = asyncio.run(get_wikidata_executor().query(sparql_query))
+    except Exception as e:
+        return pd.DataFrame(), str(e)
+    return _bindings_to_dataframe(results["results"]["bindings"]), None
 
 
-def execute_combined_query(g, rdf_query, wikidata_query_template, input_variable, debug=False):
+def execute_combined_query(g, rdf_query, wikidata_query_template, input_variable, debug=False,
+                           on_batch=None, graph_version=None):
     """
     Ejecuta una query RDF, luego usa sus resultados como input para Wikidata con procesamiento por batches,
     y devuelve AMBOS DataFrames: el RDF original y el combinado RDF+Wikidata
 
+    Todos los valores distintos de la variable de entrada se consultan en
+    Wikidata; cada batch se une a las filas RDF en cuanto llega (ver
+    enrichment.StreamingJoin), sin esperar a los demás.
+
     Args:
         g: Grafo RDF
         rdf_query: Query SPARQL para el RDF local
         wikidata_query_template: Template de query Wikidata con placeholder {values}
         input_variable: Variable del resultado RDF a usar como input
-        wikidata_input_var: Variable en la query Wikidata donde insertar los valores (debe ser 'searchTerm')
-        merge_key: Tupla (col_rdf, col_wikidata) para hacer el merge. Si es None, usa searchTerm
         debug: Si es True, retorna también las queries generadas para cada batch
+        on_batch: Función a la que se llama con (batch, join) según termina cada batch
+            de Wikidata; join.frame() da el resultado combinado parcial
+        graph_version: Hash del grafo; si se indica, la parte RDF sale de la caché de resultados
 
     Returns:
         (df_rdf_original, df_combined, error, batch_info): DataFrame RDF original, DataFrame combinado, mensaje de error, info de batches
     """
     # Ejecutar query RDF
-    df_rdf, error = execute_query(g, rdf_query)
+    df_rdf, error = execute_cached_query(g, graph_version, rdf_query)
     if error:
         return df_rdf if df_rdf is not None else pd.DataFrame(), None, error, None
 
@@ -268,93 +417,49 @@ def execute_combined_query(g, rdf_query, wikidata_query_template, input_variable
     if input_variable not in df_rdf.columns:
         return df_rdf, df_rdf, f"Variable '{input_variable}' no encontrada en resultados RDF", None
 
-    input_values = df_rdf[input_variable].dropna().unique()
+    # Índice de las filas RDF por la variable de entrada: sus claves son los valores a consultar
+    join = StreamingJoin(df_rdf, input_variable, normalize=_shorten_uri)
+    input_values = join.keys
 
     if len(input_values) == 0:
         return df_rdf, df_rdf, "No hay valores únicos para consultar en Wikidata", None
 
-    # 4. PROCESAMIENTO POR BATCHES para evitar timeouts
-    batch_size = 10
-    max_values = min(len(input_values), 200)  # Limitar a 200 valores máximo
-    batches = [input_values[i:i+batch_size]
-               for i in range(0, max_values, batch_size)]
-
-    df_wikidata_list = []
+    # 4. PROCESAMIENTO POR BATCHES para evitar timeouts: se lanzan en paralelo
+    # con límite de ritmo y tamaño de batch adaptativo (ver wikidata.py)
     errors = []
     batch_queries = []  # Para almacenar las queries generadas (debug)
 
-    for idx, batch in enumerate(batches):
-        # Construir VALUES clause para este batch
-        # Si el valor parece una URI de Wikidata o un QID, usar formato wd:Q123
-        # Si no, usar como string entrecomillado
-        formatted_values = []
-        for v in batch:
-            v_str = str(v)
-            # Detectar URIs completas de Wikidata (http://www.wikidata.org/entity/Q...)
-            if 'wikidata.org/entity/' in v_str:
-                qid = v_str.split('/')[-1]
-                formatted_values.append(f'wd:{qid}')
-            # Detectar QIDs ya acortados (Q seguido de números)
-            elif re.match(r'^Q\d+$', v_str):
-                formatted_values.append(f'wd:{v_str}')
-            else:
-                # String normal, entrecomillar
-                formatted_values.append(f'"{v_str.replace("\"", "\\\"")}"')
-        
-        batch_values_clause = " ".join(formatted_values)
-        wikidata_query = wikidata_query_template.replace(
-            "{values}", batch_values_clause)
-
+    for result in get_wikidata_executor().stream(wikidata_query_template, input_values):
         # Guardar query generada para debug
         batch_queries.append({
-            'batch_num': idx + 1,
-            'values_count': len(batch),
-            'values': list(batch),
-            'query': wikidata_query
+            'batch_num': result.batch_num,
+            'values_count': len(result.values),
+            'values': result.values,
+            'query': result.query,
+            'attempts': result.attempts,
+            'seconds': round(result.seconds, 3)
         })
 
-        # Ejecutar query para este batch
-        df_batch, error_wd = execute_wikidata_query(wikidata_query)
+        if result.error:
+            errors.append(result.error)
+        else:
+            join.add_batch(result.batch_num, result.bindings)
 
-        if error_wd:
-            errors.append(error_wd)
-        elif df_batch is not None and not df_batch.empty:
-            df_wikidata_list.append(df_batch)
+        if on_batch is not None:
+            on_batch(result, join)
 
-        # Pausa cortés entre requests
-        if len(batches) > 1:
-            time.sleep(0.8)
+    batch_queries.sort(key=lambda b: b['batch_num'])
 
-    # Concatenar resultados de todos los batches
-    if not df_wikidata_list:
+    if join.bindings_seen == 0:
         error_msg = f"Wikidata no devolvió resultados. Errores: {'; '.join(errors)}" if errors else "Wikidata no devolvió resultados"
         return df_rdf, df_rdf, error_msg, batch_queries if debug else None
 
-    df_wikidata = pd.concat(df_wikidata_list, ignore_index=True, sort=False)
-    df_wikidata = df_wikidata.drop_duplicates()
-
-
-    # Renombrar searchTerm a la variable del RDF para hacer merge
-    df_wikidata_renamed = df_wikidata.copy()
-    df_wikidata_renamed.rename(
-        columns={'searchTerm': input_variable}, inplace=True)
-    # Añadir prefijo wd_ a todas las columnas de Wikidata excepto la de join
-    cols_to_rename = {
-        col: f'wd_{col}' for col in df_wikidata_renamed.columns if col != input_variable}
-    df_wikidata_renamed.rename(columns=cols_to_rename, inplace=True)
-    # Hacer merge usando INNER JOIN para mantener todas las filas RDF
-    df_combined = pd.merge(df_rdf, df_wikidata_renamed,
-                           on=input_variable, how='inner', suffixes=('', '_dup'))
-    df_combined = df_combined.loc[:, ~
-                                  df_combined.columns.str.endswith('_dup')]
-    
-    # Eliminar filas duplicadas que se generan cuando Wikidata devuelve múltiples resultados por entidad
-    rdf_columns = list(df_rdf.columns)
-    df_combined = df_combined.drop_duplicates(subset=rdf_columns, keep='first')
-    
-    # Reemplazar NaN/None por cadenas vacías
-    df_combined = df_combined.fillna('')
-    return df_rdf, df_combined, None, batch_queries if debug else None
+    if join.bindings_without_key == join.bindings_seen:
+        return (df_rdf, df_rdf,
+                f"La query de Wikidata no devuelve ?{join.join_variable}: no se puede unir con el RDF",
+                batch_queries if debug else None)
+
+    return df_rdf, join.frame(), None, batch_queries if debug else None
 
 # Definir las queries (10 queries)
 QUERIES = {
@@ -696,6 +801,51 @@ QUERIES = {
         ''',
         "input_var": "orgWikidata",
         "wikidata_var": "searchTerm"
+    },
+    9: {
+        "nombre": "Organizadores de actividades con aforo >= 100 (federada)",
+        "description": "La misma consulta que la Query 2 escrita una sola vez en SPARQL: la parte de Wikidata va en un bloque SERVICE y se resuelve con un bind join por batches",
+        "tipo": "federada",
+        "query": '''
+        PREFIX att: <http://data.barcelona.cat/att/>
+        PREFIX rel: <http://data.barcelona.cat/rel/>
+        PREFIX node: <http://data.barcelona.cat/node/>
+        PREFIX wdt: <http://www.wikidata.org/prop/direct/>
+
+        SELECT ?actividad ?titulo ?tipo ?aforo ?organizador ?orgWikidata ?nombreOrganizador ?tipoOrganizador
+        WHERE {
+          {
+            SELECT ?actividad ?titulo ?tipo ?aforo ?organizador ?orgWikidata
+            WHERE {
+              ?actividad a node:Actividad ;
+                        att:titulo ?titulo ;
+                        att:fechaInicio ?fechaInicio ;
+                        att:tipo ?tipo ;
+                        att:aforo ?aforo ;
+                        rel:isHosted ?organizador ;
+                        FILTER (?aforo >= 100) .
+              ?organizador owl:sameAs ?orgWikidata .
+            }
+            ORDER BY ?fechaInicio
+            LIMIT 80
+          }
+          # El enlace guardado es la página de Wikidata: se pasa a la URI de la entidad
+          BIND (IRI(CONCAT("http://www.wikidata.org/entity/", STRAFTER(STR(?orgWikidata), "/wiki/"))) AS ?entidad)
+
+          SERVICE <https://query.wikidata.org/sparql> {
+            # Obtiene el nombre del organizador
+            ?entidad rdfs:label ?nombreOrganizador .
+            FILTER (LANG(?nombreOrganizador) = "en")
+
+            # Obtiene el tipo de organizador (P31: instance of)
+            OPTIONAL {
+              ?entidad wdt:P31 ?claseOrganizador .
+              ?claseOrganizador rdfs:label ?tipoOrganizador .
+              FILTER (LANG(?tipoOrganizador) = "en")
+            }
+          }
+        }
+        '''
     }
 }
 
@@ -726,7 +876,7 @@ def main():
 
     # Cargar el grafo
     with st.spinner("Cargando datos del grafo RDF..."):
-        g, error = load_graph()
+        g, graph_version, error = load_graph()
 
     if error:
         st.error(f"Error al cargar el grafo: {error}")
@@ -736,6 +886,9 @@ def main():
         st.error("No se pudo cargar el grafo")
         st.stop()
 
+    get_federation()
+    start_warmup(g, graph_version)
+
     # Sidebar para selección de query
     with st.sidebar:
         # Selector con slider (compacto y elegante)
@@ -758,6 +911,8 @@ def main():
             st.session_state.query_num = 7
         if st.button("Query 8", use_container_width=True, type="primary" if st.session_state.query_num == 8 else "secondary"):
             st.session_state.query_num = 8
+        if st.button("Query 9", use_container_width=True, type="primary" if st.session_state.query_num == 9 else "secondary"):
+            st.session_state.query_num = 9
 
         
         query_num = st.session_state.query_num
@@ -765,6 +920,18 @@ def main():
         # Mostrar info de la query seleccionada
         st.info(f"**{QUERIES[query_num]['nombre']}**") 
 
+        # Estado de la caché de Wikidata
+        wikidata_cache = get_wikidata_executor().cache
+        if wikidata_cache is not None:
+            stats = wikidata_cache.stats()
+            st.caption(
+                f"Caché Wikidata: {stats['entries']} entidades, "
+                f"{stats['hits']} aciertos / {stats['misses']} fallos")
+        stats = get_result_cache().stats()
+        st.caption(
+            f"Caché de resultados: {stats['entries']} consultas, "
+            f"{stats['hits']} aciertos / {stats['misses']} fallos")
+
     # Contenido principal
     st.markdown(f"## Query {query_num}: {QUERIES[query_num]['nombre']}")
 
@@ -785,6 +952,8 @@ def main():
             st.code(query_config["query_wikidata"],
                     language="sparql", line_numbers=True)
     else:
+        if query_config.get("tipo") == "federada":
+            st.info("Esta es una query federada: el bloque SERVICE se envía a Wikidata por batches con los valores del RDF local")
         with st.container():
             st.code(query_config["query"],
                     language="sparql", line_numbers=True)
@@ -809,14 +978,33 @@ def main():
                 "Ejecutando query encadenada: RDF local → Wikidata")
             progress_bar.progress(20)
 
+            consultados = [0]
+            preview = st.empty()
+            last_preview = [0.0]
+
+            def on_batch(result, join):
+                consultados[0] += len(result.values)
+                total = len(join.keys)
+                progress_bar.progress(20 + int(70 * consultados[0] / total))
+                status_text.info(
+                    f"Consultando Wikidata: {consultados[0]} de {total} valores procesados, "
+                    f"{join.matched_rows} filas enriquecidas")
+                # Vista previa del resultado parcial, como mucho dos veces por segundo
+                if join.matched_rows and time.monotonic() - last_preview[0] > 0.5:
+                    last_preview[0] = time.monotonic()
+                    preview.dataframe(join.frame(limit=PREVIEW_ROWS), width="stretch")
+
             # Llamar a la función centralizada
             df_rdf, df_combined, error_msg, batch_info = execute_combined_query(
                 g,
                 query_config.get("query_rdf", ""),
                 query_config.get("query_wikidata", ""),
-                query_config.get("input_var", "titulo")
+                query_config.get("input_var", "titulo"),
+                on_batch=on_batch,
+                graph_version=graph_version
             )
 
+            preview.empty()
             progress_bar.progress(90)
 
             # Guardar resultados
@@ -849,7 +1037,7 @@ def main():
         else:
             # Ejecutar query simple
             with st.spinner("Ejecutando consulta SPARQL..."):
-                df, error = execute_query(g, query_config["query"])
+                df, error = execute_cached_query(g, graph_version, query_config["query"])
 
             if error:
                 st.error(f"Error al ejecutar la query: {error}")
@@ -901,47 +1089,8 @@ def main():
 
         st.markdown("<br>", unsafe_allow_html=True)
 
-        # Opciones de visualización RDF
-        view_option = st.radio(
-            "",
-            ["Tabla Interactiva", "JSON", "Datos Raw"],
-            horizontal=True,
-            key="view_rdf"
-        )
-
-        if view_option == "Tabla Interactiva":
-            st.dataframe(
-                df,
-                width="stretch",
-                height=min(500, (len(df) + 1) * 35 + 3)
-            )
-        elif view_option == "JSON":
-            st.json(df.to_dict(orient='records'))
-        else:
-            st.text(df.to_string())
-
-        # Botones de exportación RDF
-        col1, col2, col3 = st.columns([1, 1, 2])
-
-        with col1:
-            csv = df.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥   Descargar CSV",
-                data=csv,
-                file_name=f"query_{query_num}_rdf_{QUERIES[query_num]['nombre'].replace(' ', '_')}.csv",
-                mime="text/csv",
-                width="stretch"
-            )
-
-        with col2:
-            json_str = df.to_json(orient='records', indent=2)
-            st.download_button(
-                label="📥 Descargar JSON",
-                data=json_str,
-                file_name=f"query_{query_num}_rdf_{QUERIES[query_num]['nombre'].replace(' ', '_')}.json",
-                mime="application/json",
-                width="stretch"
-            )
+        file_stem = f"query_{query_num}_{{}}_{QUERIES[query_num]['nombre'].replace(' ', '_')}"
+        render_results(df, "rdf", file_stem.format("rdf"))
 
         # SEGUNDA TABLA: Datos Combinados (solo para queries combinadas)
         if es_combinada and st.session_state.resultados_combinados is not None:
@@ -987,48 +1136,7 @@ def main():
 
             st.markdown("<br>", unsafe_allow_html=True)
 
-            # Opciones de visualización Combinados
-            view_option_combined = st.radio(
-                "",
-                ["Tabla Interactiva", "JSON", "Datos Raw"],
-                horizontal=True,
-                key="view_combined"
-            )
-
-            if view_option_combined == "Tabla Interactiva":
-                st.dataframe(
-                    df_combined,
-                    width="stretch",
-                    height=min(500, (len(df_combined) + 1) * 35 + 3)
-                )
-            elif view_option_combined == "JSON":
-                st.json(df_combined.to_dict(orient='records'))
-            else:
-                st.text(df_combined.to_string())
-
-            # Botones de exportación Combinados
-            col1, col2, col3 = st.columns([1, 1, 2])
-
-            with col1:
-                csv_combined = df_combined.to_csv(index=False).encode('utf-8')
-                st.download_button(
-                    label="📥 Descargar CSV",
-                    data=csv_combined,
-                    file_name=f"query_{query_num}_combinado_{QUERIES[query_num]['nombre'].replace(' ', '_')}.csv",
-                    mime="text/csv",
-                    width="stretch"
-                )
-
-            with col2:
-                json_str_combined = df_combined.to_json(
-                    orient='records', indent=2)
-                st.download_button(
-                    label="📥 Descargar JSON",
-                    data=json_str_combined,
-                    file_name=f"query_{query_num}_combinado_{QUERIES[query_num]['nombre'].replace(' ', '_')}.json",
-                    mime="application/json",
-                    width="stretch"
-                )
+            render_results(df_combined, "combined", file_stem.format("combinado"))
 
 
 if __name__ == "__main__":
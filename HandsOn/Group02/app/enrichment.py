@@ -0,0 +1,101 @@
+# Unión incremental de los resultados RDF con las respuestas de Wikidata
+#
+# En lugar de esperar a todos los batches y unir DataFrames completos
+# (concat + merge + drop_duplicates), las filas RDF se indexan una vez por la
+# variable de entrada y cada batch de Wikidata se incorpora en cuanto llega.
+# Solo se guarda la primera respuesta de cada entidad, así que la memoria
+# crece con el número de entidades enriquecidas, no con copias del resultado.
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Variable de las consultas de Wikidata que lleva la entidad consultada
+JOIN_VARIABLE = "searchTerm"
+WIKIDATA_PREFIX = "wd_"
+
+
+class StreamingJoin:
+    """
+    Inner join de `df_rdf` con los bindings de Wikidata sobre `input_variable`.
+    Cada fila RDF distinta aparece una vez, con los datos de la primera
+    respuesta de su entidad; las columnas de Wikidata llevan el prefijo wd_.
+    """
+
+    def __init__(self, df_rdf: pd.DataFrame, input_variable: str,
+                 normalize: Callable[[str], str] = str, join_variable: str = JOIN_VARIABLE):
+        self.df_rdf = df_rdf
+        self.input_variable = input_variable
+        self.join_variable = join_variable
+        self.normalize = normalize
+        self.bindings_seen = 0
+        self.bindings_without_key = 0
+
+        # Índice hash: valor de la variable de entrada -> posiciones de las filas
+        # RDF (las filas repetidas cuentan una sola vez)
+        unique_positions = np.flatnonzero(~df_rdf.duplicated().to_numpy())
+        keys = df_rdf[input_variable].to_numpy()[unique_positions]
+        self._rows_by_key: Dict[str, List[int]] = {}
+        for position, key in zip(unique_positions.tolist(), keys):
+            if isinstance(key, str) and key:
+                self._rows_by_key.setdefault(key, []).append(position)
+
+        self._values_by_key: Dict[str, Dict[str, str]] = {}
+        # Orden de las columnas: por batch y por orden de aparición dentro de él
+        self._column_rank: Dict[str, tuple] = {}
+        self._matched_rows = 0
+
+    @property
+    def keys(self) -> List[str]:
+        """Valores distintos de la variable de entrada, en el orden de las filas RDF"""
+        return list(self._rows_by_key)
+
+    @property
+    def matched_rows(self) -> int:
+        return self._matched_rows
+
+    @property
+    def matched_keys(self) -> int:
+        return len(self._values_by_key)
+
+    def add_batch(self, batch_num: int, bindings: List[dict]):
+        """Incorpora las respuestas de un batch (en cualquier orden de llegada)"""
+        rdf_columns = set(self.df_rdf.columns)
+        for binding in bindings:
+            self.bindings_seen += 1
+            term = binding.get(self.join_variable)
+            if term is None:
+                self.bindings_without_key += 1
+                continue
+
+            for i, name in enumerate(binding):
+                if name == self.join_variable:
+                    continue
+                column = WIKIDATA_PREFIX + name
+                # Si coincide con una columna RDF se queda la de RDF
+                if column not in rdf_columns:
+                    rank = (batch_num, i)
+                    if rank < self._column_rank.get(column, (float("inf"),)):
+                        self._column_rank[column] = rank
+
+            key = self.normalize(term.get("value", ""))
+            if key in self._values_by_key or key not in self._rows_by_key:
+                continue
+            self._values_by_key[key] = {
+                WIKIDATA_PREFIX + name: self.normalize(value.get("value", ""))
+                for name, value in binding.items() if name != self.join_variable
+            }
+            self._matched_rows += len(self._rows_by_key[key])
+
+    def frame(self, limit: Optional[int] = None) -> pd.DataFrame:
+        """Resultado combinado hasta el momento (las primeras `limit` filas, si se indica)"""
+        positions = sorted(
+            position for key in self._values_by_key for position in self._rows_by_key[key])
+        if limit is not None:
+            positions = positions[:limit]
+        keys = self.df_rdf[self.input_variable].to_numpy()[positions]
+
+        combined = self.df_rdf.iloc[positions].reset_index(drop=True)
+        for column in sorted(self._column_rank, key=self._column_rank.get):
+            combined[column] = [self._values_by_key[key].get(column, "") for key in keys]
+        return combined
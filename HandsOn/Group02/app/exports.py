@@ -0,0 +1,188 @@
+# Exportación de resultados a fichero, por tramos y en un hilo aparte
+#
+# Los resultados grandes (sobre todo los enriquecidos con Wikidata) no se
+# convierten de una vez en memoria: cada formato se escribe tramo a tramo en
+# un fichero de .cache/exports y el trabajo avanza en segundo plano mientras
+# la interfaz muestra el progreso. Al terminar, el fichero se descarga desde
+# disco.
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CACHE_DIR = Path(os.environ.get("GROUP02_CACHE_DIR", Path(__file__).resolve().parent / ".cache"))
+EXPORT_DIR = CACHE_DIR / "exports"
+CHUNK_ROWS = 10_000
+# Los ficheros exportados se borran pasado este tiempo (segundos)
+EXPORT_TTL = 3600
+
+# Formato -> (extensión, tipo MIME)
+FORMATS = {
+    "CSV": ("csv", "text/csv"),
+    "JSON": ("json", "application/json"),
+    "NDJSON": ("ndjson", "application/x-ndjson"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+    "Arrow IPC": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
+
+
+def _chunks(df, chunk_rows):
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def _write_csv(df, path, chunk_rows, advance):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(df.head(0).to_csv(index=False))
+        for chunk in _chunks(df, chunk_rows):
+            f.write(chunk.to_csv(index=False, header=False))
+            advance(len(chunk))
+
+
+def _write_ndjson(df, path, chunk_rows, advance):
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in _chunks(df, chunk_rows):
+            lines = chunk.to_json(orient="records", lines=True, force_ascii=False)
+            f.write(lines if lines.endswith("\n") else lines + "\n")
+            advance(len(chunk))
+
+
+def _write_json(df, path, chunk_rows, advance):
+    # Mismo contenido que df.to_json(orient='records', indent=2), escrito por tramos
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, chunk in enumerate(_chunks(df, chunk_rows)):
+            records = chunk.to_json(orient="records", indent=2).strip()[1:-1].strip("\n")
+            f.write(("," if i else "") + "\n" + records)
+            advance(len(chunk))
+        f.write("\n]" if len(df) else "]")
+
+
+def _arrow_tables(df, chunk_rows):
+    # El esquema se fija con el primer tramo para que todos los row groups coincidan
+    schema = None
+    for chunk in _chunks(df, chunk_rows):
+        table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+        schema = table.schema
+        yield table
+
+
+def _write_parquet(df, path, chunk_rows, advance):
+    writer = None
+    try:
+        for table in _arrow_tables(df, chunk_rows):
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            advance(table.num_rows)
+        if writer is None:
+            pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_arrow(df, path, chunk_rows, advance):
+    writer = None
+    try:
+        for table in _arrow_tables(df, chunk_rows):
+            if writer is None:
+                writer = pa.ipc.new_file(str(path), table.schema)
+            writer.write_table(table)
+            advance(table.num_rows)
+        if writer is None:
+            with pa.ipc.new_file(str(path), pa.Schema.from_pandas(df, preserve_index=False)):
+                pass
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+_WRITERS = {
+    "CSV": _write_csv,
+    "JSON": _write_json,
+    "NDJSON": _write_ndjson,
+    "Parquet": _write_parquet,
+    "Arrow IPC": _write_arrow,
+}
+
+
+class ExportJob:
+    """Una exportación en curso o terminada; la interfaz consulta su progreso"""
+
+    def __init__(self, df, fmt: str, file_stem: str, directory: Path = EXPORT_DIR,
+                 chunk_rows: int = CHUNK_ROWS):
+        extension, self.mime = FORMATS[fmt]
+        self.fmt = fmt
+        # El título solo es el nombre de la descarga: en disco puede tener
+        # caracteres no válidos (como ">" en Windows)
+        self.file_name = f"{file_stem}.{extension}"
+        self.path = Path(directory) / f"{uuid.uuid4().hex}.{extension}"
+        self.total_rows = len(df)
+        self.rows_written = 0
+        self.error: Optional[str] = None
+        self.seconds = 0.0
+        self._df = df
+        self._chunk_rows = chunk_rows
+        self._done = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def progress(self) -> float:
+        return self.rows_written / self.total_rows if self.total_rows else 1.0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def _advance(self, rows: int):
+        self.rows_written += rows
+
+    def run(self):
+        start = time.perf_counter()
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            _WRITERS[self.fmt](self._df, tmp, self._chunk_rows, self._advance)
+            tmp.replace(self.path)
+        except Exception as e:
+            self.error = str(e)
+            tmp.unlink(missing_ok=True)
+        finally:
+            # El DataFrame ya no hace falta: no se retiene mientras el trabajo siga en la sesión
+            self._df = None
+            self.seconds = time.perf_counter() - start
+            self._done.set()
+
+    def open(self):
+        return open(self.path, "rb")
+
+
+def _remove_old_exports(directory: Path):
+    if not directory.exists():
+        return
+    limit = time.time() - EXPORT_TTL
+    for old in directory.iterdir():
+        try:
+            if old.stat().st_mtime < limit:
+                old.unlink()
+        except OSError:
+            pass
+
+
+def start_export(df, fmt: str, file_stem: str, directory: Path = EXPORT_DIR) -> ExportJob:
+    """Lanza la exportación en el pool de exportaciones y devuelve el trabajo para seguirlo"""
+    _remove_old_exports(Path(directory))
+    job = ExportJob(df, fmt, file_stem, directory)
+    _executor.submit(job.run)
+    return job
@@ -0,0 +1,199 @@
+# Consultas federadas: SERVICE sobre el grafo local de rdflib
+#
+# rdflib resuelve SERVICE haciendo una petición HTTP por cada solución de la
+# parte local, de una en una y sin caché. Aquí se sustituye esa evaluación
+# (mediante CUSTOM_EVALS) por un bind join:
+#   1. se evalúa la parte local completa,
+#   2. los valores distintos de las variables compartidas con el SERVICE se
+#      envían al endpoint remoto en bloques VALUES, usando el ejecutor de
+#      wikidata.py (batches en paralelo, límite de ritmo, reintentos y caché
+#      por entidad),
+#   3. las respuestas se unen con las soluciones locales con una tabla hash.
+# Las partes que no son un SERVICE se dejan a rdflib.
+import asyncio
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from rdflib import BNode, Literal, URIRef, Variable
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.evaluate import evalPart
+from rdflib.plugins.sparql.sparql import FrozenBindings, SPARQLError
+
+from wikidata import WIKIDATA_ENDPOINT, WikidataBatchExecutor
+from wikidata_cache import WikidataCache
+
+PUBLIC_WIKIDATA_ENDPOINT = "https://query.wikidata.org/sparql"
+CUSTOM_EVAL_NAME = "group02_service_bind_join"
+
+_SERVICE = re.compile(r"^\s*SERVICE\s+(SILENT\s+)?<[^>]*>\s*\{(.*)\}\s*$", re.IGNORECASE | re.DOTALL)
+_PREFIXED_NAME = re.compile(r"(?<![\w<?$])([A-Za-z][\w-]*):")
+
+
+def term_from_json(term: dict):
+    """Término rdflib a partir de un valor de resultados SPARQL JSON"""
+    kind = term.get("type")
+    value = term.get("value", "")
+    if kind == "uri":
+        return URIRef(value)
+    if kind in ("literal", "typed-literal"):
+        datatype = term.get("datatype")
+        return Literal(value, datatype=URIRef(datatype) if datatype else None,
+                       lang=term.get("xml:lang"))
+    if kind == "bnode":
+        return BNode(value)
+    raise ValueError(f"Tipo de término desconocido en la respuesta: {kind!r}")
+
+
+def _encode_row(row) -> str:
+    """Fila del bloque VALUES: un término, o varios entre paréntesis"""
+    if isinstance(row, tuple):
+        return "(" + " ".join(term.n3() for term in row) + ")"
+    return row.n3()
+
+
+def _decode_term(term: dict) -> str:
+    return term_from_json(term).n3()
+
+
+class ServiceFederation:
+    """
+    Evaluación de SERVICE por bind join. Mantiene un ejecutor por endpoint
+    (cada uno aprende su propio tamaño de batch) y comparte la caché.
+    """
+
+    def __init__(self, cache: Optional[WikidataCache] = None,
+                 endpoints: Optional[Dict[str, str]] = None):
+        self.cache = cache
+        # Endpoint escrito en la query -> endpoint al que se llama de verdad (p. ej. un stub local)
+        self.endpoints = endpoints if endpoints is not None else {
+            PUBLIC_WIKIDATA_ENDPOINT: WIKIDATA_ENDPOINT}
+        self.remote_calls = 0
+        self._executors: Dict[str, WikidataBatchExecutor] = {}
+        self._lock = threading.Lock()
+
+    def executor(self, endpoint: str) -> WikidataBatchExecutor:
+        endpoint = self.endpoints.get(endpoint, endpoint)
+        with self._lock:
+            if endpoint not in self._executors:
+                self._executors[endpoint] = WikidataBatchExecutor(endpoint=endpoint, cache=self.cache)
+            return self._executors[endpoint]
+
+    def register(self):
+        CUSTOM_EVALS[CUSTOM_EVAL_NAME] = self.evaluate
+
+    def unregister(self):
+        if CUSTOM_EVALS.get(CUSTOM_EVAL_NAME) == self.evaluate:
+            del CUSTOM_EVALS[CUSTOM_EVAL_NAME]
+
+    def evaluate(self, ctx, part):
+        """Función para CUSTOM_EVALS: NotImplementedError deja la parte a rdflib"""
+        if part.name == "ServiceGraphPattern":
+            self._service_body(part)
+            return self._join(ctx, [ctx.solution()], part, optional=False)
+        if part.name in ("Join", "LeftJoin"):
+            if part.p2.name == "ServiceGraphPattern":
+                local, service = part.p1, part.p2
+            elif part.name == "Join" and part.p1.name == "ServiceGraphPattern":
+                local, service = part.p2, part.p1
+            else:
+                raise NotImplementedError()
+            if part.name == "LeftJoin" and part.expr.name != "TrueFilter":
+                # OPTIONAL { SERVICE ... FILTER } a nivel de la unión: se deja a rdflib
+                raise NotImplementedError()
+            # Se comprueba antes de evaluar la parte local, que ya no se podría devolver a rdflib
+            self._service_body(service)
+            return self._join(ctx, list(evalPart(ctx, local)), service,
+                              optional=part.name == "LeftJoin")
+        raise NotImplementedError()
+
+    @staticmethod
+    def _service_body(service) -> str:
+        match = _SERVICE.match(service.service_string or "")
+        if match is None or not isinstance(service.term, URIRef):
+            # SERVICE ?variable u otra forma que no se sabe reescribir
+            raise NotImplementedError()
+        return match.group(2)
+
+    def _remote_query(self, ctx, service, join_vars: List[Variable]) -> Tuple[str, str]:
+        """(endpoint, plantilla con {values}) para el cuerpo del SERVICE"""
+        body = self._service_body(service)
+
+        used = set(_PREFIXED_NAME.findall(body))
+        prefixes = "".join(
+            f"PREFIX {prefix}: <{namespace}>\n"
+            for prefix, namespace in ctx.prologue.namespace_manager.namespaces() if prefix in used)
+
+        if not join_vars:
+            values = ""
+        elif len(join_vars) == 1:
+            values = f"VALUES {join_vars[0].n3()} {{ {{values}} }}"
+        else:
+            values = f"VALUES ({' '.join(v.n3() for v in join_vars)}) {{ {{values}} }}"
+        return str(service.term), f"{prefixes}SELECT * WHERE {{\n{body}\n{values}\n}}"
+
+    def _join(self, ctx, solutions: List[FrozenBindings], service, optional: bool):
+        if not solutions:
+            return iter(())
+        service_vars = set(service._vars)
+        # Variables compartidas ligadas en todas las soluciones locales: van en VALUES
+        join_vars = sorted(
+            (v for v in service_vars if all(s.get(v) is not None for s in solutions)),
+            key=str)
+        endpoint, template = self._remote_query(ctx, service, join_vars)
+
+        if join_vars:
+            keys = list(dict.fromkeys(tuple(s[v] for v in join_vars) for s in solutions))
+            rows = [key[0] if len(key) == 1 else key for key in keys]
+        else:
+            rows = []
+
+        try:
+            remote = self._fetch(endpoint, template, rows, bool(join_vars))
+        except Exception:
+            if service.silent:
+                # SERVICE SILENT: un fallo equivale a una única solución vacía,
+                # así que las soluciones locales pasan tal cual
+                return iter(solutions)
+            raise
+
+        # Tabla hash por los valores de las variables de unión
+        by_key: Dict[tuple, List[dict]] = {}
+        for binding in remote:
+            terms = {Variable(name): term_from_json(term) for name, term in binding.items()}
+            by_key.setdefault(tuple(terms.get(v) for v in join_vars), []).append(terms)
+        # Las llamadas remotas ya se han hecho; la unión se entrega de forma perezosa
+        return self._merge(solutions, join_vars, by_key, optional)
+
+    @staticmethod
+    def _merge(solutions: List[FrozenBindings], join_vars: List[Variable],
+               by_key: Dict[tuple, List[dict]], optional: bool):
+        for solution in solutions:
+            matched = False
+            for terms in by_key.get(tuple(solution.get(v) for v in join_vars), ()):
+                # Resto de variables compartidas (ligadas solo en algunas soluciones)
+                if all(solution.get(v) in (None, t) for v, t in terms.items()):
+                    matched = True
+                    yield solution.merge(terms)
+            if optional and not matched:
+                yield solution
+
+    def _fetch(self, endpoint: str, template: str, rows: list, has_values: bool) -> List[dict]:
+        executor = self.executor(endpoint)
+        if not has_values:
+            # Nada que enviar: una sola llamada con el cuerpo tal cual
+            self.remote_calls += 1
+            data = asyncio.run(executor.query(template))
+            return data["results"]["bindings"]
+        if not rows:
+            return []
+        results = executor.run_sync(template, rows, encode=_encode_row, decode=_decode_term)
+        self.remote_calls += sum(1 for r in results if r.batch_num)
+        errors = [r.error for r in results if r.error]
+        if errors:
+            raise SPARQLError(f"SERVICE <{endpoint}>: {'; '.join(errors)}")
+        return [binding for result in results for binding in result.bindings]
+
+
+def uses_service(query: str) -> bool:
+    return re.search(r"\bSERVICE\b", query, re.IGNORECASE) is not None
@@ -0,0 +1,91 @@
+# Caché en disco (Parquet) de los resultados de las consultas al grafo local
+#
+# El grafo solo cambia si cambia el Turtle, así que un resultado queda
+# determinado por (hash del Turtle, texto de la consulta). Cada resultado se
+# guarda como un fichero Parquet con esa clave en el nombre: sobrevive a los
+# reinicios y, al cambiar el grafo, las entradas antiguas dejan de coincidir y
+# se borran en la siguiente escritura.
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+# Sube si cambia cómo se convierten los resultados a DataFrame
+RESULT_CACHE_FORMAT = 1
+
+
+class QueryResultCache:
+    """(versión del grafo, consulta) -> DataFrame, con un único cálculo por clave a la vez"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def key(graph_version: str, query: str) -> str:
+        normalized = " ".join(query.split())
+        digest = hashlib.sha256(f"{RESULT_CACHE_FORMAT}\n{normalized}".encode("utf-8")).hexdigest()
+        return f"{graph_version[:16]}-{digest[:24]}"
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.parquet"
+
+    def get(self, graph_version: str, query: str) -> Optional[pd.DataFrame]:
+        try:
+            df = pd.read_parquet(self._path(self.key(graph_version, query)))
+        except Exception:
+            # No está o el fichero está dañado: se vuelve a calcular
+            return None
+        self.hits += 1
+        return df
+
+    def put(self, graph_version: str, query: str, df: pd.DataFrame):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(self.key(graph_version, query))
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        df.to_parquet(tmp, index=False)
+        tmp.replace(path)
+        # Resultados de versiones anteriores del grafo
+        for old in self.directory.glob("*.parquet"):
+            if not old.name.startswith(graph_version[:16]):
+                old.unlink(missing_ok=True)
+
+    def get_or_compute(self, graph_version: str, query: str,
+                       compute: Callable[[], Tuple[pd.DataFrame, Optional[str]]]
+                       ) -> Tuple[pd.DataFrame, Optional[str]]:
+        """
+        Devuelve el resultado guardado o lo calcula con `compute`. Si otro hilo
+        ya lo está calculando (p. ej. el precalentamiento) espera a que termine
+        en lugar de repetir la consulta. Los errores no se guardan.
+        """
+        key = self.key(graph_version, query)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            df = self.get(graph_version, query)
+            if df is not None:
+                return df, None
+            self.misses += 1
+            df, error = compute()
+            if error is None:
+                try:
+                    self.put(graph_version, query, df)
+                except OSError:
+                    # Sin disco escribible: el resultado se devuelve igualmente
+                    pass
+            return df, error
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(list(self.directory.glob("*.parquet"))) if self.directory.exists() else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,145 @@
+# Visor de resultados paginado para la app de Streamlit
+#
+# En cada rerun solo se envía al navegador la página visible. El filtro y la
+# ordenación se calculan en el servidor sobre el DataFrame ya guardado en la
+# sesión y se recuerdan (como posiciones de fila) mientras no cambien, así que
+# cambiar de página no vuelve a filtrar ni a ordenar. Las descargas se generan
+# a petición, en segundo plano (ver exports.py), no en cada rerun.
+import math
+
+import numpy as np
+import streamlit as st
+
+from exports import FORMATS, start_export
+
+PAGE_SIZES = (25, 50, 100, 250, 500)
+ALL_COLUMNS = "Todas las columnas"
+NO_SORT = "Sin ordenar"
+VIEWS = ["Tabla Interactiva", "JSON", "Datos Raw"]
+
+
+def filter_and_sort(df, text="", column=None, sort_by=None, ascending=True):
+    """Posiciones de las filas que contienen `text` (en `column` o en cualquiera), en el orden pedido"""
+    positions = np.arange(len(df))
+    if text:
+        columns = [column] if column else list(df.columns)
+        mask = np.zeros(len(df), dtype=bool)
+        for col in columns:
+            mask |= df[col].astype(str).str.contains(text, case=False, regex=False).to_numpy()
+        positions = positions[mask]
+    if sort_by:
+        values = df[sort_by].iloc[positions].astype(str).reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind="stable").index.to_numpy()
+        positions = positions[order]
+    return positions
+
+
+def _view_positions(df, key, params):
+    """filter_and_sort con memoria en la sesión: se recalcula solo si cambian el resultado o los controles"""
+    signature = (id(df), len(df), params)
+    cached = st.session_state.get(f"{key}_positions")
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    positions = filter_and_sort(df, *params)
+    st.session_state[f"{key}_positions"] = (signature, positions)
+    return positions
+
+
+def _controls(df, key):
+    col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
+    with col1:
+        text = st.text_input("Filtrar", key=f"{key}_filter", placeholder="Texto a buscar")
+    with col2:
+        column = st.selectbox("En", [ALL_COLUMNS] + list(df.columns), key=f"{key}_filter_col")
+    with col3:
+        sort_by = st.selectbox("Ordenar por", [NO_SORT] + list(df.columns), key=f"{key}_sort")
+    with col4:
+        descending = st.toggle("Desc.", key=f"{key}_desc")
+    return (text.strip(),
+            None if column == ALL_COLUMNS else column,
+            None if sort_by == NO_SORT else sort_by,
+            not descending)
+
+
+def _pager(total, key):
+    col1, col2, col3 = st.columns([1, 1, 3])
+    with col1:
+        page_size = st.selectbox("Filas por página", PAGE_SIZES, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total / page_size))
+    # Si el filtro deja menos páginas, se vuelve a la última que exista
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    with col2:
+        page = st.number_input("Página", min_value=1, max_value=pages, step=1, key=page_key)
+    return (int(page) - 1) * page_size, page_size, pages
+
+
+def render_results(df, key, file_stem):
+    """Controles de filtro/orden, la página actual en la vista elegida y la exportación"""
+    params = _controls(df, key)
+    positions = _view_positions(df, key, params)
+    start, page_size, pages = _pager(len(positions), key)
+    page = df.iloc[positions[start:start + page_size]]
+
+    if len(positions) < len(df):
+        st.caption(f"{len(positions)} de {len(df)} filas coinciden con el filtro")
+    if len(page):
+        st.caption(f"Filas {start + 1}–{start + len(page)} de {len(positions)} · "
+                   f"página {start // page_size + 1} de {pages}")
+
+    view_option = st.radio("Vista", VIEWS, horizontal=True, key=f"view_{key}",
+                           label_visibility="collapsed")
+
+    if view_option == "Tabla Interactiva":
+        st.dataframe(
+            page,
+            width="stretch",
+            height=min(500, (len(page) + 1) * 35 + 3)
+        )
+    elif view_option == "JSON":
+        st.json(page.to_dict(orient='records'))
+    else:
+        st.text(page.to_string())
+
+    _export_panel(df, positions, key, file_stem)
+
+
+@st.fragment(run_every=0.5)
+def _export_progress(job):
+    """Se repinta sola mientras dura la exportación; al acabar recarga la página para ofrecer la descarga"""
+    if job.done:
+        st.rerun()
+    st.progress(job.progress,
+                text=f"Exportando {job.fmt}: {job.rows_written} de {job.total_rows} filas")
+
+
+def _export_panel(df, positions, key, file_stem):
+    """Exportación en segundo plano (ver exports.py) del resultado completo o de las filas filtradas"""
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        fmt = st.selectbox("Formato", list(FORMATS), key=f"{key}_export_fmt")
+    with col2:
+        only_filtered = st.checkbox("Solo las filas filtradas", key=f"{key}_export_filtered",
+                                    disabled=len(positions) == len(df))
+    with col3:
+        if st.button("📥 Preparar descarga", key=f"{key}_export_start"):
+            data = df.iloc[positions] if only_filtered else df
+            st.session_state[f"{key}_export"] = (id(df), start_export(data, fmt, file_stem))
+
+    source, job = st.session_state.get(f"{key}_export", (None, None))
+    if job is None or source != id(df):
+        # No hay exportación o es de un resultado anterior
+        return
+    if not job.done:
+        _export_progress(job)
+    elif job.error:
+        st.error(f"Error al exportar: {job.error}")
+    else:
+        st.download_button(
+            label=f"📥 Descargar {job.fmt} ({job.total_rows} filas, {job.seconds:.1f} s)",
+            data=job.open,
+            file_name=job.file_name,
+            mime=job.mime,
+            key=f"{key}_export_download"
+        )
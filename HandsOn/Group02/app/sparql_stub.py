@@ -0,0 +1,125 @@
+# Endpoint SPARQL local para probar las consultas a Wikidata sin salir a internet
+#
+# Uso:
+#   python app/sparql_stub.py --data datos.ttl --port 3232 --latency 0.3
+#   WIKIDATA_ENDPOINT=http://localhost:3232/sparql streamlit run app/app_streamlit.py
+#
+# Sirve un grafo rdflib por el protocolo SPARQL (GET/POST, resultados JSON) con
+# los prefijos de Wikidata ya declarados. Permite simular latencia, errores 503
+# y los timeouts de Wikidata cuando un bloque VALUES es demasiado grande.
+import argparse
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from rdflib import Graph, Namespace
+from rdflib.namespace import RDFS
+
+WIKIDATA_NS = {
+    "wd": Namespace("http://www.wikidata.org/entity/"),
+    "wdt": Namespace("http://www.wikidata.org/prop/direct/"),
+    "rdfs": RDFS,
+}
+_VALUES_BLOCK = re.compile(r"VALUES\s+\?\w+\s*\{([^}]*)\}", re.IGNORECASE)
+
+
+class StubState:
+    def __init__(self, graph, latency=0.0, fail_rate=0.0, max_values=None):
+        self.graph = graph
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.max_values = max_values
+        self.lock = threading.Lock()
+        # El parser SPARQL de rdflib (pyparsing) no es seguro entre hilos
+        self.query_lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self._answer(parse_qs(urlparse(self.path).query).get("query", [""])[0])
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+            if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+                self._answer(body)
+            else:
+                self._answer(parse_qs(body).get("query", [""])[0])
+
+        def _send(self, status, body, content_type="application/sparql-results+json"):
+            data = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _answer(self, query):
+            with state.lock:
+                state.requests += 1
+                state.in_flight += 1
+                state.max_in_flight = max(state.max_in_flight, state.in_flight)
+            try:
+                time.sleep(state.latency)
+                if random.random() < state.fail_rate:
+                    self._send(503, "Service Unavailable", "text/plain")
+                    return
+                block = _VALUES_BLOCK.search(query)
+                if state.max_values and block and len(block.group(1).split()) > state.max_values:
+                    self._send(500, "java.util.concurrent.TimeoutException", "text/plain")
+                    return
+                try:
+                    with state.query_lock:
+                        result = state.graph.query(query, initNs=WIKIDATA_NS)
+                        body = result.serialize(format="json").decode("utf-8")
+                except Exception as e:
+                    self._send(400, f"Query error: {e}", "text/plain")
+                    return
+                self._send(200, body)
+            finally:
+                with state.lock:
+                    state.in_flight -= 1
+
+    return Handler
+
+
+def serve(graph, port=3232, latency=0.0, fail_rate=0.0, max_values=None):
+    """Arranca el servidor en un hilo y devuelve (servidor, estado)"""
+    state = StubState(graph, latency, fail_rate, max_values)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Endpoint SPARQL local de prueba")
+    parser.add_argument("--data", help="Fichero RDF con los datos a servir")
+    parser.add_argument("--port", type=int, default=3232)
+    parser.add_argument("--latency", type=float, default=0.0, help="Segundos de espera por petición")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fracción de respuestas 503")
+    parser.add_argument("--max-values", type=int, help="Timeout simulado si VALUES supera este tamaño")
+    args = parser.parse_args()
+
+    graph = Graph()
+    if args.data:
+        graph.parse(args.data)
+    server, state = serve(graph, args.port, args.latency, args.fail_rate, args.max_values)
+    print(f"Endpoint SPARQL de prueba en http://127.0.0.1:{args.port}/sparql ({len(graph)} tripletas)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# Ejecución de las consultas a Wikidata por batches, en paralelo y con límite de ritmo
+#
+# Cada batch es una consulta con un bloque VALUES. Las consultas se lanzan en
+# hilos (SPARQLWrapper es bloqueante) coordinados desde asyncio:
+#   - un token bucket limita las peticiones por segundo,
+#   - un semáforo limita las peticiones en vuelo a la vez,
+#   - ambos son del ejecutor y valen para todo el proceso: las sesiones de
+#     Streamlit comparten el ejecutor y, cada una con su bucle asyncio, se
+#     reparten el mismo límite en vez de multiplicarlo,
+#   - el tamaño del batch se adapta a la latencia observada (AIMD): crece si
+#     las respuestas son rápidas y se reduce a la mitad ante un timeout,
+#   - los reintentos esperan con asyncio.sleep, sin bloquear a los demás.
+#
+# El endpoint se puede cambiar con WIKIDATA_ENDPOINT para probar contra un
+# servidor local (ver sparql_stub.py).
+import asyncio
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import urllib.error
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional
+
+from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError, QueryBadFormed
+
+from wikidata_cache import WikidataCache, binding_token, values_variable
+
+WIKIDATA_ENDPOINT = os.environ.get("WIKIDATA_ENDPOINT", "https://query.wikidata.org/sparql")
+USER_AGENT = "BarcelonaActivitiesExplorer/1.0"
+
+# Wikidata permite como mucho 5 consultas simultáneas por IP
+MAX_IN_FLIGHT = 3
+REQUESTS_PER_SECOND = 2.0
+BURST = 3
+QUERY_TIMEOUT = 30
+MAX_ATTEMPTS = 3
+
+BATCH_START = 10
+BATCH_MIN = 2
+BATCH_MAX = 50
+# Por debajo de esta latencia (segundos) el batch crece; por encima, se reduce
+TARGET_LATENCY = 4.0
+
+
+class TokenBucket:
+    """
+    Limitador de ritmo: `rate` peticiones por segundo con ráfagas de hasta
+    `capacity`. Bloqueante y seguro entre hilos: se llama desde el hilo que
+    hace la petición.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveBatchSize:
+    """Tamaño de batch con aumento aditivo y reducción multiplicativa"""
+
+    def __init__(self, start: int = BATCH_START, minimum: int = BATCH_MIN,
+                 maximum: int = BATCH_MAX, target_latency: float = TARGET_LATENCY):
+        self.size = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        # Lo actualizan los bucles asyncio de varias sesiones a la vez
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, values: int):
+        with self._lock:
+            # Solo crece si el batch estaba lleno: uno pequeño y rápido no dice nada
+            if seconds < self.target_latency and values >= self.size:
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+            elif seconds > 2 * self.target_latency:
+                self.size = max(self.minimum, self.size // 2)
+
+    def shrink(self):
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class RetryableError(Exception):
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def format_value(value) -> str:
+    """Valor para el bloque VALUES: entidades de Wikidata como wd:Q..., el resto como literal"""
+    v_str = str(value)
+    # Detectar URIs completas de Wikidata (http://www.wikidata.org/entity/Q...)
+    if 'wikidata.org/entity/' in v_str:
+        return f'wd:{v_str.split("/")[-1]}'
+    # Detectar QIDs ya acortados (Q seguido de números)
+    if re.match(r'^Q\d+$', v_str):
+        return f'wd:{v_str}'
+    # String normal, entrecomillar
+    escaped = v_str.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def build_batch_query(template: str, values, encode: Callable[[object], str] = format_value) -> str:
+    return template.replace("{values}", " ".join(encode(v) for v in values))
+
+
+def run_query(sparql_query: str, endpoint: str = WIKIDATA_ENDPOINT,
+              timeout: float = QUERY_TIMEOUT) -> dict:
+    """Un único intento, bloqueante. Clasifica los errores para decidir si se reintenta."""
+    sparql = SPARQLWrapper(endpoint)
+    sparql.setQuery(sparql_query)
+    sparql.setReturnFormat(JSON)
+    sparql.setTimeout(int(timeout))
+    sparql.addCustomHttpHeader("User-Agent", USER_AGENT)
+    try:
+        return sparql.query().convert()
+    except QueryBadFormed:
+        raise
+    except EndPointInternalError as e:
+        # Wikidata corta las consultas largas con un 500 y una TimeoutException
+        if "TimeoutException" in str(e):
+            raise QueryTimeout(str(e))
+        raise RetryableError(str(e))
+    except urllib.error.HTTPError as e:
+        if e.code in (429, 502, 503, 504):
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            raise RetryableError(f"HTTP {e.code}",
+                                 float(retry_after) if retry_after and retry_after.isdigit() else None)
+        raise
+    except (socket.timeout, TimeoutError) as e:
+        raise QueryTimeout(str(e) or "timed out")
+    except urllib.error.URLError as e:
+        if isinstance(e.reason, (socket.timeout, TimeoutError)):
+            raise QueryTimeout(str(e.reason))
+        raise RetryableError(str(e.reason))
+
+
+@dataclass
+class BatchResult:
+    batch_num: int
+    values: list
+    query: str
+    bindings: List[dict] = field(default_factory=list)
+    error: Optional[str] = None
+    attempts: int = 0
+    seconds: float = 0.0
+
+
+class WikidataBatchExecutor:
+    """
+    Ejecuta una plantilla con {values} sobre una lista de valores, repartidos
+    en batches que se lanzan en paralelo respetando el límite de ritmo.
+    """
+
+    def __init__(self, endpoint: str = WIKIDATA_ENDPOINT, max_in_flight: int = MAX_IN_FLIGHT,
+                 rate: float = REQUESTS_PER_SECOND, burst: int = BURST,
+                 timeout: float = QUERY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS,
+                 batch_size: Optional[AdaptiveBatchSize] = None,
+                 cache: Optional[WikidataCache] = None):
+        self.endpoint = endpoint
+        # Caché por entidad: solo los valores que no están se envían a Wikidata
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        # Se conserva entre ejecuciones: lo aprendido sobre la latencia se reutiliza
+        self.batch_size = batch_size or AdaptiveBatchSize()
+        # Límites de todo el proceso, para todas las ejecuciones y sesiones a la vez
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = threading.BoundedSemaphore(max_in_flight)
+
+    def _request(self, query: str) -> dict:
+        # En el hilo de la petición: primero un hueco, luego el turno de ritmo,
+        # para que el token no se gaste mientras se espera el hueco
+        with self.in_flight:
+            self.bucket.acquire()
+            return run_query(query, self.endpoint, self.timeout)
+
+    async def _attempt(self, query: str) -> dict:
+        return await asyncio.to_thread(self._request, query)
+
+    async def _run_batch(self, template: str, values: list, batch_num: int,
+                         encode: Callable[[object], str] = format_value) -> List[BatchResult]:
+        query = build_batch_query(template, values, encode)
+        result = BatchResult(batch_num, list(values), query)
+        backoff = 1.0
+        while True:
+            result.attempts += 1
+            start = time.perf_counter()
+            try:
+                data = await self._attempt(query)
+                result.seconds = time.perf_counter() - start
+                self.batch_size.observe(result.seconds, len(values))
+                result.bindings = data.get("results", {}).get("bindings", [])
+                result.error = None
+                return [result]
+            except QueryTimeout as e:
+                self.batch_size.shrink()
+                if len(values) > 1 and result.attempts < self.max_attempts:
+                    break
+                result.error = f"Timeout: {e}"
+            except RetryableError as e:
+                result.error = str(e)
+                if result.attempts < self.max_attempts:
+                    await asyncio.sleep(e.retry_after or backoff)
+                    backoff *= 2
+                    continue
+            except Exception as e:
+                result.error = str(e)
+            result.seconds = time.perf_counter() - start
+            return [result]
+
+        # Timeout: se divide el batch en dos mitades que se reintentan por separado
+        half = len(values) // 2
+        parts = await asyncio.gather(
+            self._run_batch(template, values[:half], batch_num, encode),
+            self._run_batch(template, values[half:], batch_num, encode),
+        )
+        return parts[0] + parts[1]
+
+    def _cache_batch(self, template_key: str, var: str, result: BatchResult,
+                     encode: Callable[[object], str], decode: Callable[[dict], str]):
+        """Reparte los bindings del batch entre sus valores y los guarda (también los vacíos)"""
+        by_token: Dict[str, List[dict]] = {}
+        for binding in result.bindings:
+            if var in binding:
+                by_token.setdefault(decode(binding[var]), []).append(binding)
+        self.cache.put_many(template_key, {
+            encode(v): by_token.get(encode(v), []) for v in result.values
+        })
+
+    async def run(self, template: str, values,
+                  on_batch: Optional[Callable[[BatchResult], None]] = None,
+                  encode: Callable[[object], str] = format_value,
+                  decode: Callable[[dict], str] = binding_token) -> List[BatchResult]:
+        """
+        Lanza todos los batches y devuelve sus resultados en orden de batch.
+        `on_batch` se llama con cada batch según va terminando. Los valores
+        resueltos desde la caché se devuelven juntos como batch 0.
+
+        `encode` escribe un valor en el bloque VALUES y `decode` lo reconstruye,
+        en la misma forma, a partir de un binding de la respuesta (así se
+        reparten los bindings entre los valores al guardarlos en la caché).
+        """
+        values = list(values)
+        results: List[BatchResult] = []
+
+        var = values_variable(template) if self.cache is not None else None
+        if var:
+            template_key = WikidataCache.template_key(template, self.endpoint)
+            tokens = {v: encode(v) for v in values}
+            found = self.cache.get_many(template_key, tokens.values())
+            cached_values = [v for v in values if tokens[v] in found]
+            values = [v for v in values if tokens[v] not in found]
+            if cached_values:
+                cached = BatchResult(0, cached_values, "(caché)", bindings=[
+                    binding for token in dict.fromkeys(tokens[v] for v in cached_values)
+                    for binding in found[token]
+                ])
+                results.append(cached)
+                if on_batch is not None:
+                    on_batch(cached)
+
+        pending = set()
+        position = 0
+        batch_num = 0
+
+        while position < len(values) or pending:
+            # Se forman los batches al lanzarlos, con el tamaño adaptado hasta ese momento
+            while position < len(values) and len(pending) < self.max_in_flight:
+                batch = values[position:position + self.batch_size.size]
+                position += len(batch)
+                batch_num += 1
+                pending.add(asyncio.create_task(
+                    self._run_batch(template, batch, batch_num, encode)))
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for result in task.result():
+                    if var and result.error is None:
+                        self._cache_batch(template_key, var, result, encode, decode)
+                    results.append(result)
+                    if on_batch is not None:
+                        on_batch(result)
+
+        results.sort(key=lambda r: r.batch_num)
+        return results
+
+    def run_sync(self, template: str, values,
+                 on_batch: Optional[Callable[[BatchResult], None]] = None,
+                 encode: Callable[[object], str] = format_value,
+                 decode: Callable[[dict], str] = binding_token) -> List[BatchResult]:
+        return asyncio.run(self.run(template, values, on_batch, encode, decode))
+
+    def stream(self, template: str, values) -> Iterator[BatchResult]:
+        """
+        Como run_sync, pero entrega cada batch en cuanto termina (en orden de
+        llegada). El bucle asyncio corre en un hilo aparte y pasa los batches
+        por una cola; si se deja de consumir, los batches pendientes terminan
+        igualmente y quedan en la caché.
+        """
+        results: "queue.Queue" = queue.Queue()
+        finished = object()
+
+        def worker():
+            try:
+                asyncio.run(self.run(template, values, on_batch=results.put))
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(finished)
+
+        threading.Thread(target=worker, name="wikidata-stream", daemon=True).start()
+        while True:
+            item = results.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def query(self, sparql_query: str) -> dict:
+        """Una consulta suelta con los mismos reintentos y límite de ritmo"""
+        results = await self._run_batch(sparql_query, [], 1)
+        if results[0].error:
+            raise RuntimeError(results[0].error)
+        return {"results": {"bindings": results[0].bindings}}
@@ -0,0 +1,148 @@
+# Caché persistente (SQLite) de las respuestas de Wikidata, por entidad consultada
+#
+# Cada consulta combinada pregunta a Wikidata por un bloque VALUES de entidades.
+# En lugar de guardar la respuesta del batch entero, se guardan los bindings de
+# cada entidad por separado (clave: plantilla + valor), así dos batches que se
+# solapan reutilizan las entradas comunes y solo se consultan las que faltan.
+# Las entidades sin resultados también se guardan (lista vacía).
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+CACHE_DIR = Path(os.environ.get("GROUP02_CACHE_DIR", Path(__file__).resolve().parent / ".cache"))
+CACHE_TTL = float(os.environ.get("WIKIDATA_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_ENTRIES = int(os.environ.get("WIKIDATA_CACHE_MAX_ENTRIES", "50000"))
+
+_VALUES_VAR = re.compile(r"VALUES\s+\?(\w+)", re.IGNORECASE)
+_SELECT_CLAUSE = re.compile(r"SELECT\s+(.*?)\s+WHERE", re.IGNORECASE | re.DOTALL)
+_WIKIDATA_ENTITY = "http://www.wikidata.org/entity/"
+
+
+def values_variable(template: str) -> Optional[str]:
+    """
+    Variable del bloque VALUES, solo si la consulta la devuelve: sin ella no se
+    puede saber a qué entidad pertenece cada binding y la plantilla no se cachea
+    """
+    values = _VALUES_VAR.search(template)
+    select = _SELECT_CLAUSE.search(template)
+    if not values or not select:
+        return None
+    var = values.group(1)
+    projection = select.group(1)
+    if projection.strip() != "*" and not re.search(rf"\?{var}\b", projection):
+        return None
+    return var
+
+
+def binding_token(term: dict) -> str:
+    """Valor de un binding en la misma forma que lo escribe format_value en el bloque VALUES"""
+    value = term.get("value", "")
+    if term.get("type") == "uri" and value.startswith(_WIKIDATA_ENTITY):
+        return f"wd:{value[len(_WIKIDATA_ENTITY):]}"
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+class WikidataCache:
+    """Entradas (plantilla, valor) -> bindings, con caducidad y límite de tamaño (LRU)"""
+
+    def __init__(self, path: Path = CACHE_DIR / "wikidata.sqlite", ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    template TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    bindings TEXT NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (template, value)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: Streamlit ejecuta cada sesión en su propio hilo
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def template_key(template: str, endpoint: str) -> str:
+        normalized = " ".join(template.split())
+        return hashlib.sha256(f"{endpoint}\n{normalized}".encode("utf-8")).hexdigest()[:32]
+
+    def get_many(self, template: str, tokens: Iterable[str]) -> Dict[str, List[dict]]:
+        """Bindings guardados y vigentes para los valores pedidos (los que falten no aparecen)"""
+        tokens = list(dict.fromkeys(tokens))
+        found: Dict[str, List[dict]] = {}
+        now = time.time()
+        with self._connect() as conn:
+            # Por tramos, para no pasar del límite de parámetros de SQLite
+            for i in range(0, len(tokens), 500):
+                chunk = tokens[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT value, bindings FROM entries WHERE template = ? AND created > ? "
+                    f"AND value IN ({','.join('?' * len(chunk))})",
+                    [template, now - self.ttl, *chunk]
+                ).fetchall()
+                for value, bindings in rows:
+                    found[value] = json.loads(bindings)
+            if found:
+                conn.executemany(
+                    "UPDATE entries SET accessed = ? WHERE template = ? AND value = ?",
+                    [(now, template, value) for value in found]
+                )
+        self.hits += len(found)
+        self.misses += len(tokens) - len(found)
+        return found
+
+    def put_many(self, template: str, entries: Dict[str, List[dict]]):
+        if not entries:
+            return
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (template, value, bindings, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(template, value, json.dumps(bindings), now, now)
+                 for value, bindings in entries.items()]
+            )
+            conn.execute("DELETE FROM entries WHERE created <= ?", (now - self.ttl,))
+            excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    "DELETE FROM entries WHERE rowid IN "
+                    "(SELECT rowid FROM entries ORDER BY accessed LIMIT ?)", (excess,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,227 @@
+# On-disk snapshot of the RDF graph for the SPARQL demo
+#
+# Parsing the Turtle files gets slower as the dataset grows, so they are parsed
+# only once into a binary snapshot of the indexed in-memory store. The snapshot
+# is named after a hash of the source files and rebuilt when they change; the
+# web app loads it in a background thread, so the server starts right away and
+# queries wait until the graph is ready.
+from pathlib import Path
+import gc
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+import rdflib
+from rdflib import Graph, Literal, URIRef
+
+# Bump when the snapshot layout changes
+STORE_FORMAT = 1
+# Seconds between two checks of the source files for changes
+SOURCE_CHECK_INTERVAL = 2.0
+
+
+def _uri(value):
+    # The URI was validated when the Turtle was parsed
+    return str.__new__(URIRef, value)
+
+
+def _literal(lexical, language, datatype, value, ill_typed):
+    # Rebuilt as it was stored, without parsing the lexical form again
+    literal = str.__new__(Literal, lexical)
+    literal._language = language
+    literal._datatype = datatype
+    literal._value = value
+    literal._ill_typed = ill_typed
+    return literal
+
+
+class _SnapshotPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if type(obj) is URIRef:
+            return _uri, (str(obj),)
+        if type(obj) is Literal:
+            return _literal, (str(obj), obj._language, obj._datatype, obj._value, obj._ill_typed)
+        return NotImplemented
+
+
+def source_stats(paths):
+    """(path, size, mtime) of every source file; cheap to compare on each request"""
+    stats = []
+    for path in paths:
+        try:
+            st = path.stat()
+            stats.append([str(path), st.st_size, st.st_mtime_ns])
+        except OSError:
+            stats.append([str(path), None, None])
+    return stats
+
+
+def source_fingerprint(paths):
+    """Hash of the source files' content (plus the snapshot format and rdflib version)"""
+    digest = hashlib.sha256(f"{STORE_FORMAT}\n{rdflib.__version__}\n".encode("utf-8"))
+    for path in paths:
+        digest.update(f"{path.name}\n".encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def build_snapshot(paths, snapshot_path):
+    """Parses the Turtle files and writes the snapshot; returns the graph"""
+    parsed = Graph()
+    for path in paths:
+        parsed.parse(path, format="turtle")
+
+    # The parser creates a new term object for every occurrence: with one object
+    # per distinct term the snapshot is smaller and faster to load
+    terms = {}
+    graph = Graph()
+    graph.addN(
+        (terms.setdefault(s, s), terms.setdefault(p, p), terms.setdefault(o, o), graph)
+        for s, p, o in parsed
+    )
+
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = snapshot_path.with_name(f"{snapshot_path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        _SnapshotPickler(f, protocol=pickle.HIGHEST_PROTOCOL).dump(graph)
+    tmp.replace(snapshot_path)
+    return graph
+
+
+def load_snapshot(snapshot_path):
+    with open(snapshot_path, "rb") as f:
+        return pickle.load(f)
+
+
+def open_snapshot(paths, directory, stats):
+    """
+    Graph for the current source files: loaded from the snapshot if there is one
+    for their content, built (and saved) otherwise. Returns (graph, version, rebuilt).
+    """
+    manifest_path = directory / "manifest.json"
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+
+    # Same sizes and modification times as last time: no need to hash the files again
+    if manifest.get("sources") == stats and manifest.get("version"):
+        version = manifest["version"]
+    else:
+        version = source_fingerprint(paths)
+    snapshot_path = directory / f"roadsafety-{version[:16]}.pickle"
+
+    graph = None
+    if snapshot_path.exists():
+        try:
+            graph = load_snapshot(snapshot_path)
+        except Exception:
+            # Damaged or written by another version of the code: rebuilt below
+            graph = None
+    rebuilt = graph is None
+    if rebuilt:
+        graph = build_snapshot(paths, snapshot_path)
+
+    try:
+        manifest_path.write_text(json.dumps({"version": version, "sources": stats}), encoding="utf-8")
+        for old in directory.glob("roadsafety-*.pickle"):
+            if old != snapshot_path:
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass
+    return graph, version, rebuilt
+
+
+class GraphStore:
+    """Graph loaded from the snapshot in the background, reloaded when the sources change"""
+
+    def __init__(self, sources, directory):
+        self.sources = [Path(p) for p in sources]
+        self.directory = Path(directory)
+        self.error = None
+        self.rebuilt = False
+        self.load_seconds = None
+        # (graph, version) swapped as a whole, so both always match
+        self._current = (None, None)
+        self._stats = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._loading = False
+        self._checked = 0.0
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def version(self):
+        return self._current[1]
+
+    @property
+    def num_triples(self):
+        graph = self._current[0]
+        return len(graph) if graph is not None else None
+
+    def start(self):
+        """Loads (or reloads) the graph in a background thread"""
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._load, name="graph-store", daemon=True).start()
+
+    def _load(self):
+        start = time.perf_counter()
+        stats = source_stats(self.sources)
+        try:
+            # Millions of new objects: the collector would scan them over and over
+            gc.disable()
+            try:
+                graph, version, rebuilt = open_snapshot(self.sources, self.directory, stats)
+            finally:
+                gc.enable()
+            old = self._current[0]
+            self._current = (graph, version)
+            self.rebuilt, self.error = rebuilt, None
+            if old is not None:
+                # The previous graph was frozen as well: hand it back to the collector
+                del old
+                gc.unfreeze()
+                gc.collect()
+            # The graph lives as long as the process; later collections skip it
+            gc.freeze()
+            print(f"Loaded triples: {len(graph)} "
+                  f"({'rebuilt' if rebuilt else 'from snapshot'}, {time.perf_counter() - start:.1f} s)")
+        except Exception as e:
+            # The previous graph (if any) keeps being served
+            self.error = str(e)
+            print(f"Could not load the RDF graph: {e}")
+        finally:
+            self._stats = stats
+            self.load_seconds = time.perf_counter() - start
+            with self._lock:
+                self._loading = False
+            self._ready.set()
+
+    def check_sources(self):
+        """Starts a reload if a source file changed (at most every SOURCE_CHECK_INTERVAL seconds)"""
+        now = time.monotonic()
+        if not self.ready or now - self._checked < SOURCE_CHECK_INTERVAL:
+            return
+        self._checked = now
+        if source_stats(self.sources) != self._stats:
+            self.start()
+
+    def current(self, timeout=None):
+        """(graph, version), waiting for the first load; (None, None) if it could not be loaded"""
+        self.check_sources()
+        self._ready.wait(timeout)
+        return self._current
+
+    def graph(self, timeout=None):
+        return self.current(timeout)[0]
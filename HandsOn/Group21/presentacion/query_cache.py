@@ -0,0 +1,125 @@
+# In-memory LRU cache of query results for the SPARQL demo
+#
+# Most POSTs are the canned examples, sent again and again. Results are kept
+# under a normalized form of the query text: comments, layout and keyword case
+# do not matter, and prefixed names are expanded with the query's own PREFIX
+# declarations, so the same query written with other prefixes still hits the
+# same entry. Entries belong to one version of the graph and are evicted, least
+# recently used first, when their estimated size exceeds the budget.
+from collections import OrderedDict
+import re
+import sys
+import threading
+
+_TOKEN = re.compile(r'''
+      (?P<space>\s+|\#[^\n]*)
+    | (?P<string>"""(?:[^"\\]|\\.|"(?!""))*"""|\'\'\'(?:[^'\\]|\\.|'(?!''))*\'\'\'
+                 |"(?:[^"\\\n]|\\.)*"|'(?:[^'\\\n]|\\.)*')
+    | (?P<iri><[^<>"{}|^`\\\s]*>)
+    | (?P<prefix>PREFIX\s+(?P<pname>[A-Za-z][\w.-]*)?:\s*<(?P<namespace>[^<>"{}|^`\\\s]*)>)
+    | (?P<var>[?$]\w+)
+    | (?P<bnode>_:\w+(?:[.-]+\w+)*)
+    | (?P<name>(?P<ns>[A-Za-z][\w.-]*)?:(?P<local>[\w:%-]+(?:\.+[\w:%-]+)*)?)
+    | (?P<number>\d*\.\d+(?:e[+-]?\d+)?|\d+(?:\.\d*)?e[+-]?\d+|\d+)
+    | (?P<word>\w+)
+    | (?P<other>.)
+''', re.VERBOSE | re.IGNORECASE | re.DOTALL)
+
+
+def normalize_query(query):
+    """
+    Tokens of the query separated by single spaces, without comments or PREFIX
+    declarations, with prefixed names written as full IRIs (undeclared
+    prefixes are left as they are) and keywords in upper case
+    """
+    namespaces = {}
+    tokens = []
+    for match in _TOKEN.finditer(query):
+        kind = match.lastgroup
+        text = match.group(0)
+        if kind == "space":
+            continue
+        if kind == "prefix":
+            namespaces[match.group("pname") or ""] = match.group("namespace")
+            continue
+        if kind == "name":
+            namespace = namespaces.get(match.group("ns") or "")
+            if namespace is not None:
+                text = f"<{namespace}{match.group('local') or ''}>"
+        elif kind in ("word", "number") and text != "a":
+            # 'a' is the only case-sensitive keyword
+            text = text.upper()
+        tokens.append(text)
+    return " ".join(tokens)
+
+
+def result_size(headers, rows):
+    """Rough size in bytes of a result (lists and strings)"""
+    size = sys.getsizeof(headers) + sum(sys.getsizeof(h) for h in headers) + sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(cell) for cell in row)
+    return size
+
+
+class ResultCache:
+    """(graph version, normalized query) -> (headers, rows, ...), LRU within `max_bytes`"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _switch_version(self, version):
+        # Results computed on another graph are of no use any more
+        if version != self._version:
+            self._entries.clear()
+            self.bytes = 0
+            self._version = version
+
+    def get(self, version, query):
+        """
+        Cached (headers, rows, seconds, truncated) or None; `seconds` is what the
+        query took to run, `truncated` whether rows were left out by the row cap
+        """
+        key = normalize_query(query)
+        with self._lock:
+            self._switch_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[:4]
+
+    def put(self, version, query, headers, rows, seconds, truncated=False):
+        size = result_size(headers, rows)
+        if size > self.max_bytes:
+            # It would push everything else out
+            return
+        key = normalize_query(query)
+        with self._lock:
+            self._switch_version(version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[4]
+            self._entries[key] = (headers, rows, seconds, truncated, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted[4]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "mb": round(self.bytes / 2**20, 1),
+            "max_mb": round(self.max_bytes / 2**20, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else None,
+        }
@@ -0,0 +1,200 @@
+# Query execution in worker processes for the SPARQL demo
+#
+# rdflib evaluates queries in pure Python while holding the GIL, so a single
+# heavy query (an unbounded ?s ?p ?o cross join, say) used to block the whole
+# Flask process. Queries now run in worker processes forked from the web
+# process once the graph is loaded: they share its memory copy-on-write
+# (read-only, nothing is copied up front) and run on as many cores as there
+# are workers. A query that goes over its time limit has its worker killed and
+# a fresh one is forked for the next query.
+#
+# Rows come back as a stream of messages while the query is still running, so
+# the page can show the first rows early, and a worker stops after `max_rows`.
+import multiprocessing
+import signal
+import threading
+import time
+
+# Loaded here so that forked workers do not each import the SPARQL engine again
+import rdflib.plugins.sparql  # noqa: F401
+
+# Rows per message sent back by a worker; fewer if they take longer than FLUSH_SECONDS
+CHUNK_ROWS = 5000
+FLUSH_SECONDS = 0.2
+
+FORK_AVAILABLE = "fork" in multiprocessing.get_all_start_methods()
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class QueryError(Exception):
+    pass
+
+
+def _result_messages(graph, query, max_rows=None):
+    """
+    ("headers", [...]), then ("rows", [...]) chunks, then ("done", (seconds, truncated));
+    `truncated` tells whether there were more than `max_rows` rows
+    """
+    start = time.perf_counter()
+    results = graph.query(query)
+    yield "headers", [str(v) for v in results.vars]
+    chunk = []
+    sent = 0
+    truncated = False
+    flushed = time.perf_counter()
+    for r in results:
+        if max_rows is not None and sent + len(chunk) >= max_rows:
+            truncated = True
+            break
+        chunk.append([str(c) if c is not None else "" for c in r])
+        if len(chunk) >= CHUNK_ROWS or time.perf_counter() - flushed >= FLUSH_SECONDS:
+            yield "rows", chunk
+            sent += len(chunk)
+            chunk = []
+            flushed = time.perf_counter()
+    if chunk:
+        yield "rows", chunk
+    yield "done", (time.perf_counter() - start, truncated)
+
+
+def stream_in_process(graph, query, max_rows=None):
+    """Same messages as QueryWorkerPool.stream, computed in this process without a time limit"""
+    try:
+        yield from _result_messages(graph, query, max_rows)
+    except Exception as e:
+        raise QueryError(str(e)) from e
+
+
+def _serve(graph, conn):
+    """Worker loop: one query at a time, results sent back in chunks"""
+    # Ctrl+C in the terminal is for the web process, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            query, max_rows = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            for message in _result_messages(graph, query, max_rows):
+                conn.send(message)
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+
+class _Worker:
+    def __init__(self, context, graph, version):
+        self.version = version
+        self.conn, child_conn = context.Pipe()
+        # With fork the graph is not pickled: the child inherits the parent's memory
+        self.process = context.Process(target=_serve, args=(graph, child_conn),
+                                       name="sparql-worker", daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class QueryWorkerPool:
+    """
+    Up to `size` worker processes. Each query gets `timeout` seconds, counting the
+    wait for a free worker and the time spent waiting for its rows (not the time
+    the caller takes to consume them)
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.killed = 0
+        self._context = multiprocessing.get_context("fork")
+        self._idle = []
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._busy = 0
+
+    def _acquire(self, graph, version, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            raise QueryTimeout(f"all {self.size} query workers stayed busy for {timeout:g} s")
+        stale = []
+        worker = None
+        with self._lock:
+            self._busy += 1
+            while self._idle and worker is None:
+                candidate = self._idle.pop()
+                if candidate.version == version and candidate.process.is_alive():
+                    worker = candidate
+                else:
+                    # Forked before the graph was reloaded, or dead
+                    stale.append(candidate)
+        for candidate in stale:
+            candidate.kill()
+        if worker is None:
+            try:
+                worker = _Worker(self._context, graph, version)
+            except Exception:
+                self._release(None)
+                raise
+        return worker
+
+    def _release(self, worker):
+        with self._lock:
+            self._busy -= 1
+            if worker is not None:
+                self._idle.append(worker)
+        self._slots.release()
+
+    def stream(self, graph, version, query, max_rows=None, timeout=None):
+        """
+        Messages of the query (see _result_messages) computed by a worker;
+        QueryTimeout or QueryError on failure. Closing the generator early
+        cancels the query.
+        """
+        remaining = self.timeout if timeout is None else timeout
+        limit = remaining
+        waited = time.monotonic()
+        worker = self._acquire(graph, version, remaining)
+        remaining -= time.monotonic() - waited
+        healthy = False
+        try:
+            worker.conn.send((query, max_rows))
+            while True:
+                waited = time.monotonic()
+                if not worker.conn.poll(max(0.0, remaining)):
+                    raise QueryTimeout(f"query cancelled after {limit:g} s (time limit)")
+                remaining -= time.monotonic() - waited
+                kind, value = worker.conn.recv()
+                if kind == "error":
+                    healthy = True
+                    raise QueryError(value)
+                if kind == "done":
+                    # The worker is idle again even if the caller stops here
+                    healthy = True
+                yield kind, value
+                if kind == "done":
+                    return
+        except (EOFError, OSError) as e:
+            raise QueryError(f"the query worker stopped unexpectedly ({e})") from e
+        finally:
+            if healthy:
+                self._release(worker)
+            else:
+                # Still running, half-way through a reply or abandoned by the
+                # caller: stop it for good
+                worker.kill()
+                self.killed += 1
+                self._release(None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "busy": self._busy,
+                "processes": self._busy + len(self._idle),
+                "killed": self.killed,
+                "timeout": self.timeout,
+            }
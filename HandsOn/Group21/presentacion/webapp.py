@@ -1,16 +1,46 @@
-from flask import Flask, request, render_template_string
-from rdflib import Graph
+from flask import Flask, Response, request, stream_with_context
+from pathlib import Path
+import csv
+import io
 import json
+import os
+
+from graph_store import GraphStore
+from query_cache import ResultCache
+from query_workers import FORK_AVAILABLE, QueryWorkerPool, stream_in_process
 
 # ============================================================
 # 1) Load RDF graph (ontology + data WITH links)
 # ============================================================
-
-g = Graph()
-g.parse("ontology/roadsafety-ontology.ttl", format="turtle")
-g.parse("rdf/roadsafety-with-links.ttl", format="turtle")
-
-print(f"Loaded triples: {len(g)}")
+# The Turtle files are parsed once into a snapshot under .store/ (see
+# graph_store.py), rebuilt when they change and loaded in the background.
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SOURCES = [
+    BASE_DIR / "ontology" / "roadsafety-ontology.ttl",
+    BASE_DIR / "rdf" / "roadsafety-with-links.ttl",
+]
+STORE_DIR = Path(os.environ.get("ROADSAFETY_STORE_DIR", Path(__file__).resolve().parent / ".store"))
+
+store = GraphStore(SOURCES, STORE_DIR)
+# With the debug reloader this file also runs in the watcher process, which
+# never serves requests: only the serving process loads the graph
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    store.start()
+
+# Results of recent queries, keyed by the normalized query (see query_cache.py)
+RESULT_CACHE_MB = int(os.environ.get("ROADSAFETY_RESULT_CACHE_MB", "256"))
+result_cache = ResultCache(RESULT_CACHE_MB * 2**20)
+
+# Queries run in forked worker processes with a time limit (see query_workers.py).
+# Without fork (Windows) or with 0 workers they run in the web process, unbounded.
+QUERY_WORKERS = int(os.environ.get("ROADSAFETY_QUERY_WORKERS", os.cpu_count() or 1))
+QUERY_TIMEOUT = float(os.environ.get("ROADSAFETY_QUERY_TIMEOUT", "60"))
+query_pool = QueryWorkerPool(QUERY_WORKERS, QUERY_TIMEOUT) if FORK_AVAILABLE and QUERY_WORKERS > 0 else None
+
+# Results are cut at MAX_ROWS rows and shown PAGE_ROWS rows at a time
+MAX_ROWS = int(os.environ.get("ROADSAFETY_MAX_ROWS", "100000"))
+PAGE_ROWS = int(os.environ.get("ROADSAFETY_PAGE_ROWS", "500"))
 
 # Default query (accidents per district)
 DEFAULT_QUERY = """
@@ -502,6 +532,27 @@ HTML_TEMPLATE = """
     .results-card {
       max-height: 480px;
       overflow: auto;
+      display: flex;
+      flex-direction: column;
+    }
+
+    /* Sent after the rows (it needs the final count) but shown above them */
+    .results-card h2 {
+      order: -2;
+    }
+
+    .results-summary {
+      order: -1;
+    }
+
+    .results-summary form {
+      display: inline;
+    }
+
+    .results-summary button {
+      margin: 0 6px 8px 0;
+      padding: 3px 10px;
+      font-size: 0.78rem;
     }
   </style>
   <script>
@@ -523,7 +574,17 @@ HTML_TEMPLATE = """
       </div>
       <h1>Road Safety – SPARQL Demo</h1>
       <p>Ontology + RDF data for Madrid road safety, exposed as a local SPARQL playground.</p>
-      <p>Loaded triples: <strong>{{ num_triples }}</strong></p>
+      {% if num_triples is none %}
+        <p>Loaded triples: <strong>loading…</strong></p>
+      {% else %}
+        <p>Loaded triples: <strong>{{ num_triples }}</strong></p>
+      {% endif %}
+      <p>Result cache: {{ cache_stats.entries }} queries · {{ cache_stats.mb }} / {{ cache_stats.max_mb }} MB ·
+         {{ cache_stats.hits }} hits, {{ cache_stats.misses }} misses</p>
+      {% if worker_stats %}
+        <p>Query workers: {{ worker_stats.busy }} busy of {{ worker_stats.size }} ·
+           time limit {{ "%g"|format(worker_stats.timeout) }} s · {{ worker_stats.killed }} cancelled</p>
+      {% endif %}
     </header>
 
     <div class="layout">
@@ -558,18 +619,17 @@ HTML_TEMPLATE = """
       <!-- ABAJO: Results -->
       <div class="card results-card">
         <h2>Results</h2>
-        {% if headers %}
-          <p class="meta">Returned rows: {{ row_count }}</p>
+        {% if result %}
           <table>
             <thead>
               <tr>
-                {% for h in headers %}
+                {% for h in result.headers %}
                   <th>{{ h }}</th>
                 {% endfor %}
               </tr>
             </thead>
             <tbody>
-              {% for row in rows %}
+              {% for row in result.page_rows() %}
                 <tr>
                   {% for cell in row %}
                     <td title="{{ cell }}">{{ cell }}</td>
@@ -578,6 +638,42 @@ HTML_TEMPLATE = """
               {% endfor %}
             </tbody>
           </table>
+          {% set _ = result.finish() %}
+          <div class="results-summary">
+            {% if result.error %}
+              <p class="error"><strong>Error:</strong> {{ result.error }}</p>
+            {% endif %}
+            <p class="meta">
+              Returned rows: {{ result.row_count }}
+              {% if result.truncated %}(stopped at the limit of {{ max_rows }} rows){% endif %}
+              {% if result.row_count %}· showing {{ result.offset + 1 }}–{{ result.page_end }}{% endif %}
+              {% if result.cached %}
+                · <span class="badge">served from cache</span> (first run took {{ "%.2f"|format(result.seconds) }} s)
+              {% elif result.seconds is not none %}
+                · {{ "%.2f"|format(result.seconds) }} s
+              {% endif %}
+            </p>
+            {% if result.previous_cursor is not none %}
+              <form method="post">
+                <input type="hidden" name="query" value="{{ query_text }}">
+                <input type="hidden" name="cursor" value="{{ result.previous_cursor }}">
+                <button type="submit">◀ Previous {{ page_rows }}</button>
+              </form>
+            {% endif %}
+            {% if result.next_cursor is not none %}
+              <form method="post">
+                <input type="hidden" name="query" value="{{ query_text }}">
+                <input type="hidden" name="cursor" value="{{ result.next_cursor }}">
+                <button type="submit">Next {{ page_rows }} ▶</button>
+              </form>
+            {% endif %}
+            {% for fmt in ["csv", "json"] %}
+              <form method="post" action="{{ url_for('download', fmt=fmt) }}">
+                <input type="hidden" name="query" value="{{ query_text }}">
+                <button type="submit">Download {{ fmt | upper }}</button>
+              </form>
+            {% endfor %}
+          </div>
         {% else %}
           <p class="meta">
             No results yet. Pick an example above and click <strong>Run query</strong>.
@@ -591,41 +687,232 @@ HTML_TEMPLATE = """
 """
 
 # ============================================================
-# 3) Main view
+# 3) Query results: streamed pages, cursors and downloads
+# ============================================================
+# A result is read from the cache or, on a miss, streamed from the query worker:
+# the rows of the requested page are sent to the browser as they arrive, the
+# rest (up to MAX_ROWS) is collected for the cache, and the next pages are
+# served from there.
+
+def query_messages(graph, version, query_text):
+    """Messages of the query (see query_workers.py), from a worker if there is a pool"""
+    if query_pool is not None:
+        return query_pool.stream(graph, version, query_text, max_rows=MAX_ROWS)
+    return stream_in_process(graph, query_text, max_rows=MAX_ROWS)
+
+
+def make_cursor(version, offset):
+    return f"{version[:12]}.{offset}"
+
+
+def cursor_offset(cursor, version):
+    """Row offset of a pagination cursor; 0 if it is invalid or from another version of the graph"""
+    prefix, _, offset = (cursor or "").partition(".")
+    if prefix != version[:12] or not offset.isdigit():
+        return 0
+    return int(offset)
+
+
+class ResultPage:
+    """One page of a query result, produced while the template streams it"""
+
+    def __init__(self, graph, version, query_text, offset):
+        self.version = version
+        self.query_text = query_text
+        self.offset = offset
+        self.error = None
+        hit = result_cache.get(version, query_text)
+        self.cached = hit is not None
+        if self.cached:
+            self.headers, self.rows, self.seconds, self.truncated = hit
+            self._messages = None
+        else:
+            self.rows = []
+            self.seconds = None
+            self.truncated = False
+            self._messages = query_messages(graph, version, query_text)
+            # The headers come first: parse errors are reported before anything is sent
+            _, self.headers = next(self._messages)
+
+    def _pull(self):
+        """Reads the next message of a streamed result; False once it is over"""
+        if self._messages is None:
+            return False
+        try:
+            kind, value = next(self._messages)
+        except Exception as e:
+            # Time limit or a failure half-way: the rows received so far are kept
+            self.error = str(e)
+            self._messages = None
+            return False
+        if kind == "rows":
+            self.rows.extend(value)
+        elif kind == "done":
+            self.seconds, self.truncated = value
+            self._messages.close()
+            self._messages = None
+            result_cache.put(self.version, self.query_text, self.headers, self.rows,
+                             self.seconds, self.truncated)
+        return True
+
+    def page_rows(self):
+        """Rows of this page, each one as soon as it is available"""
+        position = self.offset
+        while position < self.offset + PAGE_ROWS:
+            if position < len(self.rows):
+                yield self.rows[position]
+                position += 1
+            elif not self._pull():
+                return
+
+    def chunks(self):
+        """Rows from the offset to the end, in lists of up to PAGE_ROWS, as they become available"""
+        position = self.offset
+        while True:
+            if position < len(self.rows):
+                chunk = self.rows[position:position + PAGE_ROWS]
+                position += len(chunk)
+                yield chunk
+            elif not self._pull():
+                return
+
+    def finish(self):
+        """Reads the rest of the result (for the count, the cache and the next pages)"""
+        while self._pull():
+            pass
+
+    @property
+    def row_count(self):
+        return len(self.rows)
+
+    @property
+    def page_end(self):
+        return min(self.offset + PAGE_ROWS, len(self.rows))
+
+    @property
+    def previous_cursor(self):
+        if self.offset == 0:
+            return None
+        return make_cursor(self.version, max(0, self.offset - PAGE_ROWS))
+
+    @property
+    def next_cursor(self):
+        if self.offset + PAGE_ROWS >= len(self.rows):
+            return None
+        return make_cursor(self.version, self.offset + PAGE_ROWS)
+
+
+# A query that fails half-way (time limit, worker error) still ends the file
+# well-formed, with a last row or object that holds the error under this name
+# ('#' cannot start a SPARQL variable, so it never clashes with a column)
+ERROR_MARKER = "#error"
+
+
+def _csv_stream(result):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(result.headers)
+    for chunk in result.chunks():
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if result.error is not None:
+        writer.writerow([ERROR_MARKER, result.error])
+    yield buffer.getvalue()
+
+
+def _json_stream(result):
+    # A JSON array with one object per row, written chunk by chunk
+    first = True
+    yield "["
+    for chunk in result.chunks():
+        if not chunk:
+            continue
+        text = ",\n".join(json.dumps(dict(zip(result.headers, row)), ensure_ascii=False) for row in chunk)
+        yield ("\n" if first else ",\n") + text
+        first = False
+    if result.error is not None:
+        yield ("\n" if first else ",\n") + json.dumps({ERROR_MARKER: result.error}, ensure_ascii=False)
+        first = False
+    yield "\n]\n" if not first else "]\n"
+
+
+DOWNLOADS = {
+    "csv": (_csv_stream, "text/csv"),
+    "json": (_json_stream, "application/json"),
+}
+
+
+@app.route("/results.<fmt>", methods=["GET", "POST"])
+def download(fmt):
+    """The whole result (up to MAX_ROWS rows) as CSV or JSON, streamed"""
+    if fmt not in DOWNLOADS:
+        return Response(f"Unknown format: {fmt}\n", status=404, mimetype="text/plain")
+    query_text = request.values.get("query", "")
+    graph, version = store.current()
+    if graph is None:
+        return Response(f"Could not load the RDF graph: {store.error}\n", status=503, mimetype="text/plain")
+
+    try:
+        # Same path as the page: a miss streams the rows as they arrive and
+        # leaves the complete result in the cache for the next pages
+        result = ResultPage(graph, version, query_text, 0)
+    except Exception as e:
+        return Response(f"Error: {e}\n", status=400, mimetype="text/plain")
+
+    write, mimetype = DOWNLOADS[fmt]
+    return Response(
+        stream_with_context(write(result)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=results.{fmt}"},
+    )
+
+# ============================================================
+# 4) Main view
 # ============================================================
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     # Default query text
     query_text = DEFAULT_QUERY
-    headers = []
-    rows = []
+    result = None
     error = None
 
     if request.method == "POST":
         query_text = request.form.get("query", "")
-        try:
-            results = g.query(query_text)
-            headers = [str(v) for v in results.vars]
-            for r in results:
-                rows.append([str(c) if c is not None else "" for c in r])
-        except Exception as e:
-            error = str(e)
-
-    return render_template_string(
-        HTML_TEMPLATE,
-        num_triples=len(g),
+        graph, version = store.current()
+        if graph is None:
+            error = f"Could not load the RDF graph: {store.error}"
+        else:
+            try:
+                offset = cursor_offset(request.form.get("cursor"), version)
+                result = ResultPage(graph, version, query_text, offset)
+            except Exception as e:
+                error = str(e)
+    else:
+        store.check_sources()
+
+    context = dict(
+        num_triples=store.num_triples,
         query_text=query_text,
-        headers=headers,
-        rows=rows,
-        row_count=len(rows),
+        result=result,
         error=error,
+        max_rows=MAX_ROWS,
+        page_rows=PAGE_ROWS,
+        cache_stats=result_cache.stats(),
+        worker_stats=query_pool.stats() if query_pool is not None else None,
         example_names=list(QUERY_EXAMPLES.keys()),
         examples_json=json.dumps(QUERY_EXAMPLES),
     )
+    app.update_template_context(context)
+    # Sent in pieces while the rows arrive, instead of rendered in one go
+    stream = app.jinja_env.from_string(HTML_TEMPLATE).stream(context)
+    stream.enable_buffering(64)
+    return Response(stream_with_context(stream), mimetype="text/html")
 
 # ============================================================
-# 4) Run the app
+# 5) Run the app
 # ============================================================
 
 if __name__ == "__main__":